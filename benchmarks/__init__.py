@@ -0,0 +1 @@
+"""Benchmarks of the render pipeline, run with asv (see asv.conf.json). """
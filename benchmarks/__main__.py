@@ -0,0 +1,88 @@
+"""
+Run the benchmarks without asv, e.g. "python -m benchmarks [pattern]".
+
+Each benchmark is timed in this process with timeit, after the same set-up
+asv would perform, and the best time per call is printed. Use asv to compare
+commits (see asv.conf.json).
+"""
+
+from importlib import import_module
+from itertools import product
+from os.path import dirname, abspath
+from os import listdir
+import subprocess
+import textwrap
+import inspect
+import timeit
+import sys
+import re
+
+
+def main(argv):
+    pattern = re.compile(argv[0] if argv else "")
+    for name, func, params in _benchmarks():
+        for args in params:
+            label = name + ("({})".format(", ".join(map(repr, args)))
+                            if args else "")
+            if pattern.search(label):
+                print("{:<72} {:>10}".format(label, _format(func(*args))))
+                sys.stdout.flush()
+
+
+def _benchmarks():
+    """Yield (name, timer, parameter combinations) of every benchmark."""
+    here = dirname(abspath(__file__))
+    for module_name in sorted(listdir(here)):
+        if not re.match(r"bench_\w+\.py$", module_name):
+            continue
+        module = import_module("benchmarks." + module_name[:-3])
+        for name, obj in sorted(vars(module).items()):
+            if name.startswith("timeraw_"):
+                yield (module_name[:-3] + "." + name,
+                       lambda f=obj: _time_raw(f()), [()])
+            elif inspect.isclass(obj) and obj.__module__ == module.__name__:
+                params = getattr(obj, "params", [])
+                if params and not isinstance(params, tuple):
+                    params = (params,)
+                combos = list(product(*params)) if params else [()]
+                for method in sorted(m for m in dir(obj)
+                                     if m.startswith("time_")):
+                    yield ("{}.{}.{}".format(module_name[:-3], name, method),
+                           lambda *a, c=obj, m=method: _time(c, m, a), combos)
+
+
+def _time(cls, method, args):
+    """Best time per call of a benchmark method, in seconds."""
+    number = getattr(cls, "number", 0)
+    repeat = getattr(cls, "repeat", 5 if not number else 3)
+    times = []
+    for _ in range(repeat):
+        bench = cls()
+        bench.setup(*args)
+        try:
+            func = getattr(bench, method)
+            # like asv, call fast benchmarks enough times to take ~0.2 s
+            n = number or timeit.Timer(lambda: func(*args)).autorange()[0]
+            times.append(timeit.timeit(lambda: func(*args), number=n) / n)
+        finally:
+            bench.teardown(*args)
+    return min(times)
+
+
+def _time_raw(code, repeat=5):
+    """Best time of running `code` in a fresh interpreter, in seconds."""
+    cmd = [sys.executable, "-c", "import time; t = time.perf_counter(); "
+           "exec({!r}); print(time.perf_counter() - t)".format(
+               textwrap.dedent(code))]
+    return min(float(subprocess.check_output(cmd)) for _ in range(repeat))
+
+
+def _format(seconds):
+    for unit, scale in (("s", 1), ("ms", 1e-3), ("us", 1e-6)):
+        if seconds >= scale:
+            return "{:.3g} {}".format(seconds / scale, unit)
+    return "{:.3g} ns".format(seconds / 1e-9)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,71 @@
+"""Stages of wbplot.dscalar, rendered by the stand-in wb_command. """
+
+from .common import Benchmark, random_dscalars
+from wbplot import dscalar, constants
+from wbplot.wbplot import _check_dscalar_args, _show_scene, _write_dscalars
+from wbplot.utils import images, plots, workspaces
+from os.path import join, split
+import shutil
+
+
+class DscalarStages(Benchmark):
+    """Each stage of rendering a bilateral dense map."""
+
+    def setup(self):
+        super().setup()
+        self.dscalars = random_dscalars()
+        _, self.scene, self.width, self.height = _check_dscalar_args(
+            self.dscalars, 'landscape', None, 'magma')
+        self.workspace = workspaces.render_workspace(constants.DSCALAR_FILE)
+        self.render_dir = self.workspace.__enter__()
+        self.scene_file = _write_dscalars(
+            self.render_dir, self.dscalars, 'magma', None)
+        self.temp_cifti = join(
+            self.render_dir, split(constants.DSCALAR_FILE)[1])
+        self.png = self.path("image.png")
+        _show_scene(
+            self.scene_file, self.scene, self.png, self.width, self.height)
+        self.opaque = self.path("opaque.png")
+        shutil.copyfile(self.png, self.opaque)
+
+    def teardown(self):
+        self.workspace.__exit__(None, None, None)
+        super().teardown()
+
+    def time_check_args(self):
+        _check_dscalar_args(self.dscalars, 'landscape', None, 'magma')
+
+    def time_write_dense_image(self):
+        images.write_dense_image(self.dscalars, self.temp_cifti)
+
+    def time_write_dense_image_palette_params(self):
+        images.write_dense_image(
+            self.dscalars, self.temp_cifti, palette_params={
+                'pos-user': (0, 2), 'neg-user': (0, -2), 'disp-zero': True})
+
+    def time_show_scene(self):
+        _show_scene(
+            self.scene_file, self.scene, self.png, self.width, self.height)
+
+    def time_make_transparent(self):
+        shutil.copyfile(self.opaque, self.png)
+        plots.make_transparent(self.png)
+
+
+class Dscalar(Benchmark):
+    """End-to-end calls of wbplot.dscalar."""
+
+    params = (['workbench', 'numpy'], [False, True])
+    param_names = ['backend', 'transparent']
+
+    def setup(self, backend, transparent):
+        super().setup()
+        self.dscalars = random_dscalars()
+        dscalar(None, self.dscalars, backend=backend)  # warm the caches
+
+    def time_dscalar_file(self, backend, transparent):
+        dscalar(self.path("image.png"), self.dscalars, backend=backend,
+                transparent=transparent)
+
+    def time_dscalar_array(self, backend, transparent):
+        dscalar(None, self.dscalars, backend=backend, transparent=transparent)
@@ -0,0 +1,17 @@
+"""Cost of importing wbplot in a fresh interpreter. """
+
+
+def timeraw_import_wbplot():
+    return "import wbplot"
+
+
+def timeraw_import_rendering_functions():
+    return "import wbplot; wbplot.pscalar, wbplot.dscalar"
+
+
+def timeraw_import_dependencies():
+    return """
+    import wbplot
+    from wbplot.utils import images, plots
+    images.nib.load, plots.cm.ScalarMappable, plots.Image.open
+    """
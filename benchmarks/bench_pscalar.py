@@ -0,0 +1,108 @@
+"""Stages of wbplot.pscalar, rendered by the stand-in wb_command. """
+
+from .common import Benchmark, random_pscalars, clear_template_caches
+from wbplot import pscalar, constants
+from wbplot.wbplot import _check_pscalar_args, _show_scene, _write_pscalars
+from wbplot.utils import images, plots, workspaces, colormaps
+from os.path import join, split
+import shutil
+
+
+class PscalarStages(Benchmark):
+    """Each stage of rendering a bilateral parcellated map."""
+
+    def setup(self):
+        super().setup()
+        self.pscalars = random_pscalars()
+        _, _, self.scene, self.width, self.height = _check_pscalar_args(
+            self.pscalars, 'landscape', None, 'magma')
+        self.cifti = images.Cifti()
+        self.cifti.set_cmap(self.pscalars, cmap='magma')
+        self.workspace = workspaces.render_workspace(constants.DLABEL_FILE)
+        self.render_dir = self.workspace.__enter__()
+        self.scene_file = _write_pscalars(
+            self.render_dir, self.pscalars, 'magma', None)
+        self.temp_cifti = join(
+            self.render_dir, split(constants.DLABEL_FILE)[1])
+        self.png = self.path("image.png")
+        _show_scene(
+            self.scene_file, self.scene, self.png, self.width, self.height)
+        self.opaque = self.path("opaque.png")
+        shutil.copyfile(self.png, self.opaque)
+
+    def teardown(self):
+        self.workspace.__exit__(None, None, None)
+        super().teardown()
+
+    def time_check_args(self):
+        _check_pscalar_args(self.pscalars, 'landscape', None, 'magma')
+
+    def time_cifti_template_warm(self):
+        images.Cifti()
+
+    def time_set_cmap(self):
+        self.cifti.set_cmap(self.pscalars, cmap='magma')
+
+    def time_cifti_save(self):
+        self.cifti.save(self.temp_cifti)
+
+    def time_write_parcellated_image(self):
+        images.write_parcellated_image(
+            self.pscalars, self.temp_cifti, cmap='magma')
+
+    def time_show_scene(self):
+        _show_scene(
+            self.scene_file, self.scene, self.png, self.width, self.height)
+
+    def time_make_transparent(self):
+        shutil.copyfile(self.opaque, self.png)
+        plots.make_transparent(self.png)
+
+
+class Colormap(Benchmark):
+    """Mapping parcel scalars to colors through a colormap's lookup table."""
+
+    params = (colormaps.NORMS, [1, 100])
+    param_names = ['norm', 'maps']
+
+    def setup(self, norm, maps):
+        super().setup()
+        self.pscalars = random_pscalars(None if maps == 1 else maps)
+        colormaps.map_colors(self.pscalars, 'magma', norm=norm)
+
+    def time_map_colors(self, norm, maps):
+        colormaps.map_colors(self.pscalars, 'magma', norm=norm)
+
+
+class PscalarTemplateCold(Benchmark):
+    """Loading the DLABEL template, with nothing cached in memory."""
+
+    number = 1
+    repeat = 10
+
+    def setup(self):
+        super().setup()
+        clear_template_caches()
+
+    def time_cifti_template_cold(self):
+        images.Cifti()
+
+
+class Pscalar(Benchmark):
+    """End-to-end calls of wbplot.pscalar."""
+
+    params = (['workbench', 'numpy'], [False, True])
+    param_names = ['backend', 'transparent']
+
+    def setup(self, backend, transparent):
+        super().setup()
+        self.pscalars = random_pscalars()
+        pscalar(None, self.pscalars, backend=backend)  # warm the caches
+
+    def time_pscalar_file(self, backend, transparent):
+        pscalar(self.path("image.png"), self.pscalars, backend=backend,
+                transparent=transparent)
+
+    def time_pscalar_array(self, backend, transparent):
+        pscalar(None, self.pscalars, backend=backend, transparent=transparent)
+
@@ -0,0 +1,81 @@
+"""End-to-end throughput of batch and parallel rendering. """
+
+from .common import Benchmark, random_pscalars, random_dscalars
+from wbplot import (pscalar, dscalar, pscalar_batch, dscalar_batch,
+                    render_many, render_many_async, RenderPlan)
+import asyncio
+
+# Number of maps rendered by each benchmark
+N_MAPS = 16
+
+
+class Batch(Benchmark):
+    """wbplot.pscalar_batch and wbplot.dscalar_batch, per batch of maps."""
+
+    params = ['workbench', 'numpy']
+    param_names = ['backend']
+
+    def setup(self, backend):
+        super().setup()
+        self.pscalars = random_pscalars(N_MAPS)
+        self.dscalars = random_dscalars(N_MAPS)
+        self.files = [self.path("{}.png".format(i)) for i in range(N_MAPS)]
+        pscalar(None, self.pscalars[0], backend=backend)  # warm the caches
+        dscalar(None, self.dscalars[0], backend=backend)
+
+    def time_pscalar_batch(self, backend):
+        pscalar_batch(self.files, self.pscalars, backend=backend)
+
+    def time_dscalar_batch(self, backend):
+        dscalar_batch(self.files, self.dscalars, backend=backend)
+
+    def time_pscalar_loop(self, backend):
+        for file_out, x in zip(self.files, self.pscalars):
+            pscalar(file_out, x, backend=backend)
+
+
+class Plan(Benchmark):
+    """Rendering a batch of maps through one wbplot.RenderPlan."""
+
+    params = (['pscalars', 'dscalars'], ['workbench', 'numpy'])
+    param_names = ['data', 'backend']
+
+    def setup(self, data, backend):
+        super().setup()
+        self.maps = random_pscalars(N_MAPS) if data == 'pscalars' else (
+            random_dscalars(N_MAPS))
+        self.files = [self.path("{}.png".format(i)) for i in range(N_MAPS)]
+        self.plan = RenderPlan(data, backend=backend)
+        self.plan.render(self.maps[0])  # warm the caches & workspace
+
+    def teardown(self, data, backend):
+        self.plan.close()
+        super().teardown()
+
+    def time_render_plan(self, data, backend):
+        for file_out, x in zip(self.files, self.maps):
+            self.plan.render(x, file_out)
+
+
+class Parallel(Benchmark):
+    """wbplot.render_many and wbplot.render_many_async, per batch of maps."""
+
+    params = (['pscalars', 'dscalars'], [1, 4])
+    param_names = ['data', 'workers']
+
+    def setup(self, data, workers):
+        super().setup()
+        maps = random_pscalars(N_MAPS) if data == 'pscalars' else (
+            random_dscalars(N_MAPS))
+        self.jobs = [{'file_out': self.path("{}.png".format(i)), data: x}
+                     for i, x in enumerate(maps)]
+        render_many(self.jobs[:1])  # warm the caches
+
+    def time_render_many(self, data, workers):
+        results = render_many(self.jobs, max_workers=workers)
+        assert all(r.ok for r in results)
+
+    def time_render_many_async(self, data, workers):
+        results = asyncio.run(render_many_async(
+            self.jobs, max_concurrency=workers))
+        assert all(r.ok for r in results)
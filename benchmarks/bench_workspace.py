@@ -0,0 +1,46 @@
+"""Extraction of the scene workspace and set-up of render directories. """
+
+from .common import Benchmark
+from wbplot import constants, config
+from wbplot.utils import workspaces
+import tempfile
+import shutil
+
+
+class WorkspaceCold(Benchmark):
+    """Materializing the scene workspace in an empty cache directory."""
+
+    number = 1
+    repeat = 10
+
+    def setup(self):
+        super().setup()
+        config.CACHE_DIR = tempfile.mkdtemp(prefix="wbplot-bench-cache-")
+        workspaces._workspaces.clear()
+
+    def teardown(self):
+        shutil.rmtree(config.CACHE_DIR, ignore_errors=True)
+        workspaces._workspaces.clear()
+        super().teardown()
+
+    def time_get_workspace_cold(self):
+        workspaces.get_workspace()
+
+
+class Workspace(Benchmark):
+    """Finding the cached workspace, and making a render directory in it."""
+
+    def setup(self):
+        super().setup()
+        workspaces.get_workspace()
+
+    def time_get_workspace_warm(self):
+        workspaces.get_workspace()
+
+    def time_render_workspace_dlabel(self):
+        with workspaces.render_workspace(constants.DLABEL_FILE):
+            pass
+
+    def time_render_workspace_dscalar(self):
+        with workspaces.render_workspace(constants.DSCALAR_FILE):
+            pass
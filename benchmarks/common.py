@@ -0,0 +1,96 @@
+"""Shared set-up for the benchmarks: a stand-in wb_command and scene file. """
+
+from wbplot import config, constants
+from wbplot.utils import templates, images
+from os.path import join, exists, dirname, abspath, relpath
+from os import walk, makedirs
+from zipfile import ZipFile
+import numpy as np
+import tempfile
+import shutil
+
+# Executable which stands in for Connectome Workbench's wb_command; it writes
+# a fixed image of the requested size, so the suite runs without Workbench
+FAKE_WB_COMMAND = join(dirname(abspath(__file__)), "fake_wb", "wb_command")
+
+# Directory in which workspaces and rasterized views are cached between
+# benchmarks, so that only the benchmarks of cold starts pay for them
+CACHE_DIR = join(tempfile.gettempdir(), "wbplot-benchmarks")
+
+# Settings of wbplot.config which the benchmarks override
+_SETTINGS = ['CACHE_DIR', 'WB_COMMAND', 'SCENE_ZIP_FILE', 'PARCEL_IMAGES',
+             'RESULT_CACHE']
+
+
+def scene_zip():
+    """
+    Get the scene zip file to render with, building a stand-in for it in
+    CACHE_DIR if wbplot.config.SCENE_ZIP_FILE does not exist.
+
+    The stand-in holds an empty scene file and the surfaces and parcellation of
+    the package's data directory, like the real archive. The fake wb_command
+    does not read the scene, so only the cost of setting up workspaces depends
+    on its contents.
+
+    """
+    if exists(config.SCENE_ZIP_FILE):
+        return config.SCENE_ZIP_FILE
+    zip_file = join(CACHE_DIR, "scene.zip")
+    if not exists(zip_file):
+        makedirs(CACHE_DIR, exist_ok=True)
+        temp = zip_file + ".tmp"
+        with ZipFile(temp, "w") as z:
+            z.writestr("Human.scene", "<SceneFile/>\n")
+            for root, _, names in walk(config.PARCELLATIONS_DIR):
+                for name in sorted(names):
+                    path = join(root, name)
+                    z.write(path, relpath(path, constants.DATA_DIR))
+        shutil.move(temp, zip_file)
+    return zip_file
+
+
+def random_pscalars(n=None, seed=0):
+    """Random parcel scalar values, of shape (360,) or (n, 360)."""
+    shape = 360 if n is None else (n, 360)
+    return np.random.default_rng(seed).standard_normal(shape)
+
+
+def random_dscalars(n=None, seed=0):
+    """Random dense scalar values, of shape (59412,) or (n, 59412)."""
+    shape = 59412 if n is None else (n, 59412)
+    return np.random.default_rng(seed).standard_normal(shape)
+
+
+class Benchmark:
+    """
+    Base class of the benchmarks, which point wbplot at the fake wb_command
+    and a cache directory of their own, and restore its configuration after.
+
+    Renders go through Workbench (i.e. the fake) unless a benchmark sets
+    PARCEL_IMAGES, and never through the result cache.
+    """
+
+    def setup(self, *params):
+        self._config = {name: getattr(config, name) for name in _SETTINGS}
+        config.CACHE_DIR = CACHE_DIR
+        config.WB_COMMAND = FAKE_WB_COMMAND
+        config.SCENE_ZIP_FILE = scene_zip()
+        config.PARCEL_IMAGES = False
+        config.RESULT_CACHE = False
+        self.tmpdir = tempfile.mkdtemp(prefix="wbplot-bench-")
+
+    def teardown(self, *params):
+        for name, value in self._config.items():
+            setattr(config, name, value)
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+    def path(self, name):
+        """Absolute path to a file in this benchmark's scratch directory."""
+        return join(self.tmpdir, name)
+
+
+def clear_template_caches():
+    """Forget every template file loaded by this process."""
+    templates.clear_templates()
+    images._label_tables.clear()
+    images._cifti_writers.clear()
@@ -0,0 +1,227 @@
+import stat
+import threading
+
+import numpy as np
+import pytest
+from PIL import Image, ImageSequence
+
+from wbplot import config, movie
+from wbplot.utils import animation
+
+
+def _frames(n=3, shape=(6, 9, 4)):
+    """Frames which differ in color, with a transparent corner."""
+    frames = []
+    for i in range(n):
+        frame = np.zeros(shape, dtype=np.uint8)
+        frame[..., i % 3] = 255
+        if shape[2] == 4:
+            frame[..., 3] = 255
+            frame[0, 0, 3] = 0
+        frames.append(frame)
+    return frames
+
+
+def _write(fname, frames, fps=10, loop=0):
+    with animation.open_writer(fname, fps, loop) as writer:
+        for frame in frames:
+            writer.write(frame)
+    return writer
+
+
+@pytest.mark.parametrize("ext", [".png", ".apng"])
+def test_apng(tmp_path, ext):
+    fname = str(tmp_path / ("movie" + ext))
+    frames = _frames(4)
+    assert _write(fname, frames, fps=4, loop=3).frames == 4
+    with Image.open(fname) as im:
+        assert im.format == "PNG"
+        assert im.n_frames == 4
+        assert im.info["loop"] == 3
+        for frame, decoded in zip(frames, ImageSequence.Iterator(im)):
+            assert decoded.info["duration"] == 250
+            np.testing.assert_array_equal(
+                np.asarray(decoded.convert("RGBA")), frame)
+
+
+def test_apng_encoded_frames(tmp_path):
+    fname = str(tmp_path / "movie.png")
+    frames = _frames(2, shape=(5, 7, 3))
+    with animation.open_writer(fname) as writer:
+        for frame in [writer.encode(f) for f in frames]:
+            writer.write(frame)
+    with Image.open(fname) as im:
+        assert im.n_frames == 2
+        im.seek(1)
+        np.testing.assert_array_equal(
+            np.asarray(im.convert("RGB")), frames[1])
+
+
+def test_gif(tmp_path):
+    fname = str(tmp_path / "movie.gif")
+    frames = _frames(3)
+    assert _write(fname, frames, fps=20, loop=2).frames == 3
+    with Image.open(fname) as im:
+        assert im.format == "GIF"
+        assert im.n_frames == 3
+        assert im.info["loop"] == 2
+        for frame, decoded in zip(frames, ImageSequence.Iterator(im)):
+            assert decoded.info["duration"] == 50
+            rgba = np.asarray(decoded.convert("RGBA"))
+            assert rgba[0, 0, 3] == 0  # transparency is kept
+            np.testing.assert_array_equal(rgba[1:, 1:], frame[1:, 1:])
+
+
+@pytest.mark.parametrize("ext", [".png", ".gif"])
+def test_frame_with_wrong_shape(tmp_path, ext):
+    fname = str(tmp_path / ("movie" + ext))
+    with animation.open_writer(fname) as writer:
+        writer.write(_frames(1)[0])
+        with pytest.raises(ValueError, match="shape"):
+            writer.write(_frames(1, shape=(7, 9, 4))[0])
+    assert writer.frames == 1
+    with Image.open(fname) as im:
+        assert im.n_frames == 1
+
+
+def test_invalid_arguments(tmp_path):
+    with pytest.raises(ValueError):
+        animation.open_writer(str(tmp_path / "movie.png"), fps=0)
+    with pytest.raises(ValueError):
+        animation.open_writer(str(tmp_path / "movie.png"), loop=-1)
+
+
+def _script(path, body):
+    path.write_text("#!/bin/sh\n" + body)
+    path.chmod(path.stat().st_mode | stat.S_IEXEC)
+    return str(path)
+
+
+def test_ffmpeg(tmp_path, monkeypatch):
+    # a stand-in ffmpeg which saves its arguments and input
+    log, raw = tmp_path / "args.txt", tmp_path / "frames.raw"
+    monkeypatch.setattr(config, "FFMPEG", _script(
+        tmp_path / "ffmpeg", 'echo "$@" > {}\ncat > {}\n'.format(log, raw)))
+    fname = str(tmp_path / "movie.mp4")
+    frames = _frames(2, shape=(5, 7, 3))
+    assert _write(fname, frames, fps=12).frames == 2
+    args = log.read_text().split()
+    assert args[args.index("-s") + 1] == "7x5"
+    assert args[args.index("-r") + 1] == "12"
+    assert args[args.index("-pix_fmt") + 1] == "rgb24"
+    assert args[-1] == fname
+    assert raw.read_bytes() == b"".join(f.tobytes() for f in frames)
+
+
+def test_ffmpeg_not_found(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, "FFMPEG", str(tmp_path / "no-ffmpeg"))
+    writer = animation.open_writer(str(tmp_path / "movie.mp4"))
+    with pytest.raises(RuntimeError, match="could not run ffmpeg"):
+        writer.write(_frames(1)[0])
+
+
+def test_ffmpeg_failure(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, "FFMPEG", _script(
+        tmp_path / "ffmpeg", 'cat > /dev/null\necho "bad codec" >&2\n'
+        'exit 3\n'))
+    with pytest.raises(RuntimeError, match="exit code 3: bad codec"):
+        _write(str(tmp_path / "movie.mp4"), _frames(2))
+
+
+def test_ffmpeg_exits_early(tmp_path, monkeypatch):
+    # ffmpeg exits without reading its input, e.g. on a bad output path
+    monkeypatch.setattr(config, "FFMPEG", _script(
+        tmp_path / "ffmpeg", 'echo "no such file" >&2\nexit 1\n'))
+    big = [np.zeros((512, 512, 4), dtype=np.uint8)] * 8
+    with pytest.raises(RuntimeError, match="no such file"):
+        _write(str(tmp_path / "movie.mp4"), big)
+
+
+class _StubRenderer:
+    """Renders the frame index into a pixel, counting frames in flight."""
+
+    def __init__(self, delay=0.01):
+        self.delay = delay
+        self.lock = threading.Lock()
+        self.running = self.max_running = self.started = 0
+        self.release = threading.Event()
+        self.release.set()
+
+    def __call__(self, series, index):
+        with self.lock:
+            self.started += 1
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+        self.release.wait()
+        threading.Event().wait(self.delay)
+        with self.lock:
+            self.running -= 1
+        image = np.zeros((2, 2, 3), dtype=np.uint8)
+        image[0, 0, 0] = index
+        return image
+
+
+def _stub_frames(monkeypatch, renderer, n_frames, max_workers, frames=None):
+    monkeypatch.setattr(movie.raster, "get_dense_renderer",
+                        lambda *args: None)
+    monkeypatch.setattr(movie, "_numpy_renderer", lambda *args: renderer)
+    return movie._frames(
+        np.zeros((n_frames, 59412)), range(n_frames) if frames is None
+        else frames, 1, 2, 2, 'magma', 'numpy', max_workers, None,
+        lambda image: image)
+
+
+def test_frames_in_order(monkeypatch):
+    renderer = _StubRenderer()
+    frames = [5, 0, 3, 3, 9]
+    rendered = _stub_frames(monkeypatch, renderer, 10, 3, frames)
+    assert [image[0, 0, 0] for image in rendered] == frames
+    assert renderer.max_running <= 3
+
+
+def test_frames_in_flight_are_bounded(monkeypatch):
+    renderer = _StubRenderer()
+    rendered = _stub_frames(monkeypatch, renderer, 50, 2)
+    next(rendered)
+    threading.Event().wait(0.2)  # let the workers run ahead
+    # at most 2 * max_workers frames are submitted ahead of the consumer
+    assert renderer.started <= 1 + 2 * 2
+    rendered.close()
+
+
+def test_frames_cancelled_when_closed(monkeypatch):
+    renderer = _StubRenderer()
+    rendered = _stub_frames(monkeypatch, renderer, 50, 2)
+    next(rendered)
+    renderer.release.clear()  # hold the running frames
+    threading.Timer(0.1, renderer.release.set).start()
+    rendered.close()  # cancels pending frames, waits for running ones
+    started = renderer.started
+    assert started < 50
+    assert renderer.running == 0
+    threading.Event().wait(0.1)
+    assert renderer.started == started
+
+
+def test_dscalar_movie(tmp_path, monkeypatch):
+    renderer = _StubRenderer(delay=0)
+    monkeypatch.setattr(movie.raster, "get_dense_renderer",
+                        lambda *args: None)
+    monkeypatch.setattr(movie, "_numpy_renderer", lambda *args: renderer)
+    series = np.zeros((4, 59412))
+    fname = str(tmp_path / "movie")
+    assert movie.dscalar_movie(
+        fname, series, fps=5, backend='numpy', max_workers=2) == 4
+    with Image.open(fname + ".png") as im:
+        assert im.n_frames == 4
+        assert im.info["duration"] == 200
+        im.seek(3)
+        assert np.asarray(im.convert("RGB"))[0, 0, 0] == 3
+
+
+def test_dscalar_frames_checks_series():
+    with pytest.raises(ValueError, match="59412"):
+        movie.dscalar_frames(np.zeros((3, 100)), backend='numpy')
+    with pytest.raises(ValueError, match="max_workers"):
+        movie.dscalar_frames(
+            np.zeros((3, 59412)), backend='numpy', max_workers=0)
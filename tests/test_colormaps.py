@@ -0,0 +1,91 @@
+import numpy as np
+import pytest
+
+from wbplot.utils import colormaps, images
+
+
+def test_map_colors_batch_matches_single_maps():
+    x = np.random.default_rng(0).normal(size=(3, 360))
+    for norm in colormaps.NORMS:
+        batch = colormaps.map_colors(np.abs(x), 'viridis', norm=norm)
+        for i in range(3):
+            np.testing.assert_array_equal(
+                batch[i], colormaps.map_colors(np.abs(x[i]), 'viridis',
+                                               norm=norm))
+
+
+def test_colorbar_range():
+    x = np.array([-1., 3., np.nan])
+    assert colormaps.colorbar_range(x) == (-1., 3.)
+    assert colormaps.colorbar_range(x, norm='symmetric') == (-3., 3.)
+    assert colormaps.colorbar_range((), (-1, 2), 'symmetric') == (-2., 2.)
+    with pytest.raises(ValueError, match="cannot be drawn"):
+        colormaps.colorbar_range(x, norm='log')
+    with pytest.raises(ValueError, match="norm must be one of"):
+        colormaps.colorbar_range(x, norm='nope')
+
+
+def test_set_cmap_calls_mappable_once_per_parcel():
+    calls = []
+
+    def mappable(value):
+        calls.append(value)
+        return 1., 0., 0., 1.
+
+    c = images.Cifti()
+    c.set_cmap(np.arange(360.), mappable=mappable)
+    assert len(calls) == 360
+
+
+def test_set_cmap_vectorized_mappable():
+    calls = []
+
+    def mappable(values):
+        calls.append(values)
+        return np.ones(values.shape + (4,))
+
+    c = images.Cifti()
+    c.set_cmap(np.arange(360.), mappable=mappable, vectorized=True)
+    assert len(calls) == 1
+    with pytest.raises(ValueError):
+        c.set_cmap(np.arange(360.), mappable=lambda v: v, vectorized=True)
+
+
+def test_set_cmap_norm():
+    x = np.linspace(-1, 3, 360)
+    c = images.Cifti()
+    c.set_cmap(x, cmap='RdBu_r', norm='symmetric')
+    symmetric = c.xml
+    c.set_cmap(x, cmap='RdBu_r', vrange=(-3, 3))
+    assert c.xml == symmetric
+    c.set_cmap(x, cmap='RdBu_r')
+    assert c.xml != symmetric
+
+
+def test_colormap_instances():
+    from matplotlib.colors import ListedColormap
+    from wbplot.utils import plots
+    cmap = ListedColormap([[0, 0, 0], [1, 0, 0], [0, 0, 1]], name='rgb')
+    assert plots.get_cmap(cmap) is cmap
+    assert plots.check_cmap_plt(cmap) is cmap
+    x = np.array([0., 0.5, 1.])
+    np.testing.assert_array_equal(colormaps.map_colors(x, cmap)[:, :3], [
+        [0, 0, 0], [1, 0, 0], [0, 0, 1]])
+    viridis = plots.get_cmap('viridis')
+    np.testing.assert_array_equal(
+        colormaps.get_lut(viridis), colormaps.get_lut('viridis'))
+    # modifying an instance changes its colors and its key
+    key = colormaps.cmap_key(cmap)
+    cmap.set_bad('white')
+    assert colormaps.cmap_key(cmap) != key
+    assert colormaps.cmap_key('viridis') == 'viridis'
+
+
+def test_set_cmap_colormap_instance():
+    from wbplot.utils import plots
+    x = np.linspace(0, 1, 360)
+    c = images.Cifti()
+    c.set_cmap(x, cmap=plots.get_cmap('viridis'))
+    xml = c.xml
+    c.set_cmap(x, cmap='viridis')
+    assert c.xml == xml
@@ -0,0 +1,29 @@
+import numpy as np
+import pytest
+
+from wbplot import compose
+
+
+def test_shared_colorbar_spans_unilateral_maps_as_drawn():
+    jobs = [dict(pscalars=np.linspace(1, 2, 180), hemisphere='left')] * 2
+    # the right hemisphere is drawn as zeros
+    assert compose._shared_colorbar(jobs) == {
+        'cmap': 'magma', 'vrange': (0., 2.)}
+
+
+def test_shared_colorbar_bilateral():
+    jobs = [dict(pscalars=np.linspace(-1, 2, 360), cmap='viridis')]
+    assert compose._shared_colorbar(jobs) == {
+        'cmap': 'viridis', 'vrange': (-1., 2.)}
+
+
+def test_shared_colorbar_requires_a_shared_range():
+    jobs = [dict(pscalars=np.linspace(1, 2, 360)),
+            dict(pscalars=np.linspace(1, 3, 360))]
+    with pytest.raises(ValueError):
+        compose._shared_colorbar(jobs)
+
+
+def test_montage_is_the_function():
+    import wbplot
+    assert wbplot.montage is compose.montage
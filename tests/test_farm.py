@@ -0,0 +1,212 @@
+import asyncio
+import threading
+
+import pytest
+
+from wbplot import aio, farm
+from wbplot.utils.workbench import WorkbenchError
+
+
+class _StubRenderer:
+    """
+    Stands in for pscalar and dscalar, counting jobs started and finished.
+    Jobs fail with their 'error' item, after failing with a WorkbenchError
+    'fails' times.
+    """
+
+    def __init__(self, delay=0.005):
+        self.delay = delay
+        self.lock = threading.Lock()
+        self.started = self.finished = self.running = self.max_running = 0
+        self.calls = dict()
+
+    def _start(self, file_out, fails=0, error=None, **job):
+        with self.lock:
+            self.started += 1
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+            self.calls[file_out] = self.calls.get(file_out, 0) + 1
+            attempt = self.calls[file_out]
+        if attempt <= fails:
+            raise WorkbenchError("attempt {} failed".format(attempt))
+        if error is not None:
+            raise error
+
+    def _finish(self):
+        with self.lock:
+            self.running -= 1
+            self.finished += 1
+
+    def __call__(self, **job):
+        try:
+            self._start(**job)
+            threading.Event().wait(self.delay)
+        finally:
+            self._finish()
+
+    async def render_async(self, **job):
+        try:
+            self._start(**job)
+            await asyncio.sleep(self.delay)  # a real future, not a no-op
+        finally:
+            self._finish()
+
+
+def _jobs(n, **job):
+    return [dict(job, file_out="{}.png".format(i), pscalars=i)
+            for i in range(n)]
+
+
+@pytest.fixture
+def renderer(monkeypatch):
+    renderer = _StubRenderer()
+    for module, suffix, attr in [(farm, "", "__call__"),
+                                 (aio, "_async", "render_async")]:
+        for func in ("pscalar", "dscalar"):
+            monkeypatch.setattr(module, func + suffix,
+                                getattr(renderer, attr))
+    return renderer
+
+
+def _render_many(jobs, max_workers, **kwargs):
+    return farm.render_many(jobs, max_workers=max_workers, **kwargs)
+
+
+def _render_many_async(jobs, max_workers, **kwargs):
+    return asyncio.run(aio.render_many_async(
+        jobs, max_concurrency=max_workers, **kwargs))
+
+
+@pytest.fixture(params=[_render_many, _render_many_async])
+def render_many(request):
+    return request.param
+
+
+def test_results_in_order(renderer, render_many):
+    progress = []
+    results = render_many(
+        _jobs(10), 3, progress=lambda *args: progress.append(args))
+    assert [r.index for r in results] == list(range(10))
+    assert [r.file_out for r in results] == [j["file_out"] for j in _jobs(10)]
+    assert all(r.ok and r.error is None and r.attempts == 1 for r in results)
+    assert [(done, total) for done, total, _ in progress] == [
+        (i, 10) for i in range(1, 11)]
+    assert sorted(r.index for _, _, r in progress) == list(range(10))
+    assert renderer.max_running <= 3
+
+
+def test_dscalar_jobs(renderer, render_many):
+    results = render_many([{"file_out": "a.png", "dscalars": 0}], 1)
+    assert results[0].ok and renderer.calls == {"a.png": 1}
+
+
+def test_errors_are_captured(renderer, render_many):
+    jobs = _jobs(4)
+    jobs[1]["error"] = ValueError("bad job")
+    jobs[2] = {"file_out": "2.png"}
+    jobs[3] = "3.png"
+    results = render_many(jobs, 2)
+    assert results[0].ok
+    assert isinstance(results[1].error, ValueError)
+    assert str(results[1].error) == "bad job"
+    assert not results[1].ok and results[1].file_out == "1.png"
+    assert "either 'pscalars' or 'dscalars'" in str(results[2].error)
+    assert isinstance(results[3].error, TypeError)
+    assert results[3].file_out is None
+
+
+def test_workbench_errors_are_retried(renderer, render_many):
+    jobs = _jobs(3)
+    jobs[0]["fails"] = 1
+    jobs[1]["fails"] = 3
+    jobs[2]["fails"] = 1
+    jobs[2]["error"] = ValueError("not retried")
+    results = render_many(jobs, 2, retries=2)
+    assert results[0].ok and results[0].attempts == 2
+    assert isinstance(results[1].error, WorkbenchError)
+    assert results[1].attempts == 3
+    assert isinstance(results[2].error, ValueError)
+    assert results[2].attempts == 2
+
+
+def test_back_pressure(renderer):
+    in_flight = []
+
+    def jobs():
+        for job in _jobs(40):
+            # jobs pulled from the generator but not yet finished
+            in_flight.append(len(in_flight) + 1 - renderer.finished)
+            yield job
+
+    results = farm.render_many(jobs(), max_workers=2, max_pending=3)
+    assert len(results) == 40 and all(r.ok for r in results)
+    # the next job is taken while waiting for one of max_pending to finish
+    assert max(in_flight) <= 3 + 1
+    assert renderer.max_running <= 2
+
+
+def test_back_pressure_async(renderer):
+    in_flight = []
+
+    def jobs():
+        for job in _jobs(40):
+            in_flight.append(len(in_flight) + 1 - renderer.finished)
+            yield job
+
+    results = _render_many_async(jobs(), 3)
+    assert len(results) == 40 and all(r.ok for r in results)
+    assert max(in_flight) <= 3 + 1
+    assert renderer.max_running <= 3
+
+
+def test_invalid_arguments():
+    with pytest.raises(ValueError, match="max_workers"):
+        farm.render_many([], max_workers=0)
+    with pytest.raises(ValueError, match="max_pending"):
+        farm.render_many([], max_workers=2, max_pending=1)
+    with pytest.raises(ValueError, match="executor"):
+        farm.render_many([], max_workers=1, executor='fiber')
+    with pytest.raises(ValueError, match="max_concurrency"):
+        _render_many_async([], 0)
+
+
+class _Stop(Exception):
+    pass
+
+
+def _stop(*args):
+    raise _Stop()
+
+
+def test_progress_error_cancels_pending_jobs(renderer):
+    with pytest.raises(_Stop):
+        farm.render_many(_jobs(50), max_workers=1, progress=_stop)
+    started = renderer.started
+    assert started < 50
+    threading.Event().wait(0.05)
+    assert renderer.started == started
+
+
+def test_progress_error_cancels_running_jobs_async(renderer):
+    with pytest.raises(_Stop):
+        _render_many_async(_jobs(50), 4, progress=_stop)
+    # the other running jobs were cancelled, not left to finish
+    assert renderer.started == renderer.finished
+    assert renderer.started < 50
+
+
+def test_cancel_async(renderer):
+    renderer.delay = 10
+
+    async def main():
+        task = asyncio.ensure_future(aio.render_many_async(
+            _jobs(20), max_concurrency=4))
+        while renderer.started < 4:
+            await asyncio.sleep(0.001)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(main())
+    assert renderer.started == renderer.finished == 4
+    assert renderer.running == 0
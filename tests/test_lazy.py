@@ -0,0 +1,62 @@
+import subprocess
+import sys
+from os.path import abspath, dirname
+
+import pytest
+
+import wbplot
+from wbplot.utils import lazy, profiling
+
+# Dependencies which importing wbplot must not import
+HEAVY = ['numpy', 'matplotlib', 'nibabel', 'PIL', 'scipy']
+
+
+def _run(code):
+    """Run Python `code` in a fresh interpreter, returning its output."""
+    return subprocess.run(
+        [sys.executable, "-c", code], check=True, capture_output=True,
+        text=True, cwd=dirname(dirname(abspath(__file__)))).stdout
+
+
+def _loaded(*statements):
+    """Heavy dependencies loaded by a fresh interpreter after `statements`."""
+    return _run("\n".join(statements + (
+        "import sys",
+        "print(sorted({{m.split('.')[0] for m in sys.modules}} & "
+        "set({!r})))".format(HEAVY),))).strip()
+
+
+def test_import_is_light():
+    assert _loaded("import wbplot") == "[]"
+    assert _loaded("import wbplot", "dir(wbplot)",
+                   "wbplot.config.PARCEL_IMAGES") == "[]"
+
+
+def test_dependencies_are_imported_on_first_use():
+    assert "numpy" in _loaded("import wbplot", "wbplot.pscalar")
+
+
+def test_public_names():
+    assert set(wbplot.__all__) <= set(dir(wbplot))
+    for name in wbplot._LAZY:
+        assert getattr(wbplot, name) is not None
+    with pytest.raises(AttributeError, match="no attribute 'nope'"):
+        wbplot.nope
+
+
+def test_lazy_module(monkeypatch):
+    monkeypatch.setattr(lazy, "_import_times", dict())
+    monkeypatch.delitem(sys.modules, "colorsys", raising=False)
+    module = lazy.lazy_import("colorsys")
+    assert isinstance(module, lazy.LazyModule)
+    assert "not loaded" in repr(module)
+    assert "colorsys" not in sys.modules
+    with wbplot.profile() as stats:
+        assert module.rgb_to_hsv(1., 0., 0.) == (0., 1., 1.)
+    assert "colorsys" in sys.modules and "(loaded)" in repr(module)
+    assert stats['import'].calls == 1
+    assert list(lazy.import_times()) == ["colorsys"]
+    # modules which are already imported are returned as they are
+    assert lazy.lazy_import("colorsys") is sys.modules["colorsys"]
+    assert lazy.lazy_import("sys") is sys
+    assert not profiling.recording()
@@ -0,0 +1,26 @@
+import pytest
+
+from wbplot.utils import palettes
+
+
+def test_colorbar_cmap():
+    assert palettes.colorbar_cmap("JET256") == "jet"
+    for palette in ("ROY-BIG-BL", "videen_style"):
+        with pytest.raises(ValueError, match="cannot draw a colorbar"):
+            palettes.colorbar_cmap(palette)
+
+
+MAPPING = (
+    "<ScaleMode></ScaleMode><PaletteName></PaletteName>"
+    "<DisplayPositiveData></DisplayPositiveData>"
+    "<DisplayNegativeData></DisplayNegativeData>"
+    "<DisplayZeroData></DisplayZeroData>"
+    "<UserScaleValues>-100 0 0 100</UserScaleValues>")
+
+
+def test_user_scale_values_round_trip():
+    params = {"pos-user": (1e-7, 1.5e12), "neg-user": (-2.5e-9, -1e15)}
+    mapping = palettes.palette_mapping(MAPPING, "magma", params)
+    written = palettes._get(mapping, "UserScaleValues").split()
+    assert [float(v) for v in written] == [-1e15, -2.5e-9, 1e-7, 1.5e12]
+    assert palettes._get(mapping, "ScaleMode") == "MODE_USER_SCALE"
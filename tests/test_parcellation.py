@@ -0,0 +1,169 @@
+import warnings
+
+import nibabel as nib
+import numpy as np
+import pytest
+
+from wbplot.utils import parcellation, templates
+
+# Grayordinates per parcel, and unlabeled grayordinates, of the test file
+PER_PARCEL = 3
+UNLABELED = 20
+
+
+def _write_dlabel(fname, keys):
+    """Write a DLABEL file of surface vertices with the given label keys."""
+    label_table = {int(k): ("parcel {}".format(k), (1., 0., 0., 1.))
+                   for k in np.unique(keys)}
+    header = (nib.cifti2.LabelAxis(["parcels"], [label_table]),
+              nib.cifti2.BrainModelAxis.from_mask(
+                  np.ones(len(keys), dtype=bool), name="CortexLeft"))
+    image = nib.Cifti2Image(
+        np.asarray(keys, dtype=np.float32)[None], header=header)
+    image.nifti_header.set_intent("ConnDenseLabel")
+    nib.save(image, fname)
+    return fname
+
+
+@pytest.fixture
+def dlabel(tmp_path):
+    # each parcel labels PER_PARCEL grayordinates; half of the unlabeled
+    # grayordinates have key 0, and half a key beyond the last parcel
+    keys = np.concatenate([
+        np.repeat(np.arange(1, 361), PER_PARCEL),
+        np.zeros(UNLABELED // 2), np.full(UNLABELED // 2, 361)])
+    keys = np.random.default_rng(0).permutation(keys)
+    fname = _write_dlabel(str(tmp_path / "test.dlabel.nii"), keys)
+    yield fname
+    parcellation._parcel_maps.pop(fname, None)
+    templates._templates.pop(fname, None)
+
+
+def _dscalars(dlabel, n_maps):
+    n = len(parcellation.get_parcel_map(dlabel).labels)
+    return np.random.default_rng(1).normal(size=(n_maps, n))
+
+
+def _expected(dscalars, dlabel, reduce):
+    labels = parcellation.get_parcel_map(dlabel).labels
+    return np.stack([reduce(dscalars[:, labels == i], axis=1)
+                     for i in range(360)], axis=1)
+
+
+def test_parcel_map(dlabel):
+    parcel_map = parcellation.get_parcel_map(dlabel)
+    assert parcel_map is parcellation.get_parcel_map(dlabel)
+    assert len(parcel_map.labels) == 360 * PER_PARCEL + UNLABELED
+    assert (parcel_map.labels == -1).sum() == UNLABELED
+    np.testing.assert_array_equal(parcel_map.counts, PER_PARCEL)
+    for i in (0, 254, 359):
+        indices = parcel_map.indices[
+            parcel_map.indptr[i]:parcel_map.indptr[i + 1]]
+        np.testing.assert_array_equal(
+            indices, np.flatnonzero(parcel_map.labels == i))
+
+
+def test_empty_parcel(tmp_path):
+    keys = np.repeat(np.delete(np.arange(1, 361), 4), 2)
+    fname = _write_dlabel(str(tmp_path / "empty.dlabel.nii"), keys)
+    with pytest.raises(RuntimeError, match=r"parcels \[4\]"):
+        parcellation.get_parcel_map(fname)
+
+
+@pytest.mark.parametrize("method, reduce", [
+    ("mean", np.mean), ("sum", np.sum), ("min", np.min), ("max", np.max)])
+def test_methods(dlabel, method, reduce):
+    dscalars = _dscalars(dlabel, 4)
+    pscalars = parcellation.dscalars_to_pscalars(
+        dscalars, method, fname=dlabel)
+    assert pscalars.shape == (4, 360)
+    np.testing.assert_allclose(
+        pscalars, _expected(dscalars, dlabel, reduce))
+    np.testing.assert_allclose(parcellation.dscalars_to_pscalars(
+        dscalars[2], method, fname=dlabel), pscalars[2])
+
+
+def test_invalid_arguments(dlabel):
+    dscalars = _dscalars(dlabel, 1)
+    with pytest.raises(ValueError, match="method"):
+        parcellation.dscalars_to_pscalars(dscalars, "median", fname=dlabel)
+    with pytest.raises(ValueError, match="dscalars must have shape"):
+        parcellation.dscalars_to_pscalars(dscalars[:, 1:], fname=dlabel)
+    with pytest.raises(ValueError, match="pscalars must have shape"):
+        parcellation.pscalars_to_dscalars(np.zeros(359), fname=dlabel)
+
+
+@pytest.mark.parametrize("method, reduce", [
+    ("mean", np.nanmean), ("sum", np.nansum), ("min", np.nanmin),
+    ("max", np.nanmax)])
+def test_only_numeric(dlabel, method, reduce):
+    parcel_map = parcellation.get_parcel_map(dlabel)
+    dscalars = _dscalars(dlabel, 2)
+    grayordinates = parcel_map.indices.reshape(360, PER_PARCEL)
+    dscalars[0, grayordinates[3, 0]] = np.nan
+    dscalars[0, grayordinates[4, 1]] = np.inf
+    dscalars[1, grayordinates[5, 2]] = -np.inf
+    dscalars[1, grayordinates[6]] = np.nan  # no finite values
+    dscalars[:, parcel_map.labels < 0] = np.nan  # unlabeled: ignored
+
+    pscalars = parcellation.dscalars_to_pscalars(
+        dscalars, method, only_numeric=True, fname=dlabel)
+    finite = np.where(np.isfinite(dscalars), dscalars, np.nan)
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)  # all-NaN parcel
+        expected = _expected(finite, dlabel, reduce)
+    expected[1, 6] = np.nan
+    np.testing.assert_allclose(pscalars, expected)
+    assert np.isnan(pscalars).sum() == 1
+
+    # otherwise, non-finite values propagate
+    pscalars = parcellation.dscalars_to_pscalars(dscalars, method,
+                                                 fname=dlabel)
+    assert np.isnan(pscalars[0, 3]) and np.isnan(pscalars[1, 6])
+    if method != "min":
+        assert pscalars[0, 4] == np.inf
+    if method != "max":
+        assert pscalars[1, 5] == -np.inf
+    assert np.isfinite(np.delete(pscalars, [3, 4, 5, 6], axis=1)).all()
+
+
+def test_round_trip(dlabel):
+    pscalars = np.random.default_rng(2).normal(size=(3, 360))
+    dscalars = parcellation.pscalars_to_dscalars(
+        pscalars, fill=-1., fname=dlabel)
+    labels = parcellation.get_parcel_map(dlabel).labels
+    assert dscalars.shape == (3, len(labels))
+    np.testing.assert_array_equal(dscalars[:, labels < 0], -1.)
+    np.testing.assert_array_equal(
+        dscalars[:, labels >= 0], pscalars[:, labels[labels >= 0]])
+    for method in parcellation.METHODS:
+        expected = pscalars * PER_PARCEL if method == "sum" else pscalars
+        np.testing.assert_allclose(parcellation.dscalars_to_pscalars(
+            dscalars, method, fname=dlabel), expected)
+
+
+def test_round_trip_fills_with_nan(dlabel):
+    pscalars = np.arange(360)
+    dscalars = parcellation.pscalars_to_dscalars(pscalars, fname=dlabel)
+    assert dscalars.dtype == np.float64
+    assert np.isnan(dscalars).sum() == UNLABELED
+    np.testing.assert_array_equal(parcellation.dscalars_to_pscalars(
+        dscalars, only_numeric=True, fname=dlabel), pscalars)
+
+
+@pytest.mark.parametrize("only_numeric", [False, True])
+def test_chunks(dlabel, monkeypatch, only_numeric):
+    dscalars = _dscalars(dlabel, 7)
+    dscalars[5, :10] = np.nan
+    expected = parcellation.dscalars_to_pscalars(
+        dscalars, "max", only_numeric, fname=dlabel)
+    # three maps per chunk, so that the last chunk is partial
+    monkeypatch.setattr(
+        parcellation, "CHUNK_SIZE", 3 * dscalars.shape[1] + 1)
+    chunks = []
+    reduce = parcellation._reduce
+    monkeypatch.setattr(parcellation, "_reduce", lambda x, *args: (
+        chunks.append(len(x)) or reduce(x, *args)))
+    np.testing.assert_array_equal(parcellation.dscalars_to_pscalars(
+        dscalars, "max", only_numeric, fname=dlabel), expected)
+    assert chunks == [3, 3, 1]
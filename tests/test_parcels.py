@@ -0,0 +1,68 @@
+import numpy as np
+
+from wbplot import config
+from wbplot import wbplot as wb
+from wbplot.utils import parcels, raster
+
+
+def _parcel_image(shade=1.):
+    """One pixel per label key 0..360, followed by one background pixel."""
+    n = 361
+    return parcels.ParcelImage(
+        shape=(1, n + 1), pixels=np.arange(n),
+        labels=np.arange(n, dtype=np.uint16),
+        shade=np.full(n, shade, dtype=np.float32),
+        unlabeled=np.array([10, 20, 30]))
+
+
+def _distinct_colors():
+    """A different RGB color for each of the 360 parcels."""
+    keys = np.arange(1, 361)
+    return np.stack([keys % 256, keys // 256, np.full(360, 100)], axis=1)
+
+
+def test_each_parcel_drawn_in_its_own_color():
+    colors = _distinct_colors()
+    image = parcels.ParcelRenderer(_parcel_image()).render(colors)
+    assert image.shape == (1, 362, 3)
+    np.testing.assert_array_equal(image[0, 1:361], colors)
+    assert len(np.unique(image[0, 1:361], axis=0)) == 360
+
+
+def test_parcels_above_255():
+    colors = _distinct_colors()
+    image = parcels.ParcelRenderer(_parcel_image()).render(colors)
+    for key in (255, 256, 257, 300, 360):
+        np.testing.assert_array_equal(image[0, key], colors[key - 1])
+
+
+def test_unlabeled_and_background():
+    image = parcels.ParcelRenderer(_parcel_image()).render(_distinct_colors())
+    np.testing.assert_array_equal(image[0, 0], [10, 20, 30])
+    np.testing.assert_array_equal(
+        image[0, -1], np.round(np.asarray(raster.BACKGROUND) * 255))
+
+
+def test_shading():
+    colors = _distinct_colors()
+    image = parcels.ParcelRenderer(_parcel_image(shade=0.)).render(colors)
+    np.testing.assert_array_equal(image[0, :361], 0)
+
+
+def test_digest():
+    renderer = parcels.ParcelRenderer(_parcel_image())
+    assert renderer.digest() == parcels.ParcelRenderer(
+        _parcel_image()).digest()
+    assert renderer.digest() != parcels.ParcelRenderer(
+        _parcel_image(shade=.5)).digest()
+
+
+def test_parcel_image_in_result_key(monkeypatch):
+    renderers = {1: parcels.ParcelRenderer(_parcel_image()), 2: None}
+    monkeypatch.setattr(parcels, "get_renderer", lambda scene, *args: (
+        renderers[scene]))
+    key = wb._parcel_image_key(1, 10, 10, 'workbench')
+    assert key == renderers[1].digest()
+    assert wb._parcel_image_key(2, 10, 10, 'workbench') is None
+    monkeypatch.setattr(config, "PARCEL_IMAGES", False)
+    assert wb._parcel_image_key(1, 10, 10, 'workbench') is None
@@ -0,0 +1,113 @@
+import io
+import zipfile
+from os.path import abspath, dirname, exists, join
+
+import numpy as np
+import pytest
+from PIL import Image
+
+import wbplot
+from wbplot import config
+from wbplot.utils import workspaces
+
+# Stand-in for wb_command which renders a fixed image
+FAKE_WB_COMMAND = join(
+    dirname(dirname(abspath(__file__))), "benchmarks", "fake_wb",
+    "wb_command")
+
+
+@pytest.fixture
+def cache_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, "CACHE_DIR", str(tmp_path / "cache"))
+    return tmp_path / "cache"
+
+
+def _maps(n, size):
+    return np.random.default_rng(size).normal(size=(n, size))
+
+
+@pytest.mark.parametrize("kwargs", [
+    {},
+    {"vrange": (-1, 2), "cmap": "viridis"},
+    {"norm": "symmetric", "transparent": True},
+    {"norm": "quantile"},
+    {"hemisphere": "left"},
+    {"hemisphere": "right", "orientation": "portrait", "vrange": (0, 1)},
+    {"colorbar": True},
+    {"colorbar": {"loc": "lower center"}, "vrange": (-2, 2)},
+])
+def test_pscalars_match_pscalar(cache_dir, kwargs):
+    size = 360 if kwargs.get("hemisphere") is None else 180
+    plan = wbplot.RenderPlan('pscalars', backend='numpy', **kwargs)
+    assert plan.shape == (size,)
+    for x in _maps(2, size):
+        np.testing.assert_array_equal(plan.render(x), wbplot.pscalar(
+            None, x, backend='numpy', cache=False, **kwargs))
+
+
+@pytest.mark.parametrize("kwargs", [
+    {},
+    {"palette_params": {"pos-user": (0, 1), "neg-user": (0, -1)}},
+    {"palette_params": {"disp-neg": False}, "colorbar": True},
+])
+def test_dscalars_match_dscalar(cache_dir, kwargs):
+    plan = wbplot.RenderPlan('dscalars', backend='numpy', **kwargs)
+    for x in _maps(2, 59412):
+        np.testing.assert_array_equal(plan.render(x), wbplot.dscalar(
+            None, x, backend='numpy', cache=False, **kwargs))
+
+
+def test_outputs(cache_dir, tmp_path):
+    x = _maps(1, 360)[0]
+    expected = wbplot.pscalar(None, x, backend='numpy', cache=False)
+    plan = wbplot.RenderPlan('pscalars', backend='numpy', output='png')
+    png = plan.render(x)
+    np.testing.assert_array_equal(
+        np.asarray(Image.open(io.BytesIO(png)).convert("RGBA")), expected)
+    fname = str(tmp_path / "map.png")
+    assert plan.render(x, fname) is None
+    np.testing.assert_array_equal(
+        np.asarray(Image.open(fname).convert("RGBA")), expected)
+
+
+def test_invalid_arguments():
+    with pytest.raises(ValueError, match="dtype"):
+        wbplot.RenderPlan('pscalar')
+    with pytest.raises(ValueError, match="palette_params"):
+        wbplot.RenderPlan('pscalars', palette_params={})
+    with pytest.raises(ValueError, match="vrange"):
+        wbplot.RenderPlan('dscalars', vrange=(0, 1))
+    with pytest.raises(ValueError, match="norm"):
+        wbplot.RenderPlan('dscalars', norm='log')
+    plan = wbplot.RenderPlan('pscalars', hemisphere='left', backend='numpy')
+    with pytest.raises(ValueError, match=r"must have shape \(180,\)"):
+        plan.render(np.zeros(360))
+
+
+def test_workbench_render_dir_is_reused(cache_dir, tmp_path, monkeypatch):
+    scene_zip = str(tmp_path / "scene.zip")
+    with zipfile.ZipFile(scene_zip, "w") as z:
+        z.writestr("Human.scene", "<scene/>")
+    monkeypatch.setattr(config, "SCENE_ZIP_FILE", scene_zip)
+    monkeypatch.setattr(config, "WB_COMMAND", FAKE_WB_COMMAND)
+    monkeypatch.setattr(config, "PARCEL_IMAGES", False)
+    monkeypatch.setattr(workspaces, "_workspaces", dict())
+    render_dirs = []
+    make_dir = workspaces.tempfile.mkdtemp
+
+    def mkdtemp(prefix, **kwargs):
+        path = make_dir(prefix=prefix, **kwargs)
+        if prefix == "wbplot-":
+            render_dirs.append(path)
+        return path
+
+    monkeypatch.setattr(workspaces.tempfile, "mkdtemp", mkdtemp)
+
+    for dtype, size in (('pscalars', 360), ('dscalars', 59412)):
+        with wbplot.RenderPlan(dtype) as plan:
+            for i, x in enumerate(_maps(3, size)):
+                fname = str(tmp_path / "{}-{}.png".format(dtype, i))
+                plan.render(x, fname)
+                assert Image.open(fname).size == (plan.width, plan.height)
+            assert len(render_dirs) == 1 and exists(render_dirs[0])
+        assert not exists(render_dirs.pop())
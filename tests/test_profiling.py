@@ -0,0 +1,136 @@
+import asyncio
+import json
+import threading
+import time
+
+import pytest
+
+import wbplot
+from wbplot.utils import profiling
+
+
+def _busy(seconds):
+    """Use the CPU for `seconds` of wall time."""
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        pass
+
+
+def test_no_profile():
+    assert profiling.stage('raster') is profiling._NOT_RECORDING
+    with profiling.stage('raster'):
+        assert not profiling.recording()
+        profiling.add_bytes(10)  # ignored
+
+
+def test_nested_stages():
+    hooked = []
+    with wbplot.profile(hook=lambda *args: hooked.append(args)) as stats:
+        for _ in range(2):
+            with profiling.stage('pscalar'):
+                assert profiling.recording()
+                _busy(0.02)
+                with profiling.stage('colormap'):
+                    _busy(0.03)
+                    profiling.add_bytes(5)
+                    with profiling.stage('raster'):
+                        profiling.add_bytes(7)
+                profiling.add_bytes(100)
+        with profiling.stage('colormap'):
+            pass
+    assert not profiling.recording()
+    assert set(stats.stages) == {'pscalar', 'colormap', 'raster'}
+    assert [stats[s].calls for s in ('pscalar', 'colormap', 'raster')] == [
+        2, 3, 2]
+    # each stage's time excludes the stages nested inside it
+    assert 0.04 <= stats['pscalar'].seconds < 0.06 + 0.03
+    assert 0.06 <= stats['colormap'].seconds
+    assert stats['pscalar'].cpu_seconds <= stats['pscalar'].seconds + 0.01
+    assert stats.seconds <= stats.wall_seconds
+    # bytes are counted by the innermost stage
+    assert [stats[s].bytes_written for s in ('pscalar', 'colormap', 'raster')
+            ] == [200, 10, 14]
+    assert stats.bytes_written == 224
+    assert [name for name, _ in hooked] == [
+        'raster', 'colormap', 'pscalar'] * 2 + ['colormap']
+    assert all(s.calls == 1 for _, s in hooked)
+
+
+def test_nested_profiles():
+    with wbplot.profile() as outer:
+        with profiling.stage('validation'):
+            pass
+        with wbplot.profile() as inner:
+            with profiling.stage('raster'):
+                pass
+    assert set(outer.stages) == {'validation', 'raster'}
+    assert set(inner.stages) == {'raster'}
+
+
+def test_threads_are_recorded_separately():
+    with wbplot.profile() as stats:
+        with profiling.stage('render_many'):
+            thread = threading.Thread(target=_stage, args=('raster', 0.03))
+            thread.start()
+            thread.join()
+    assert stats['raster'].calls == 1 and stats['raster'].seconds >= 0.03
+    # the thread's stage is not nested in this thread's stage
+    assert stats['render_many'].seconds >= 0.03
+
+
+def _stage(name, seconds):
+    with profiling.stage(name):
+        time.sleep(seconds)
+
+
+def test_profiled_functions():
+    @profiling.profiled
+    def pscalar(x):
+        with profiling.stage('raster'):
+            return x + 1
+
+    @profiling.profiled
+    async def pscalar_async(x):
+        with profiling.stage('workbench'):
+            await asyncio.sleep(0.02)
+        return pscalar(x)
+
+    async def main():
+        return await asyncio.gather(pscalar_async(1), pscalar_async(2))
+
+    assert pscalar.__name__ == 'pscalar'
+    with wbplot.profile() as stats:
+        assert asyncio.run(main()) == [2, 3]
+    assert [stats[s].calls for s in (
+        'pscalar_async', 'workbench', 'pscalar', 'raster')] == [2] * 4
+    # time awaited in a task's stage is not counted in its parent stage
+    assert stats['workbench'].seconds >= 0.04
+    assert stats['pscalar_async'].seconds < 0.02
+
+
+def test_memory():
+    with wbplot.profile(memory=True) as stats:
+        with profiling.stage('outer'):
+            with profiling.stage('colormap'):
+                data = bytearray(1 << 22)
+            del data
+    assert stats['colormap'].peak_memory >= 1 << 22
+    assert stats['outer'].peak_memory >= 1 << 22
+
+
+def test_stats_sum_and_json():
+    stats = []
+    for n in (1, 2):
+        with wbplot.profile() as s:
+            for _ in range(n):
+                with profiling.stage('raster'):
+                    profiling.add_bytes(10)
+        stats.append(s)
+    total = sum(stats)
+    assert total['raster'].calls == 3
+    assert total.bytes_written == 30
+    assert total.wall_seconds == pytest.approx(
+        stats[0].wall_seconds + stats[1].wall_seconds)
+    d = json.loads(total.to_json())
+    assert d['stages']['raster']['calls'] == 3
+    assert d == total.to_dict()
@@ -0,0 +1,41 @@
+import numpy as np
+from wbplot.utils import palettes, raster
+
+
+def test_dscalar_range_auto_scale_includes_zero():
+    assert raster.dscalar_range(np.array([1., 2., 4.])) == (0., 4.)
+    assert raster.dscalar_range(np.array([-3., -1.])) == (-3., 0.)
+    assert raster.dscalar_range(np.array([-3., 1., np.nan])) == (-3., 1.)
+    assert raster.dscalar_range(np.zeros(4)) == (0., 1.)
+
+
+def test_dscalar_range_user_scale():
+    # (min, max) pairs, where max is mapped to the end of the palette
+    params = {"pos-user": (0, 5), "neg-user": (0, -3)}
+    assert raster.dscalar_range(np.array([1., 2.]), params) == (-3., 5.)
+    # as with wb_command, user values are only used if both are given
+    assert raster.dscalar_range(
+        np.array([1., 2.]), {"pos-user": (0, 5)}) == (0., 2.)
+
+
+def test_dscalar_range_percentile_scale():
+    x = np.arange(-100., 101.)
+    params = {"pos-percent": (2, 90), "neg-percent": (2, 98)}
+    vmin, vmax = raster.dscalar_range(x, params)
+    assert vmin == -np.percentile(np.arange(1., 101.), 98)
+    assert vmax == np.percentile(np.arange(1., 101.), 90)
+
+
+def test_dscalar_range_matches_palette_xml():
+    params = {"pos-percent": (2, 90), "neg-percent": (5, 98)}
+    mapping = palettes.palette_mapping(
+        "<ScaleMode></ScaleMode><PaletteName></PaletteName>"
+        "<DisplayPositiveData></DisplayPositiveData>"
+        "<DisplayNegativeData></DisplayNegativeData>"
+        "<DisplayZeroData></DisplayZeroData>"
+        "<AutoScalePercentageValues>98 2 2 98</AutoScalePercentageValues>",
+        palette_params=params)
+    written = palettes._get(mapping, "AutoScalePercentageValues").split()
+    assert [float(v) for v in written] == [98., 5., 2., 90.]
+    assert palettes.scale_values(params, "AutoScalePercentageValues") == [
+        98., 5., 2., 90.]
@@ -0,0 +1,60 @@
+import os
+
+import pytest
+
+from wbplot import config
+from wbplot.utils import results
+
+
+@pytest.fixture
+def cache_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, "CACHE_DIR", str(tmp_path))
+    monkeypatch.setattr(config, "RESULT_CACHE_BYTES", 1000)
+    yield tmp_path
+    results._totals.clear()
+
+
+def _cached():
+    directory = os.path.join(config.CACHE_DIR, results.RESULT_DIR)
+    return sorted(os.listdir(directory))
+
+
+def test_lookup_returns_stored_image(cache_dir):
+    results.store("a", b"png-a")
+    assert results.lookup("a") == b"png-a"
+    assert results.lookup("b") is None
+
+
+def test_lookup_of_evicted_image_is_a_miss(cache_dir):
+    results.store("a", b"png-a")
+    os.remove(results.result_file("a"))
+    assert results.lookup("a") is None
+
+
+def test_store_evicts_least_recently_used(cache_dir):
+    for i, key in enumerate("abcd"):
+        results.store(key, bytes(300))
+        os.utime(results.result_file(key), ns=(i, i))
+    # 1200 bytes > 1000: shrunk to at most EVICT_TO * 1000 bytes
+    assert _cached() == ["b.png", "c.png", "d.png"]
+    results.lookup("b")
+    results.store("e", bytes(300))
+    assert _cached() == ["b.png", "d.png", "e.png"]
+
+
+def test_store_only_scans_when_over_limit(cache_dir, monkeypatch):
+    scans = []
+    evict = results._evict
+    monkeypatch.setattr(results, "_evict", lambda *args: scans.append(
+        args) or evict(*args))
+    for key in "abc":
+        results.store(key, bytes(300))
+    assert len(scans) == 1  # the first store, to find the cache's size
+    results.store("d", bytes(300))
+    assert len(scans) == 2
+
+
+def test_clear(cache_dir):
+    results.store("a", b"png-a")
+    assert results.clear() == 1
+    assert results.lookup("a") is None
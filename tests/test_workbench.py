@@ -0,0 +1,150 @@
+import asyncio
+import os
+import pickle
+import stat
+import time
+from os.path import dirname, join
+
+import pytest
+
+from wbplot import config
+from wbplot.utils import workbench
+
+# Stand-in for wb_command which renders a fixed image
+FAKE_WB_COMMAND = join(
+    dirname(dirname(os.path.abspath(__file__))), "benchmarks", "fake_wb",
+    "wb_command")
+
+
+def _wb_command(tmp_path, monkeypatch, body):
+    """Point wbplot.config.WB_COMMAND at a shell script."""
+    path = tmp_path / "wb_command"
+    path.write_text("#!/bin/sh\n" + body)
+    path.chmod(path.stat().st_mode | stat.S_IEXEC)
+    monkeypatch.setattr(config, "WB_COMMAND", str(path))
+    return str(path)
+
+
+def _alive(pid):
+    """Whether process `pid` exists and is not a zombie."""
+    try:
+        with open("/proc/{}/stat".format(pid)) as f:
+            return f.read().rsplit(")", 1)[1].split()[0] != "Z"
+    except FileNotFoundError:
+        return False
+
+
+def _wait_until_dead(pid, timeout=5.):
+    deadline = time.monotonic() + timeout
+    while _alive(pid) and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return not _alive(pid)
+
+
+# a command which starts a child process, then hangs
+HANG = 'sleep 30 &\necho $! > "$1"\nwait\n'
+
+
+def test_show_scene(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, "WB_COMMAND", FAKE_WB_COMMAND)
+    scene_file = tmp_path / "Human.scene"
+    scene_file.write_text("")
+    file_out = str(tmp_path / "out.png")
+    call = workbench.run(
+        ['-show-scene', scene_file, 1, file_out, 40, 30])
+    assert call.args == [FAKE_WB_COMMAND, '-show-scene', str(scene_file),
+                         '1', file_out, '40', '30']
+    assert call.returncode == 0 and call.elapsed > 0
+    with open(file_out, "rb") as f:
+        assert f.read(8) == b"\x89PNG\r\n\x1a\n"
+
+
+def test_output_is_captured(tmp_path, monkeypatch):
+    _wb_command(tmp_path, monkeypatch, 'echo "out $1"\necho err >&2\n')
+    call = workbench.run(['-version'])
+    assert call.stdout == "out -version\n"
+    assert call.stderr == "err\n"
+
+
+def test_non_zero_exit(tmp_path, monkeypatch):
+    command = _wb_command(
+        tmp_path, monkeypatch, 'echo "ERROR: bad scene" >&2\nexit 3\n')
+    with pytest.raises(workbench.WorkbenchError) as info:
+        workbench.run(['-show-scene', 'x.scene'])
+    e = info.value
+    assert e.returncode == 3 and not e.timed_out
+    assert e.cmd == [command, '-show-scene', 'x.scene']
+    assert e.stderr == "ERROR: bad scene\n"
+    assert "failed with exit status 3" in str(e)
+    assert str(e).endswith("stderr:\nERROR: bad scene")
+
+
+def test_command_not_found(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, "WB_COMMAND", str(tmp_path / "missing"))
+    with pytest.raises(workbench.WorkbenchError, match="could not run"):
+        workbench.run(['-version'])
+
+
+def test_timeout_kills_process_group(tmp_path, monkeypatch):
+    _wb_command(tmp_path, monkeypatch, HANG)
+    pid_file = tmp_path / "pid"
+    start = time.perf_counter()
+    with pytest.raises(workbench.WorkbenchError, match="timed out") as info:
+        workbench.run([pid_file], timeout=0.5)
+    assert time.perf_counter() - start < 10
+    assert info.value.timed_out and info.value.returncode is None
+    # the command's own child was killed with it
+    assert _wait_until_dead(int(pid_file.read_text()))
+
+
+def test_default_timeout(tmp_path, monkeypatch):
+    _wb_command(tmp_path, monkeypatch, HANG)
+    monkeypatch.setattr(config, "WB_TIMEOUT", 0.5)
+    with pytest.raises(workbench.WorkbenchError) as info:
+        workbench.run([tmp_path / "pid"])
+    assert info.value.timed_out
+
+
+def test_run_async(tmp_path, monkeypatch):
+    _wb_command(tmp_path, monkeypatch, 'echo "$@"\n')
+    call = asyncio.run(workbench.run_async(['-a', 1]))
+    assert call.stdout == "-a 1\n"
+
+    _wb_command(tmp_path, monkeypatch, 'exit 2\n')
+    with pytest.raises(workbench.WorkbenchError) as info:
+        asyncio.run(workbench.run_async(['-a']))
+    assert info.value.returncode == 2
+
+
+def test_run_async_timeout(tmp_path, monkeypatch):
+    _wb_command(tmp_path, monkeypatch, HANG)
+    pid_file = tmp_path / "pid"
+    with pytest.raises(workbench.WorkbenchError) as info:
+        asyncio.run(workbench.run_async([pid_file], timeout=0.5))
+    assert info.value.timed_out
+    assert _wait_until_dead(int(pid_file.read_text()))
+
+
+def test_run_async_cancelled(tmp_path, monkeypatch):
+    _wb_command(tmp_path, monkeypatch, HANG)
+    pid_file = tmp_path / "pid"
+
+    async def main():
+        task = asyncio.ensure_future(workbench.run_async([pid_file]))
+        while not pid_file.exists() or not pid_file.read_text():
+            await asyncio.sleep(0.01)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(main())
+    assert _wait_until_dead(int(pid_file.read_text()))
+
+
+def test_error_pickles():
+    e = workbench.WorkbenchError(
+        "failed", ['wb_command', '-x'], 1, "stderr", 2.5, timed_out=True)
+    e2 = pickle.loads(pickle.dumps(e))
+    assert str(e2) == str(e)
+    assert (e2.cmd, e2.returncode, e2.stderr, e2.elapsed, e2.timed_out) == (
+        e.cmd, e.returncode, e.stderr, e.elapsed, e.timed_out)
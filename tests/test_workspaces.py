@@ -0,0 +1,142 @@
+import os
+import subprocess
+import sys
+import zipfile
+from os.path import exists, isdir, islink, join
+
+import pytest
+
+from wbplot import config, constants
+from wbplot.utils import workspaces
+
+
+def _scene_zip(fname, scene="<scene/>"):
+    with zipfile.ZipFile(fname, "w") as z:
+        z.writestr("Human.scene", scene)
+        z.writestr("Surfaces/left.surf.gii", "surface")
+    return str(fname)
+
+
+@pytest.fixture
+def cache_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, "CACHE_DIR", str(tmp_path / "cache"))
+    monkeypatch.setattr(
+        config, "SCENE_ZIP_FILE", _scene_zip(tmp_path / "scene.zip"))
+    monkeypatch.setattr(workspaces, "_workspaces", dict())
+    return tmp_path / "cache"
+
+
+def _workspaces(cache_dir):
+    return sorted(name for name in os.listdir(cache_dir)
+                  if name.startswith(workspaces.WORKSPACE_PREFIX)
+                  and not name.endswith(workspaces.LOCK_SUFFIX))
+
+
+def _new_scene(tmp_path, monkeypatch, name):
+    monkeypatch.setattr(config, "SCENE_ZIP_FILE", _scene_zip(
+        tmp_path / (name + ".zip"), "<scene name='{}'/>".format(name)))
+    return workspaces.get_workspace()
+
+
+def test_get_workspace(cache_dir):
+    workspace = workspaces.get_workspace()
+    assert workspace == join(str(cache_dir), workspaces.WORKSPACE_PREFIX
+                             + workspaces.scene_key())
+    with open(join(workspace, "Human.scene")) as f:
+        assert f.read() == "<scene/>"
+    assert exists(join(workspace, "Surfaces", "left.surf.gii"))
+    for image_file in (constants.DLABEL_FILE, constants.DSCALAR_FILE):
+        assert exists(join(workspace, os.path.basename(image_file)))
+    assert workspaces.get_workspace() == workspace
+    assert [n for n in os.listdir(cache_dir) if n.startswith(".tmp-")] == []
+
+
+def test_new_scene_replaces_workspace(cache_dir, tmp_path, monkeypatch):
+    old = workspaces.get_workspace()
+    new = _new_scene(tmp_path, monkeypatch, "new")
+    assert new != old
+    assert _workspaces(cache_dir) == [os.path.basename(new)]
+
+
+def test_render_workspace(cache_dir):
+    image_file = constants.DSCALAR_FILE
+    with workspaces.render_workspace(image_file) as render_dir:
+        names = set(os.listdir(render_dir))
+        assert names == {"Human.scene", "Surfaces",
+                         os.path.basename(constants.DLABEL_FILE)}
+        # the scene file is a copy, so it can be edited; the rest are links
+        assert not islink(join(render_dir, "Human.scene"))
+        assert islink(join(render_dir, "Surfaces"))
+        with workspaces.render_workspace(image_file) as other:
+            assert other != render_dir
+    assert not exists(render_dir) and not exists(other)
+
+
+def test_render_workspace_removed_on_error(cache_dir):
+    with pytest.raises(KeyError):
+        with workspaces.render_workspace(constants.DLABEL_FILE) as render_dir:
+            raise KeyError()
+    assert not exists(render_dir)
+
+
+def test_clean_workspaces(cache_dir):
+    old = workspaces.get_workspace()
+    workspaces.clean_workspaces(keep=workspaces.scene_key())
+    assert _workspaces(cache_dir) == [os.path.basename(old)]
+    workspaces.clean_workspaces()
+    assert _workspaces(cache_dir) == []
+    assert os.listdir(cache_dir) == []
+    # the memoized workspace is forgotten, so it is made again
+    assert workspaces.get_workspace() == old and isdir(old)
+
+
+def test_clean_skips_workspace_in_use(cache_dir, tmp_path, monkeypatch):
+    with workspaces.render_workspace(constants.DLABEL_FILE) as render_dir:
+        in_use = workspaces.get_workspace()
+        new = _new_scene(tmp_path, monkeypatch, "new")
+        workspaces.clean_workspaces()
+        assert _workspaces(cache_dir) == [os.path.basename(in_use)]
+        assert exists(join(render_dir, "Surfaces", "left.surf.gii"))
+        assert not exists(new)
+    workspaces.clean_workspaces()
+    assert _workspaces(cache_dir) == []
+
+
+@pytest.mark.skipif(workspaces.fcntl is None, reason="needs fcntl")
+def test_clean_skips_workspace_locked_by_another_process(cache_dir):
+    workspace = workspaces.get_workspace()
+    # another process holds the workspace's lock until its stdin is closed
+    holder = subprocess.Popen(
+        [sys.executable, "-c",
+         "import fcntl, sys\n"
+         "f = open(sys.argv[1], 'a')\n"
+         "fcntl.flock(f, fcntl.LOCK_SH)\n"
+         "print('locked', flush=True)\n"
+         "sys.stdin.read()\n",
+         workspace + workspaces.LOCK_SUFFIX],
+        stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True)
+    try:
+        assert holder.stdout.readline() == "locked\n"
+        workspaces.clean_workspaces()
+        assert isdir(workspace)
+    finally:
+        holder.communicate("")
+    workspaces.clean_workspaces()
+    assert not exists(workspace)
+
+
+def test_workspace_removed_after_it_was_found(cache_dir, monkeypatch):
+    get_workspace = workspaces.get_workspace
+    found = []
+
+    def get_then_clean():
+        # another process removes the workspace before it is locked
+        found.append(get_workspace())
+        if len(found) == 1:
+            workspaces.clean_workspaces()
+        return found[-1]
+
+    monkeypatch.setattr(workspaces, "get_workspace", get_then_clean)
+    with workspaces.render_workspace(constants.DLABEL_FILE) as render_dir:
+        assert exists(join(render_dir, "Human.scene"))
+    assert len(found) == 2 and found[0] == found[1] and isdir(found[1])
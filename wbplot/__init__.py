@@ -1,5 +1,40 @@
-from .wbplot import pscalar, dscalar
-from .utils.images import extract_nifti_data, extract_gifti_data
-from .utils.images import write_dense_image, write_parcellated_image
 from . import constants, config
 __version__ = '1.0.14'
+
+# Public names, and the submodules from which they are imported on first use
+# (PEP 562), so that importing wbplot does not import its dependencies
+_LAZY = {
+    "pscalar": ".wbplot", "dscalar": ".wbplot", "pscalar_batch": ".wbplot",
+    "dscalar_batch": ".wbplot",
+    "render_many": ".farm", "RenderResult": ".farm",
+    "montage": ".compose", "RenderPlan": ".plan",
+    "dscalar_frames": ".movie", "dscalar_movie": ".movie",
+    "pscalar_async": ".aio", "dscalar_async": ".aio",
+    "render_many_async": ".aio",
+    "WorkbenchError": ".utils.workbench",
+    "add_colorbar": ".utils.annotate", "add_text": ".utils.annotate",
+    "extract_nifti_data": ".utils.images",
+    "extract_gifti_data": ".utils.images",
+    "write_dense_image": ".utils.images",
+    "write_parcellated_image": ".utils.images",
+    "pscalars_to_dscalars": ".utils.parcellation",
+    "dscalars_to_pscalars": ".utils.parcellation",
+    "profile": ".utils.profiling",
+}
+
+__all__ = sorted(_LAZY) + ["constants", "config"]
+
+
+def __getattr__(name):
+    module = _LAZY.get(name)
+    if module is None:
+        raise AttributeError(
+            "module {!r} has no attribute {!r}".format(__name__, name))
+    from importlib import import_module
+    value = getattr(import_module(module, __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_LAZY))
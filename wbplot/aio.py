@@ -0,0 +1,233 @@
+"""Render images from asyncio code without blocking the event loop. """
+
+from wbplot.wbplot import (
+    _check_file_out, _check_pscalar_args, _check_dscalar_args,
+    _write_pscalars, _write_dscalars, _parcel_renderer, _make_transparent)
+from wbplot.farm import _job_func, _job_result, _retry
+from wbplot.utils import outputs, workspaces, workbench, parcels, profiling
+from wbplot.utils import colormaps
+from wbplot import constants
+from functools import partial
+from contextvars import copy_context
+from os import cpu_count
+import asyncio
+import time
+
+
+@profiling.profiled
+async def pscalar_async(file_out, pscalars, orientation='landscape',
+                        hemisphere=None, vrange=None, cmap='magma',
+                        transparent=False, norm='linear'):
+    """
+    Save an image of parcellated scalars, as a coroutine.
+
+    Parameters
+    ----------
+    file_out : str
+        absolute path to filename where image is saved. if `filename` has an
+        extension, it must be .png
+    pscalars, orientation, hemisphere, vrange, cmap, transparent, norm
+        see :func:`wbplot.pscalar`
+
+    Returns
+    -------
+    None
+
+    Raises
+    ------
+    RuntimeError : scene file was not extracted to the workspace directory
+    WorkbenchError : Connectome Workbench failed to render the image, or timed
+        out (see wbplot.config.WB_TIMEOUT)
+
+    Notes
+    -----
+    Only the Workbench backend is supported, and images are always written to
+    `file_out`; unlike :func:`wbplot.pscalar`, there are no `backend`,
+    `cache`, `output` or `colorbar` arguments.
+
+    Connectome Workbench runs as a child process which is awaited, so many
+    renders can be in flight at once on a single event loop. File I/O runs in
+    the loop's default executor. If the task is cancelled, the child process
+    is killed and the render directory is removed. Calibrated scenes are
+    re-coloured without running Workbench, as by :func:`wbplot.pscalar`.
+
+    """
+    with profiling.stage('validation'):
+        file_out = _check_file_out(file_out)
+        pscalars, cmap, scene, width, height = _check_pscalar_args(
+            pscalars, orientation, hemisphere, cmap)
+        norm = colormaps.check_norm(norm)
+    renderer = _parcel_renderer(scene, width, height, 'workbench')
+    if renderer is not None:  # scene is calibrated; no need for Workbench
+        image = parcels.render_pscalars(
+            renderer, pscalars, cmap, vrange, norm)
+        await _in_executor(partial(
+            outputs.from_array, image, file_out, transparent=transparent))
+        return
+    await _render(
+        constants.DLABEL_FILE,
+        partial(_write_pscalars, pscalars=pscalars, cmap=cmap, vrange=vrange,
+                norm=norm),
+        scene, file_out, width, height, transparent)
+
+
+@profiling.profiled
+async def dscalar_async(file_out, dscalars, orientation='landscape',
+                        hemisphere=None, palette='magma', palette_params=None,
+                        transparent=False):
+    """
+    Save an image of dense scalars, as a coroutine.
+
+    Parameters
+    ----------
+    file_out : str
+        absolute path to filename where image is saved. if `filename` has an
+        extension, it must be .png
+    dscalars, orientation, hemisphere, palette, palette_params, transparent
+        see :func:`wbplot.dscalar`
+
+    Returns
+    -------
+    None
+
+    Raises
+    ------
+    RuntimeError : scene file was not extracted to the workspace directory
+    WorkbenchError : Connectome Workbench failed to render the image, or timed
+        out (see wbplot.config.WB_TIMEOUT)
+
+    Notes
+    -----
+    See :func:`pscalar_async`; as there, only the Workbench backend and output
+    files are supported.
+
+    """
+    with profiling.stage('validation'):
+        palette, scene, width, height = _check_dscalar_args(
+            dscalars, orientation, hemisphere, palette)
+    await _render(
+        constants.DSCALAR_FILE,
+        partial(_write_dscalars, dscalars=dscalars, palette=palette,
+                palette_params=palette_params),
+        scene, file_out, width, height, transparent)
+
+
+async def render_many_async(jobs, max_concurrency=None, progress=None,
+                            retries=0):
+    """
+    Render many images concurrently, as a coroutine.
+
+    Parameters
+    ----------
+    jobs : iterable of dict
+        keyword arguments for :func:`pscalar_async` (if the dict contains the
+        key 'pscalars') or :func:`dscalar_async` (if it contains 'dscalars').
+        may be a generator, in which case jobs are only created as slots
+        become available
+    max_concurrency : int or None, default None
+        maximum number of images rendered at once; if None, use the number of
+        CPUs on the machine
+    progress : Callable[int, int or None, RenderResult] or None, default None
+        called after each job finishes with the number of jobs finished so far,
+        the total number of jobs (None if `jobs` has no length) and the job's
+        :class:`wbplot.RenderResult`
+    retries : int, default 0
+        number of times a job is retried if Connectome Workbench fails or times
+        out; other errors are not retried
+
+    Returns
+    -------
+    list of RenderResult
+        one result per job, in the order the jobs were given
+
+    Raises
+    ------
+    ValueError : invalid `max_concurrency` argument
+
+    Notes
+    -----
+    This is the coroutine counterpart of :func:`wbplot.render_many`. Failed
+    jobs do not stop the remaining jobs; if this coroutine is cancelled, all
+    running jobs are cancelled and their child processes killed.
+
+    """
+    if max_concurrency is None:
+        max_concurrency = cpu_count() or 1
+    if max_concurrency < 1:
+        raise ValueError("max_concurrency must be at least 1")
+
+    total = len(jobs) if hasattr(jobs, "__len__") else None
+    results = []
+    pending = set()
+
+    def collect(done):
+        for task in done:
+            results.append(task.result())
+            if progress is not None:
+                progress(len(results), total, results[-1])
+
+    try:
+        for index, job in enumerate(jobs):
+            if len(pending) >= max_concurrency:
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED)
+                collect(done)
+            pending.add(asyncio.ensure_future(
+                _render_job(index, job, retries)))
+        if pending:
+            done, pending = await asyncio.wait(pending)
+            collect(done)
+    except BaseException:
+        for task in pending:
+            task.cancel()
+        if pending:
+            await asyncio.wait(pending)
+        raise
+    return sorted(results, key=lambda r: r.index)
+
+
+async def _render_job(index, job, retries):
+    """Render a single job, capturing any exception raised."""
+    start = time.perf_counter()
+    attempts = 0
+    while True:
+        attempts += 1
+        try:
+            await _job_func(job, pscalar_async, dscalar_async)(**job)
+        except Exception as e:
+            if _retry(e, attempts, retries):
+                continue
+            return _job_result(index, job, start, attempts, e)
+        return _job_result(index, job, start, attempts, None)
+
+
+async def _render(image_file, write, scene, file_out, width, height,
+                  transparent):
+    """Write the image file into a render directory and show the scene."""
+    workspace = workspaces.render_workspace(image_file)
+    leave = partial(workspace.__exit__, None, None, None)
+    enter = _in_executor(workspace.__enter__)
+    try:
+        render_dir = await asyncio.shield(enter)
+    except asyncio.CancelledError:
+        # The directory is still being made; remove it once it exists
+        enter.add_done_callback(
+            lambda f: f.cancelled() or f.exception() or _in_executor(leave))
+        raise
+    try:
+        scene_file = await _in_executor(partial(write, render_dir))
+        await workbench.run_async(
+            ['-show-scene', scene_file, scene, file_out, width, height])
+    finally:
+        await asyncio.shield(_in_executor(leave))
+    if transparent:
+        await _in_executor(partial(_make_transparent, file_out))
+
+
+def _in_executor(func):
+    """
+    Run ``func()`` in the event loop's default executor, in the context of the
+    current task so that it is profiled as part of the task's render.
+    """
+    return asyncio.get_running_loop().run_in_executor(
+        None, copy_context().run, func)
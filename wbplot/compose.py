@@ -0,0 +1,255 @@
+"""Composite many rendered maps into a single figure with NumPy and PIL. """
+
+from wbplot.wbplot import pscalar, dscalar
+from wbplot.utils import annotate, colormaps, images, outputs, palettes
+from wbplot.utils import raster
+from wbplot.utils.lazy import lazy_import
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from os import cpu_count
+import numpy as np
+
+Image = lazy_import("PIL.Image")
+
+
+def montage(file_out, jobs, ncols=None, row_labels=None, col_labels=None,
+            colorbar=None, trim=True, spacing=10, font_size=24,
+            max_workers=None, transparent=False, output='array'):
+    """
+    Render maps in parallel and arrange them in a labeled grid.
+
+    Parameters
+    ----------
+    file_out : str or file-like or None
+        absolute path to the PNG file where the figure is saved, a binary
+        file-like object, or None to return the figure in the format set by
+        `output`
+    jobs : sequence of (dict or None), or sequence of rows of (dict or None)
+        keyword arguments for :func:`wbplot.pscalar` (if the dict contains the
+        key 'pscalars') or :func:`wbplot.dscalar` (if it contains 'dscalars'),
+        without `file_out`. None leaves a cell empty. a flat sequence is laid
+        out row by row in `ncols` columns
+    ncols : int or None, default None
+        number of columns in the grid, if `jobs` is flat; if None, use the
+        length of `col_labels` or else a roughly square grid
+    row_labels : sequence of str or None, default None
+        text drawn to the left of each row
+    col_labels : sequence of str or None, default None
+        text drawn above each column
+    colorbar : bool or dict or None, default None
+        draw a colorbar beneath the grid. if True, every map must be drawn
+        with the same colormap over the same range of values; otherwise, a
+        dict with keys 'cmap' and 'vrange' (and optionally 'label') describing
+        the colorbar
+    trim : bool, default True
+        crop the whitespace around the maps
+    spacing : int, default 10
+        gap between the cells of the grid and around its edges, in pixels
+    font_size : int, default 24
+        size of the labels, in pixels
+    max_workers : int or None, default None
+        maximum number of maps rendered at once; if None, use the number of
+        CPUs on the machine
+    transparent : bool, default False
+        make all white pixels in the figure transparent
+    output : 'array' or 'image' or 'png', default 'array'
+        if `file_out` is None, return the figure as an RGBA array, a
+        :class:~`PIL.Image.Image`, or PNG bytes
+
+    Returns
+    -------
+    None or numpy.ndarray or PIL.Image.Image or bytes
+        the figure, if `file_out` is None
+
+    Raises
+    ------
+    ValueError : invalid arguments, or `colorbar` is True but the maps do not
+        share a colormap and range of values
+    TypeError : a job is not a dict
+
+    Notes
+    -----
+    Maps are rendered into memory (see the `output` argument of
+    :func:`wbplot.pscalar`) by a pool of threads, and each is cropped as soon
+    as it is finished, so only the figure and the cropped maps are held in
+    memory. Maps of the same size are cropped to the same box, so that they
+    stay aligned in the grid. If any map fails to render, the remaining maps
+    are cancelled and the error is raised.
+
+    """
+    outputs.check_output(file_out, output)
+    grid = _layout(jobs, ncols, col_labels)
+    nrows, ncols = len(grid), len(grid[0])
+    if row_labels is not None and len(row_labels) != nrows:
+        raise ValueError("expected {} row labels, got {}".format(
+            nrows, len(row_labels)))
+    if col_labels is not None and len(col_labels) != ncols:
+        raise ValueError("expected {} column labels, got {}".format(
+            ncols, len(col_labels)))
+    if colorbar is True:
+        colorbar = _shared_colorbar(
+            [job for row in grid for job in row if job is not None])
+    elif colorbar and not {'cmap', 'vrange'} <= set(colorbar):
+        raise ValueError("colorbar dict must contain 'cmap' and 'vrange'")
+
+    tiles = _render_tiles(grid, max_workers, trim)
+    if not tiles:
+        raise ValueError("jobs must contain at least one map")
+    cell_h = max(size[0] for _, _, size in tiles.values())
+    cell_w = max(size[1] for _, _, size in tiles.values())
+
+    # Measure the labels and colorbar, then lay out the figure
+    font = annotate.get_font(font_size)
+    left = top = spacing
+    if row_labels is not None:
+        left += max(annotate.text_size(str(s), font)[0]
+                    for s in row_labels) + spacing
+    if col_labels is not None:
+        top += max(annotate.text_size(str(s), font)[1]
+                   for s in col_labels) + spacing
+    grid_w = ncols * cell_w + (ncols - 1) * spacing
+    grid_h = nrows * cell_h + (nrows - 1) * spacing
+    cbar = None
+    if colorbar:
+        cbar = annotate.colorbar(
+            colorbar['cmap'], colorbar['vrange'], length=grid_w // 3,
+            thickness=font_size, font_size=font_size,
+            label=colorbar.get('label'))
+    width = left + grid_w + spacing
+    height = top + grid_h + spacing
+    if cbar is not None:
+        height += cbar.shape[0] + spacing
+        width = max(width, cbar.shape[1] + 2 * spacing)
+
+    canvas = np.full((height, width, 4), 255, dtype=np.uint8)
+    for (i, j), (tile, offset, size) in tiles.items():
+        y = top + i * (cell_h + spacing) + (cell_h - size[0]) // 2 + offset[0]
+        x = left + j * (cell_w + spacing) + (cell_w - size[1]) // 2 + offset[1]
+        canvas[y:y + tile.shape[0], x:x + tile.shape[1], :tile.shape[2]] = tile
+    figure = Image.fromarray(canvas, "RGBA")
+    if row_labels is not None:
+        for i, s in enumerate(row_labels):
+            y = top + i * (cell_h + spacing) + cell_h / 2
+            annotate.draw_text(figure, (left - spacing, y), str(s), font, "rm")
+    if col_labels is not None:
+        for j, s in enumerate(col_labels):
+            x = left + j * (cell_w + spacing) + cell_w / 2
+            annotate.draw_text(figure, (x, top - spacing), str(s), font, "mb")
+    if cbar is not None:
+        x = left + (grid_w - cbar.shape[1]) // 2
+        x = min(max(x, spacing), width - spacing - cbar.shape[1])
+        figure.alpha_composite(
+            Image.fromarray(cbar, "RGBA"), (x, top + grid_h + spacing))
+    return outputs.from_array(
+        np.asarray(figure), file_out, output, transparent)
+
+
+def _layout(jobs, ncols, col_labels=None):
+    """Arrange the jobs in rows of equal length, padding with None."""
+    jobs = list(jobs)
+    if any(isinstance(job, (list, tuple)) for job in jobs):
+        rows = [list(row) for row in jobs]
+    else:
+        if ncols is None and col_labels is not None:
+            ncols = len(col_labels)
+        elif ncols is None:
+            ncols = int(np.ceil(np.sqrt(len(jobs)))) if jobs else 1
+        if ncols < 1:
+            raise ValueError("ncols must be at least 1")
+        rows = [jobs[i:i + ncols] for i in range(0, len(jobs), ncols)]
+    if not rows:
+        raise ValueError("jobs must contain at least one map")
+    n = max(len(row) for row in rows)
+    return [row + [None] * (n - len(row)) for row in rows]
+
+
+def _render_tiles(grid, max_workers, trim):
+    """
+    Render every job in the grid, returning (tile, offset, size) by cell: the
+    cropped image, its position within the box shared by all images of the
+    same size, and the size of that box.
+    """
+    if max_workers is None:
+        max_workers = cpu_count() or 1
+    if max_workers < 1:
+        raise ValueError("max_workers must be at least 1")
+    tiles, boxes = {}, {}
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = {}
+        for i, row in enumerate(grid):
+            for j, job in enumerate(row):
+                if job is not None:
+                    futures[pool.submit(_render_job, job)] = (i, j)
+        try:
+            for future in as_completed(futures):
+                image = future.result()
+                box = _content_box(image) if trim else (
+                    0, image.shape[0], 0, image.shape[1])
+                tiles[futures[future]] = image[
+                    box[0]:box[1], box[2]:box[3]].copy(), box, image.shape
+                boxes.setdefault(image.shape, []).append(box)
+        except BaseException:
+            for future in futures:
+                future.cancel()
+            raise
+
+    # Place each tile within the box enclosing all tiles of the same size
+    union = {shape: (min(b[0] for b in bs), max(b[1] for b in bs),
+                     min(b[2] for b in bs), max(b[3] for b in bs))
+             for shape, bs in boxes.items()}
+    cells = {}
+    for cell, (tile, box, shape) in tiles.items():
+        u = union[shape]
+        cells[cell] = tile, (box[0] - u[0], box[2] - u[2]), (
+            u[1] - u[0], u[3] - u[2])
+    return cells
+
+
+def _render_job(job):
+    """Render a single job into an RGBA array."""
+    if not isinstance(job, dict):
+        raise TypeError("job: expected dict, got {}".format(type(job)))
+    if 'file_out' in job:
+        raise ValueError("montage jobs must not contain 'file_out'")
+    kwargs = dict(job, output='array')
+    if "pscalars" in job:
+        return pscalar(None, **kwargs)
+    if "dscalars" in job:
+        return dscalar(None, **kwargs)
+    raise ValueError("job must contain either 'pscalars' or 'dscalars'")
+
+
+def _content_box(image):
+    """Find the (top, bottom, left, right) bounds of non-background pixels."""
+    content = np.any(image[:, :, :3] != image[0, 0, :3], axis=2)
+    rows, cols = np.flatnonzero(content.any(1)), np.flatnonzero(content.any(0))
+    if not rows.size:
+        return 0, 1, 0, 1
+    return rows[0], rows[-1] + 1, cols[0], cols[-1] + 1
+
+
+def _shared_colorbar(jobs):
+    """Find the colormap and range of values shared by every job."""
+    specs = dict()  # colormaps by stable key, as instances are not hashable
+    for job in jobs:
+        if "pscalars" in job:
+            cmap = job.get('cmap', 'magma')
+            # the range of the map as drawn, i.e. after zero-padding the other
+            # hemisphere of unilateral pscalars
+            x = images.map_unilateral_to_bilateral(
+                np.asarray(job['pscalars']), job.get('hemisphere'))
+            vrange = colormaps.colorbar_range(
+                x, job.get('vrange'), job.get('norm', 'linear'))
+        elif "dscalars" in job:
+            cmap = palettes.colorbar_cmap(job.get('palette', 'magma'))
+            vrange = raster.dscalar_range(
+                job['dscalars'], job.get('palette_params'))
+        else:
+            continue
+        specs.setdefault((colormaps.cmap_key(cmap), float(vrange[0]),
+                          float(vrange[1])), cmap)
+    if len(specs) != 1:
+        raise ValueError(
+            "colorbar=True requires every map to share a colormap and range "
+            "of values; pass a dict with keys 'cmap' and 'vrange' instead")
+    (_, vmin, vmax), cmap = specs.popitem()
+    return {'cmap': cmap, 'vrange': (vmin, vmax)}
@@ -1,4 +1,5 @@
-from os.path import join
+from os import environ
+from os.path import join, expanduser
 from .constants import DATA_DIR
 
 # TODO: add descriptions
@@ -11,3 +12,31 @@ PARCELLATION_FILE = join(
 
 SCENE_FILE = join(DATA_DIR, "Human.scene")
 SCENE_ZIP_FILE = join(DATA_DIR, "scene.zip")
+
+# Directory in which extracted scene workspaces (and other reusable files) are
+# cached between calls. Override by setting the WBPLOT_CACHE_DIR environment
+# variable before importing wbplot.
+CACHE_DIR = environ.get("WBPLOT_CACHE_DIR") or join(
+    environ.get("XDG_CACHE_HOME") or join(expanduser("~"), ".cache"),
+    "wbplot")
+
+# Connectome Workbench's command-line executable, and the number of seconds
+# after which a Workbench call is killed (None to wait indefinitely)
+WB_COMMAND = "wb_command"
+WB_TIMEOUT = 300
+
+# ffmpeg's command-line executable, used to write videos (e.g. .mp4 files) with
+# wbplot.dscalar_movie
+FFMPEG = "ffmpeg"
+
+# Whether wbplot.pscalar re-colours a cached image of the parcel drawn in each
+# pixel, when one has been made by wbplot.utils.parcels.calibrate, instead of
+# running Workbench
+PARCEL_IMAGES = True
+
+# Whether wbplot.pscalar and wbplot.dscalar reuse previously rendered images of
+# the same data and parameters, kept in the "results" subdirectory of
+# CACHE_DIR, and the total size (in bytes) beyond which the least recently
+# used images are evicted
+RESULT_CACHE = False
+RESULT_CACHE_BYTES = 1 << 30
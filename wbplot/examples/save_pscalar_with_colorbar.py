@@ -10,7 +10,6 @@ from wbplot import constants
 import matplotlib.pyplot as plt
 import matplotlib.colors as clrs
 from matplotlib import colorbar
-import matplotlib.image as mpimg
 from os.path import join
 import numpy as np
 
@@ -38,9 +37,10 @@ pscalars_l = np.array(
      1.33, 1.37, 1.37, 1.35, 1.31, 1.26, 1.40, 1.20, 1.16, 1.42, 1.21, 1.32,
      1.30, 1.24, 1.24, 1.13, 1.56, 1.62, 1.39, 1.22, 1.26, 1.17, 1.19, 1.12])
 x = (pscalars_l - pscalars_l.mean()) / pscalars_l.std()  # standardize
-file_out = join(output_dir, "test.png")
-pscalar(file_out=file_out, pscalars=x, hemisphere='left',
-        vrange=(-2, 2), cmap='magma', transparent=True)
+# Passing file_out=None returns the image as an RGBA array instead of saving
+# it, so it doesn't have to be written to disk and read back in again.
+img = pscalar(file_out=None, pscalars=x, hemisphere='left',
+              vrange=(-2, 2), cmap='magma', transparent=True)
 # Note that you'll want transparent=True if you plan to place the colorbar
 # inside the bounding box of the image!
 
@@ -51,9 +51,7 @@ fig = plt.figure(figsize=(3, 3/aspect))
 ax = fig.add_axes([0.075, 0, 0.85, 0.85])
 cax = fig.add_axes([0.44, 0.02, 0.12, 0.07])
 
-# Now we have to load the map into matplotlib. One way to do this is the
-# following:
-img = mpimg.imread(file_out)
+# Now we show the image array in matplotlib:
 im = ax.imshow(img)
 ax.axis('off')
 
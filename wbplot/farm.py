@@ -0,0 +1,173 @@
+"""Render many images concurrently using a pool of Connectome Workbench calls. """
+
+from wbplot.wbplot import pscalar, dscalar
+from wbplot.utils import templates
+from wbplot.utils.workbench import WorkbenchError
+from concurrent.futures import (
+    ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED)
+from collections import namedtuple
+from os import cpu_count
+import time
+
+RenderResult = namedtuple(
+    "RenderResult", ["index", "file_out", "ok", "error", "elapsed", "attempts"])
+RenderResult.__doc__ = """
+Outcome of a single job passed to :func:`render_many`.
+
+Attributes
+----------
+index : int
+    position of the job in the sequence of jobs
+file_out : str or None
+    the job's output file
+ok : bool
+    whether the image was rendered successfully
+error : Exception or None
+    the exception raised by the job, if it failed
+elapsed : float
+    wall time spent on the job, in seconds
+attempts : int
+    number of times the job was run
+"""
+
+
+def render_many(jobs, max_workers=None, executor='thread', max_pending=None,
+                progress=None, retries=0):
+    """
+    Render many images concurrently.
+
+    Parameters
+    ----------
+    jobs : iterable of dict
+        keyword arguments for :func:`wbplot.pscalar` (if the dict contains the
+        key 'pscalars') or :func:`wbplot.dscalar` (if it contains 'dscalars').
+        may be a generator, in which case jobs are only created as workers
+        become available
+    max_workers : int or None, default None
+        maximum number of images rendered at once; if None, use the number of
+        CPUs on the machine
+    executor : 'thread' or 'process', default 'thread'
+        whether jobs run in a pool of threads or of processes
+    max_pending : int or None, default None
+        maximum number of jobs submitted to the pool but not yet finished; if
+        None, use twice `max_workers`
+    progress : Callable[int, int or None, RenderResult] or None, default None
+        called after each job finishes with the number of jobs finished so far,
+        the total number of jobs (None if `jobs` has no length) and the job's
+        :class:`RenderResult`
+    retries : int, default 0
+        number of times a job is retried if Connectome Workbench fails or times
+        out (see wbplot.config.WB_TIMEOUT); other errors are not retried
+
+    Returns
+    -------
+    list of RenderResult
+        one result per job, in the order the jobs were given
+
+    Raises
+    ------
+    ValueError : invalid `max_workers`, `executor` or `max_pending` argument
+
+    Notes
+    -----
+    Failed jobs do not stop the remaining jobs from running; check the `ok`
+    and `error` attributes of the returned results. Because at most
+    `max_pending` jobs are in flight at any time, the number of temporary
+    render directories (and of job arguments held in memory when `jobs` is a
+    generator) stays bounded however many jobs there are.
+
+    """
+    if max_workers is None:
+        max_workers = cpu_count() or 1
+    if max_workers < 1:
+        raise ValueError("max_workers must be at least 1")
+    max_pending = 2 * max_workers if max_pending is None else max_pending
+    if max_pending < max_workers:
+        raise ValueError("max_pending must be at least max_workers")
+    if executor == 'thread':
+        pool = ThreadPoolExecutor(max_workers=max_workers)
+    elif executor == 'process':
+        templates.preload_templates()  # shared with forked workers
+        pool = ProcessPoolExecutor(max_workers=max_workers)
+    else:
+        raise ValueError("executor must be 'thread' or 'process'")
+
+    total = len(jobs) if hasattr(jobs, "__len__") else None
+    results = []
+    pending = set()
+    with pool:
+        try:
+            for index, job in enumerate(jobs):
+                if len(pending) >= max_pending:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    _collect(done, results, total, progress)
+                pending.add(pool.submit(_render_job, index, job, retries))
+            done, pending = wait(pending)
+            _collect(done, results, total, progress)
+        except BaseException:
+            for future in pending:
+                future.cancel()
+            raise
+    return sorted(results, key=lambda r: r.index)
+
+
+def _collect(done, results, total, progress):
+    """Append the results of finished futures and report progress."""
+    for future in done:
+        result = future.result()
+        results.append(result)
+        if progress is not None:
+            progress(len(results), total, result)
+
+
+def _render_job(index, job, retries=0):
+    """Render a single job, capturing any exception raised."""
+    start = time.perf_counter()
+    attempts = 0
+    while True:
+        attempts += 1
+        try:
+            _job_func(job, pscalar, dscalar)(**job)
+        except Exception as e:
+            if _retry(e, attempts, retries):
+                continue
+            return _job_result(index, job, start, attempts, e)
+        return _job_result(index, job, start, attempts, None)
+
+
+def _job_func(job, pscalar_func, dscalar_func):
+    """
+    Check a job's type and choose the function which renders it.
+
+    Returns
+    -------
+    Callable
+        `pscalar_func` if the job contains the key 'pscalars', or
+        `dscalar_func` if it contains 'dscalars'
+
+    Raises
+    ------
+    TypeError : `job` is not a dict
+    ValueError : `job` contains neither 'pscalars' nor 'dscalars'
+
+    """
+    if not isinstance(job, dict):
+        raise TypeError("job: expected dict, got {}".format(type(job)))
+    if "pscalars" in job:
+        return pscalar_func
+    if "dscalars" in job:
+        return dscalar_func
+    raise ValueError("job must contain either 'pscalars' or 'dscalars'")
+
+
+def _retry(error, attempts, retries):
+    """Whether a job which raised `error` on attempt `attempts` is rerun."""
+    return isinstance(error, WorkbenchError) and attempts <= retries
+
+
+def _job_result(index, job, start, attempts, error):
+    """Make the result of a job which started at time `start`."""
+    file_out = job.get("file_out") if isinstance(job, dict) else None
+    elapsed = time.perf_counter() - start
+    return RenderResult(
+        index, file_out, error is None, error, elapsed, attempts)
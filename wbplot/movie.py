@@ -0,0 +1,264 @@
+"""Render dense scalar series frame by frame, and stream them into animations. """
+
+from wbplot.wbplot import (
+    _check_backend, _check_dscalar_args, _write_dscalars)
+from wbplot.utils import images, raster, outputs, workspaces, animation
+from wbplot.utils import workbench
+from wbplot.utils.lazy import lazy_import
+from wbplot import constants
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+from functools import partial
+from collections import deque
+from os.path import join, splitext
+from os import cpu_count
+import numpy as np
+import queue
+
+nib = lazy_import("nibabel")
+
+
+def dscalar_frames(dscalars, orientation='landscape', hemisphere=None,
+                   palette='magma', transparent=False, palette_params=None,
+                   backend='workbench', frames=None, max_workers=None):
+    """
+    Render the maps of a dense scalar series one at a time, in order.
+
+    Parameters
+    ----------
+    dscalars : numpy.ndarray or str
+        dense scalar values, of shape (n_frames, 59412), or absolute path to a
+        .npy file or CIFTI file (e.g. a .dtseries.nii or .dscalar.nii file)
+        holding such an array. files are memory-mapped, so only the frames
+        being rendered are read into memory
+    orientation : 'portrait' or 'landscape', default 'landscape'
+        orientation of the frames. if hemisphere is None (i.e., if data are
+        bilateral), this argument is ignored.
+    hemisphere : 'left' or 'right' or None, default None
+        which hemisphere to plot. if bilateral, use None
+    palette : str, default 'magma'
+        color palette to use for plotting
+    transparent : bool, default False
+        make all white pixels in the frames transparent
+    palette_params : dict or None, default None
+        see :func:`wbplot.dscalar`. pass 'pos-user' and 'neg-user' to keep the
+        same color scale in every frame
+    backend : 'workbench' or 'numpy', default 'workbench'
+        see :func:`wbplot.dscalar`
+    frames : sequence of int or None, default None
+        indices of the frames to render; if None, render every frame
+    max_workers : int or None, default None
+        maximum number of frames rendered at once; if None, use the number of
+        CPUs on the machine
+
+    Yields
+    ------
+    numpy.ndarray
+        RGBA image of each frame, of shape (height, width, 4)
+
+    Raises
+    ------
+    ValueError : invalid arguments, or `dscalars` does not have 59412 columns
+    WorkbenchError : Connectome Workbench failed to render a frame
+
+    Notes
+    -----
+    Frames are rendered in parallel, but at most twice `max_workers` frames
+    are in flight or waiting to be consumed at any time, so memory use does
+    not grow with the length of the series. With the Workbench backend, each
+    worker renders all of its frames in a single workspace, re-using the
+    template DSCALAR header; nothing is rendered until the first frame is
+    requested.
+
+    """
+    args = _check_frames_args(
+        dscalars, orientation, hemisphere, palette, backend, frames,
+        max_workers)
+    return _frames(*args, palette_params=palette_params, finish=partial(
+        outputs.from_array, transparent=transparent))
+
+
+def dscalar_movie(file_out, dscalars, fps=10, loop=0, orientation='landscape',
+                  hemisphere=None, palette='magma', transparent=False,
+                  palette_params=None, backend='workbench', frames=None,
+                  max_workers=None):
+    """
+    Save an animation of a dense scalar series.
+
+    Parameters
+    ----------
+    file_out : str
+        absolute path to the output file. '.png' and '.apng' files are written
+        as animated PNGs, '.gif' files as GIFs, and anything else (e.g. '.mp4')
+        by piping frames to ffmpeg (see wbplot.config.FFMPEG)
+    dscalars : numpy.ndarray or str
+        see :func:`dscalar_frames`
+    fps : float, default 10
+        frames per second
+    loop : int, default 0
+        number of times an animated PNG or GIF plays; 0 to loop forever
+    orientation, hemisphere, palette, transparent, palette_params, backend,
+    frames, max_workers
+        see :func:`dscalar_frames`
+
+    Returns
+    -------
+    int
+        number of frames written
+
+    Raises
+    ------
+    ValueError : invalid arguments
+    RuntimeError : ffmpeg could not be run or failed
+    WorkbenchError : Connectome Workbench failed to render a frame
+
+    Notes
+    -----
+    Each frame is encoded and written as soon as it is rendered, so only a
+    few frames are held in memory however long the series.
+
+    """
+    if not splitext(file_out)[1]:
+        file_out += ".png"
+    args = _check_frames_args(
+        dscalars, orientation, hemisphere, palette, backend, frames,
+        max_workers)
+    with animation.open_writer(file_out, fps, loop) as writer:
+        # Frames are encoded by the worker threads too, then written in order
+        def finish(image):
+            return writer.encode(
+                outputs.from_array(image, transparent=transparent))
+        rendered = _frames(*args, palette_params=palette_params, finish=finish)
+        try:
+            for frame in rendered:
+                writer.write(frame)
+        finally:
+            rendered.close()
+    return writer.frames
+
+
+def _check_frames_args(dscalars, orientation, hemisphere, palette, backend,
+                       frames, max_workers):
+    """
+    Check the inputs of :func:`dscalar_frames`.
+
+    Returns
+    -------
+    series : numpy.ndarray or nibabel.arrayproxy.ArrayProxy
+    frames : sequence of int
+    scene, width, height : int
+        see :func:`wbplot.utils.plots.map_params_to_scene`
+    palette, backend : str
+    max_workers : int
+
+    """
+    backend = _check_backend(backend)
+    series = _open_series(dscalars)
+    palette, scene, width, height = _check_dscalar_args(
+        series[0] if series.shape[0] else np.zeros(59412), orientation,
+        hemisphere, palette)
+    frames = range(series.shape[0]) if frames is None else list(frames)
+    if max_workers is None:
+        max_workers = cpu_count() or 1
+    if max_workers < 1:
+        raise ValueError("max_workers must be at least 1")
+    return series, frames, scene, width, height, palette, backend, max_workers
+
+
+def _open_series(dscalars):
+    """Open a dense scalar series, memory-mapping it if it is a file."""
+    if isinstance(dscalars, str):
+        if dscalars.endswith(".npy"):
+            series = np.load(dscalars, mmap_mode='r')
+        else:
+            series = nib.load(dscalars).dataobj  # reads frames on demand
+    elif hasattr(dscalars, "shape") and hasattr(dscalars, "__getitem__"):
+        series = dscalars
+    else:
+        series = np.asarray(dscalars)
+    if len(series.shape) != 2 or series.shape[1] != 59412:
+        raise ValueError(
+            "dscalars must have shape (n_frames, 59412), got {}".format(
+                series.shape))
+    return series
+
+
+def _frames(series, frames, scene, width, height, palette, backend,
+            max_workers, palette_params, finish):
+    """
+    Render frames in a pool of threads, yielding them in order after applying
+    ``finish(image)`` in the worker threads.
+    """
+    with ExitStack() as stack:
+        if backend == 'numpy':
+            renderer = raster.get_dense_renderer(scene, width, height)
+            render = _numpy_renderer(renderer, palette, palette_params)
+        else:
+            render = _workbench_renderer(
+                stack, max_workers, scene, width, height, palette,
+                palette_params)
+        # entered last, so running frames finish before workspaces are removed
+        pool = stack.enter_context(ThreadPoolExecutor(max_workers=max_workers))
+        pending = deque()
+        indices = iter(frames)
+        try:
+            while True:
+                while len(pending) < 2 * max_workers:
+                    index = next(indices, None)
+                    if index is None:
+                        break
+                    pending.append(pool.submit(
+                        _render_frame, render, finish, series, index))
+                if not pending:
+                    return
+                yield pending.popleft().result()
+        finally:
+            for future in pending:
+                future.cancel()
+
+
+def _render_frame(render, finish, series, index):
+    """Render and finish a single frame."""
+    return finish(render(series, index))
+
+
+def _numpy_renderer(renderer, palette, palette_params):
+    """Make a function which renders a frame with the NumPy rasterizer."""
+    def render(series, index):
+        dscalars = _read_frame(series, index)
+        return renderer.render(
+            raster.dscalar_colors(dscalars, palette, palette_params))
+    return render
+
+
+def _workbench_renderer(stack, max_workers, scene, width, height, palette,
+                        palette_params):
+    """
+    Make a function which renders a frame with Connectome Workbench, in one of
+    `max_workers` workspaces which are removed when `stack` is closed.
+    """
+    render_dirs = queue.Queue()
+    for _ in range(max_workers):
+        render_dirs.put(stack.enter_context(
+            workspaces.render_workspace(constants.DSCALAR_FILE)))
+
+    def render(series, index):
+        dscalars = _read_frame(series, index)
+        render_dir = render_dirs.get()
+        try:
+            scene_file = _write_dscalars(
+                render_dir, dscalars, palette, palette_params)
+            png = join(render_dir, "frame.png")
+            workbench.run(
+                ['-show-scene', scene_file, scene, png, width, height])
+            return outputs.from_png(png)
+        finally:
+            render_dirs.put(render_dir)
+    return render
+
+
+def _read_frame(series, index):
+    """Read one frame of a dense scalar series into memory."""
+    dscalars = np.asarray(series[index], dtype=np.float64)
+    images.check_dscalars(dscalars)
+    return dscalars
@@ -0,0 +1,292 @@
+"""Render many maps with the same settings, checking them only once. """
+
+from wbplot.wbplot import (
+    _check_backend, _check_file_out, _colorbar_drawer, _parcel_renderer,
+    _png_file, _show_scene)
+from wbplot.utils import plots, images, raster, outputs, palettes, colormaps
+from wbplot.utils import workspaces, profiling
+from wbplot import constants
+from contextlib import ExitStack
+from os.path import join, split
+from threading import Lock
+import numpy as np
+
+# Types of map which can be rendered, as named by map_params_to_scene
+DTYPES = ['pscalars', 'dscalars']
+
+
+class RenderPlan(object):
+    """
+    Settings shared by many renders of the same view, checked and resolved
+    once, e.g. to render thousands of permuted or null maps.
+
+    The scene, image size, colormap lookup table, template file and renderer
+    are resolved when the plan is made. :meth:`render` then only checks the
+    shape of each map before mapping it to colors and drawing it.
+
+    Parameters
+    ----------
+    dtype : 'pscalars' or 'dscalars'
+        whether the plan renders parcellated or dense scalars
+    orientation : 'portrait' or 'landscape', default 'landscape'
+        orientation of the images. ignored if hemisphere is None
+    hemisphere : 'left' or 'right' or None, default None
+        which hemisphere the maps correspond to. if bilateral, use None
+    cmap : str, default 'magma'
+        MATPLOTLIB colormap for pscalars, or Workbench color palette for
+        dscalars
+    vrange : tuple or None, default None
+        data (min, max) for plotting pscalars; if None, each map uses its own
+        range. the range of dscalars is set by `palette_params`
+    palette_params : dict or None, default None
+        see :func:`wbplot.dscalar`; dscalars only
+    transparent : bool, default False
+        make all white pixels in the images transparent
+    backend : 'workbench' or 'numpy', default 'workbench'
+        see :func:`wbplot.pscalar` and :func:`wbplot.dscalar`
+    output : 'array' or 'image' or 'png', default 'array'
+        format in which :meth:`render` returns images when no file is given
+    colorbar : bool or dict or None, default None
+        see :func:`wbplot.pscalar` and :func:`wbplot.dscalar`
+    norm : str, default 'linear'
+        see :func:`wbplot.pscalar`; pscalars only
+
+    Attributes
+    ----------
+    shape : tuple
+        shape of the maps which are rendered, e.g. (360,) for bilateral
+        pscalars
+    scene, width, height : int
+        see :func:`wbplot.utils.plots.map_params_to_scene`
+
+    Raises
+    ------
+    ValueError : invalid arguments
+
+    Notes
+    -----
+    Renders made with Connectome Workbench all take place in a single render
+    directory, which is created by the first of them and removed by
+    :meth:`close`; use the plan as a context manager to close it. These
+    renders are made one at a time, so make one plan per thread to render in
+    parallel. The result cache (see :mod:`wbplot.utils.results`) is not used.
+
+    Example
+    -------
+    >>> with wbplot.RenderPlan('pscalars', vrange=(-3, 3)) as plan:
+    ...     for i, x in enumerate(nulls):
+    ...         plan.render(x, "/tmp/null-{}.png".format(i))
+
+    """
+
+    def __init__(self, dtype, orientation='landscape', hemisphere=None,
+                 cmap='magma', vrange=None, palette_params=None,
+                 transparent=False, backend='workbench', output='array',
+                 colorbar=None, norm='linear'):
+        if dtype not in DTYPES:
+            raise ValueError("dtype must be one of {}".format(DTYPES))
+        self.dtype = dtype
+        self.backend = _check_backend(backend)
+        orientation = plots.check_orientation(orientation)
+        self.hemisphere = images.check_dense_hemi(hemisphere)
+        outputs.check_output(None, output)
+        self.output = output
+        self.transparent = transparent
+        self.scene, self.width, self.height = plots.map_params_to_scene(
+            dtype=dtype, orientation=orientation, hemisphere=self.hemisphere)
+
+        if dtype == 'pscalars':
+            if palette_params is not None:
+                raise ValueError("palette_params are only used with dscalars")
+            self.cmap = plots.check_cmap_plt(cmap)
+            self.norm = colormaps.check_norm(norm)
+            colormaps.get_lut(self.cmap)
+            self.vrange = None if vrange is None else plots.check_vrange(
+                vrange)
+            self.palette_params = None
+            self.shape = (360,) if self.hemisphere is None else (180,)
+            mpl_cmap = self.cmap
+            self._renderer = _parcel_renderer(
+                self.scene, self.width, self.height, self.backend)
+            if self._renderer is None:
+                self._cifti = images.Cifti()
+        else:
+            if vrange is not None:
+                raise ValueError(
+                    "vrange is only used with pscalars; set the range of "
+                    "dscalars with palette_params")
+            if norm != 'linear':
+                raise ValueError(
+                    "norm is only used with pscalars; set the scale mode of "
+                    "dscalars with palette_params")
+            self.cmap = plots.check_cmap_wb(cmap)
+            self.norm = norm
+            self.vrange = None
+            self.palette_params = (
+                None if palette_params is None else dict(palette_params))
+            self.shape = (59412,)
+            mpl_cmap = None
+            if colorbar:
+                mpl_cmap = palettes.colorbar_cmap(self.cmap)
+            elif self.backend == 'numpy':
+                mpl_cmap = palettes.mpl_cmap(self.cmap)
+            if self.backend == 'numpy':
+                raster.colormap_lut(mpl_cmap)
+                self._renderer = raster.get_dense_renderer(
+                    self.scene, self.width, self.height)
+            else:
+                self._renderer = None
+                self._writer = images.get_cifti_writer(constants.DSCALAR_FILE)
+                # None if some params must be applied by wb_command
+                self._xml = None
+                if not palettes.split_params(self.palette_params)[1]:
+                    self._xml = palettes.palette_xml(
+                        self.cmap, self.palette_params)
+
+        # A colorbar spans each map's own range unless it is fixed by vrange
+        self._colorbar = colorbar
+        self._draw = None
+        if colorbar:
+            self._draw = _colorbar_drawer(colorbar, mpl_cmap, (
+                colormaps.colorbar_range((), self.vrange, self.norm)))
+        self._mpl_cmap = mpl_cmap
+        self._stack = ExitStack()
+        self._render_dir = None
+        self._lock = Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __repr__(self):
+        return ("RenderPlan(dtype={!r}, scene={}, cmap={!r}, vrange={!r}, "
+                "backend={!r})".format(self.dtype, self.scene, self.cmap,
+                                       self.vrange, self.backend))
+
+    def render(self, data, file_out=None):
+        """
+        Render one map.
+
+        Parameters
+        ----------
+        data : numpy.ndarray
+            scalar values, of shape `self.shape`
+        file_out : str or file-like or None, default None
+            absolute path to a .png file, or a binary file-like object, to
+            which the image is written; if None, return the image in the format
+            set by `output`
+
+        Returns
+        -------
+        None or numpy.ndarray or PIL.Image.Image or bytes
+            the image, if `file_out` is None
+
+        Raises
+        ------
+        ValueError : `data` does not have shape `self.shape`
+        TypeError : `file_out` is not a path, a file-like object or None
+        WorkbenchError : Connectome Workbench failed to render the image, or
+            timed out (see wbplot.config.WB_TIMEOUT)
+
+        """
+        with profiling.stage('RenderPlan.render'):
+            with profiling.stage('validation'):
+                data = self._check(data)
+                if file_out is not None:
+                    outputs.check_output(file_out, self.output)
+                    file_out = _check_file_out(file_out)
+            draw = self._draw
+            if self._colorbar and self.vrange is None:
+                draw = _colorbar_drawer(
+                    self._colorbar, self._mpl_cmap, self._range(data))
+            if self.dtype == 'pscalars':
+                return self._render_pscalars(data, file_out, draw)
+            return self._render_dscalars(data, file_out, draw)
+
+    def close(self):
+        """Remove the render directory used by Connectome Workbench, if any."""
+        with self._lock:
+            self._stack.close()
+            self._render_dir = None
+
+    def _check(self, data):
+        """Check the shape of a map, and make pscalars bilateral."""
+        data = np.asarray(data)
+        if data.shape != self.shape:
+            raise ValueError("{} must have shape {}, got {}".format(
+                self.dtype, self.shape, data.shape))
+        if self.dtype == 'dscalars' or self.hemisphere is None:
+            return data
+        bilateral = np.zeros(360)  # as images.map_unilateral_to_bilateral
+        if self.hemisphere == 'right':
+            bilateral[:180] = data
+        else:
+            bilateral[180:] = data
+        return bilateral
+
+    def _range(self, data):
+        """Get the range of values spanned by a map's colorbar."""
+        if self.dtype == 'pscalars':
+            return colormaps.colorbar_range(data, self.vrange, self.norm)
+        return raster.dscalar_range(data, self.palette_params)
+
+    def _workspace(self):
+        """Get the render directory, creating it on first use."""
+        if self._render_dir is None:
+            image_file = (constants.DLABEL_FILE if self.dtype == 'pscalars'
+                          else constants.DSCALAR_FILE)
+            self._render_dir = self._stack.enter_context(
+                workspaces.render_workspace(image_file))
+        return self._render_dir
+
+    def _render_pscalars(self, pscalars, file_out, draw):
+        """Render checked, bilateral `pscalars`."""
+        if self._renderer is not None:
+            with profiling.stage('colormap'):
+                colors = colormaps.map_colors(
+                    pscalars, self.cmap, self.vrange, self.norm)[:, :3] * 255
+            with profiling.stage('raster'):
+                image = self._renderer.render(colors)
+            return outputs.from_array(
+                image, file_out, self.output, self.transparent, draw)
+        with self._lock:
+            render_dir = self._workspace()
+            with profiling.stage('colormap'):
+                self._cifti.set_colors(colormaps.map_colors(
+                    pscalars, self.cmap, self.vrange, self.norm))
+            self._cifti.save(
+                join(render_dir, split(constants.DLABEL_FILE)[1]))
+            return self._show_scene(render_dir, file_out, draw)
+
+    def _render_dscalars(self, dscalars, file_out, draw):
+        """Render checked `dscalars`."""
+        if self._renderer is not None:
+            with profiling.stage('colormap'):
+                colors = raster.dscalar_colors(
+                    dscalars, self.cmap, self.palette_params)
+            with profiling.stage('raster'):
+                image = self._renderer.render(colors)
+            return outputs.from_array(
+                image, file_out, self.output, self.transparent, draw)
+        with self._lock:
+            render_dir = self._workspace()
+            temp_cifti = join(render_dir, split(constants.DSCALAR_FILE)[1])
+            if self._xml is None:
+                images.write_dense_image(
+                    dscalars, temp_cifti, self.cmap, self.palette_params)
+            else:
+                with profiling.stage('cifti_write'):
+                    self._writer.write(
+                        temp_cifti, xml=self._xml, data=dscalars)
+                    profiling.add_file(temp_cifti)
+            return self._show_scene(render_dir, file_out, draw)
+
+    def _show_scene(self, render_dir, file_out, draw):
+        """Render the scene in `render_dir` with Workbench and deliver it."""
+        png = _png_file(file_out, render_dir)
+        _show_scene(join(render_dir, "Human.scene"), self.scene, png,
+                    self.width, self.height)
+        return outputs.from_png(
+            png, file_out, self.output, self.transparent, draw)
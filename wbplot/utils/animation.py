@@ -0,0 +1,360 @@
+"""Stream frames into animated PNG, GIF or ffmpeg video files. """
+
+import numpy as np
+from .. import config
+from .lazy import lazy_import
+from io import BytesIO
+from fractions import Fraction
+from os.path import splitext
+import subprocess
+import tempfile
+import struct
+import zlib
+
+Image = lazy_import("PIL.Image")
+
+# File extensions written natively; any other extension is written by ffmpeg
+APNG_EXTENSIONS = ['.png', '.apng']
+GIF_EXTENSIONS = ['.gif']
+
+
+def open_writer(file_out, fps=10, loop=0):
+    """
+    Open a writer for an animation, chosen by the extension of `file_out`.
+
+    Parameters
+    ----------
+    file_out : str
+        absolute path to the output file. '.png' and '.apng' files are written
+        as animated PNGs, '.gif' files as GIFs, and anything else (e.g. '.mp4')
+        by ffmpeg (see wbplot.config.FFMPEG)
+    fps : float, default 10
+        frames per second
+    loop : int, default 0
+        number of times an animated PNG or GIF plays; 0 to loop forever
+
+    Returns
+    -------
+    ApngWriter or GifWriter or FfmpegWriter
+
+    Raises
+    ------
+    ValueError : invalid `fps` or `loop` argument
+
+    """
+    if not fps > 0:
+        raise ValueError("fps must be positive")
+    if loop < 0:
+        raise ValueError("loop must be non-negative")
+    ext = splitext(file_out)[1].lower()
+    if ext in APNG_EXTENSIONS:
+        return ApngWriter(file_out, fps, loop)
+    if ext in GIF_EXTENSIONS:
+        return GifWriter(file_out, fps, loop)
+    return FfmpegWriter(file_out, fps)
+
+
+class _Writer:
+    """Common interface of the animation writers."""
+
+    def __init__(self, file_out, fps):
+        self.file_out = file_out
+        self.fps = fps
+        self.size = None
+        self.frames = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def encode(self, image):
+        """
+        Compress a frame, ready to be written. Frames may be encoded in
+        parallel by several threads, and then written in order.
+
+        Parameters
+        ----------
+        image : numpy.ndarray
+            RGB or RGBA image of shape (height, width, 3 or 4), dtype uint8
+
+        Returns
+        -------
+        tuple
+            the shape of `image` and its encoded data
+
+        """
+        return image.shape, self._encode(image)
+
+    def write(self, image):
+        """
+        Append a frame to the animation.
+
+        Parameters
+        ----------
+        image : numpy.ndarray or tuple
+            RGB or RGBA image of shape (height, width, 3 or 4), dtype uint8,
+            or the frame returned by :meth:`encode`. every frame must have the
+            same shape
+
+        Returns
+        -------
+        None
+
+        Raises
+        ------
+        ValueError : `image` does not have the shape of the first frame
+
+        """
+        shape, data = self.encode(image) if isinstance(
+            image, np.ndarray) else image
+        if self.size is None:
+            self.size = shape
+        elif shape != self.size:
+            raise ValueError(
+                "frame {} has shape {}, but the first frame has shape "
+                "{}".format(self.frames, shape, self.size))
+        self._write(shape, data)
+        self.frames += 1
+
+    def close(self):
+        """Finish writing the animation."""
+        raise NotImplementedError
+
+    def _encode(self, image):
+        raise NotImplementedError
+
+    def _write(self, shape, data):
+        raise NotImplementedError
+
+
+class ApngWriter(_Writer):
+    """
+    Write an animated PNG one frame at a time.
+
+    Each frame is compressed by PIL and its image data are copied into the
+    file as soon as it is written, so only one frame is held in memory. The
+    number of frames is filled in by :meth:`close`.
+
+    """
+
+    def __init__(self, file_out, fps=10, loop=0):
+        super().__init__(file_out, fps)
+        self.loop = loop
+        self.fp = open(file_out, "wb")
+        self.sequence = 0
+        self.actl = None
+        self.delay = _fraction(1. / fps)
+
+    def _encode(self, image):
+        buf = BytesIO()
+        Image.fromarray(image).save(buf, "PNG")
+        return [(kind, data) for kind, data in _png_chunks(buf.getvalue())
+                if kind in (b"IHDR", b"IDAT")]
+
+    def _write(self, shape, chunks):
+        if self.actl is None:
+            self.fp.write(b"\x89PNG\r\n\x1a\n")
+            for kind, data in chunks:
+                if kind == b"IHDR":
+                    self._chunk(kind, data)
+            self.actl = self.fp.tell()
+            self._chunk(b"acTL", struct.pack(">II", 0, self.loop))
+        height, width = shape[:2]
+        self._chunk(b"fcTL", struct.pack(
+            ">IIIIIHHBB", self._next(), width, height, 0, 0, self.delay[0],
+            self.delay[1], 0, 0))
+        for kind, data in chunks:
+            if kind == b"IDAT":
+                if self.frames == 0:
+                    self._chunk(b"IDAT", data)
+                else:
+                    self._chunk(b"fdAT", struct.pack(">I", self._next()) + data)
+
+    def close(self):
+        if self.fp.closed:
+            return
+        try:
+            if self.actl is not None:
+                self._chunk(b"IEND", b"")
+                self.fp.seek(self.actl)
+                self._chunk(b"acTL", struct.pack(">II", self.frames, self.loop))
+        finally:
+            self.fp.close()
+
+    def _chunk(self, kind, data):
+        self.fp.write(struct.pack(">I", len(data)) + kind + data)
+        self.fp.write(struct.pack(">I", zlib.crc32(kind + data)))
+
+    def _next(self):
+        self.sequence += 1
+        return self.sequence - 1
+
+
+class GifWriter(_Writer):
+    """
+    Write an animated GIF one frame at a time.
+
+    Each frame is quantized and compressed by PIL, with its own color table,
+    and copied into the file as soon as it is written, so only one frame is
+    held in memory. Transparent pixels stay transparent.
+
+    """
+
+    def __init__(self, file_out, fps=10, loop=0):
+        super().__init__(file_out, fps)
+        self.loop = loop
+        self.fp = open(file_out, "wb")
+        self.duration = int(round(1000. / fps))
+
+    def _encode(self, image):
+        buf = BytesIO()
+        Image.fromarray(image).save(
+            buf, "GIF", duration=self.duration, disposal=2)
+        return _gif_frame(buf.getvalue())
+
+    def _write(self, shape, data):
+        if self.frames == 0:
+            height, width = shape[:2]
+            self.fp.write(b"GIF89a" + struct.pack("<HHBBB", width, height,
+                                                  0x70, 0, 0))
+            self.fp.write(b"!\xff\x0bNETSCAPE2.0\x03\x01" + struct.pack(
+                "<H", self.loop) + b"\x00")
+        self.fp.write(data)
+
+    def close(self):
+        if self.fp.closed:
+            return
+        try:
+            if self.frames:
+                self.fp.write(b";")
+        finally:
+            self.fp.close()
+
+
+class FfmpegWriter(_Writer):
+    """
+    Write a video by piping raw frames to ffmpeg.
+
+    Frames are padded to even dimensions and encoded in the yuv420p pixel
+    format, which most players support; transparency is not kept.
+
+    """
+
+    def __init__(self, file_out, fps=10):
+        super().__init__(file_out, fps)
+        self.proc = None
+        self.stderr = None
+
+    def _encode(self, image):
+        return np.ascontiguousarray(image).tobytes()
+
+    def _write(self, shape, data):
+        if self.proc is None:
+            self._start(shape)
+        try:
+            self.proc.stdin.write(data)
+        except (BrokenPipeError, OSError):
+            self.proc.stdin = None
+            self._wait()
+
+    def close(self):
+        if self.proc is not None:
+            self._wait()
+
+    def _start(self, shape):
+        height, width, depth = shape
+        args = [
+            config.FFMPEG, "-y", "-loglevel", "error", "-f", "rawvideo",
+            "-pix_fmt", "rgba" if depth == 4 else "rgb24",
+            "-s", "{}x{}".format(width, height), "-r", str(self.fps),
+            "-i", "-", "-vf", "pad=ceil(iw/2)*2:ceil(ih/2)*2",
+            "-pix_fmt", "yuv420p", self.file_out]
+        self.stderr = tempfile.TemporaryFile()
+        try:
+            self.proc = subprocess.Popen(
+                args, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL,
+                stderr=self.stderr)
+        except OSError as e:
+            self.stderr.close()
+            raise RuntimeError(
+                "could not run ffmpeg ({}); install it or set "
+                "wbplot.config.FFMPEG, or write a .png or .gif file "
+                "instead".format(e))
+
+    def _wait(self):
+        """Wait for ffmpeg to exit, raising an error if it failed."""
+        proc, self.proc = self.proc, None
+        if proc.stdin is not None:
+            try:
+                proc.stdin.close()
+            except OSError:
+                pass
+        returncode = proc.wait()
+        self.stderr.seek(0)
+        stderr = self.stderr.read().decode(errors="replace").strip()
+        self.stderr.close()
+        if returncode != 0:
+            raise RuntimeError("ffmpeg failed with exit code {}: {}".format(
+                returncode, stderr))
+
+
+def _png_chunks(png):
+    """Iterate over the (type, data) chunks of a PNG file's contents."""
+    pos = 8
+    while pos < len(png):
+        length, kind = struct.unpack(">I4s", png[pos:pos + 8])
+        yield kind, png[pos + 8:pos + 8 + length]
+        pos += 12 + length
+
+
+def _gif_frame(gif):
+    """
+    Extract the blocks of a single-frame GIF file, moving its global color
+    table into the image descriptor.
+    """
+    packed = gif[10]
+    pos = 13
+    table = b""
+    if packed & 0x80:
+        table = gif[pos:pos + 3 * 2 ** ((packed & 7) + 1)]
+        pos += len(table)
+    blocks = []
+    while gif[pos:pos + 1] != b";":
+        start = pos
+        if gif[pos] == 0x21:  # extension: label, then data sub-blocks
+            pos = _skip_sub_blocks(gif, pos + 2)
+            if gif[start + 1] != 0xff:  # drop application extensions
+                blocks.append(gif[start:pos])
+        elif gif[pos] == 0x2c:  # image descriptor, color table and data
+            desc = bytearray(gif[pos:pos + 10])
+            pos += 10
+            if desc[9] & 0x80:
+                size = 3 * 2 ** ((desc[9] & 7) + 1)
+                blocks.append(bytes(desc) + gif[pos:pos + size])
+                pos += size
+            else:
+                desc[9] |= 0x80 | (packed & 7)
+                blocks.append(bytes(desc) + table)
+            end = _skip_sub_blocks(gif, pos + 1)
+            blocks.append(gif[pos:end])
+            pos = end
+        else:
+            raise RuntimeError("unexpected block in GIF data")
+    return b"".join(blocks)
+
+
+def _skip_sub_blocks(data, pos):
+    """Find the end of the data sub-blocks starting at `pos`."""
+    while data[pos]:
+        pos += data[pos] + 1
+    return pos + 1
+
+
+def _fraction(x):
+    """Approximate `x` as a (numerator, denominator) pair of 16-bit ints."""
+    f = Fraction(x).limit_denominator(65535)
+    while f.numerator > 65535:
+        f = Fraction(f.numerator // 2, max(1, f.denominator // 2))
+    return f.numerator, f.denominator
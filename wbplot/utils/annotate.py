@@ -0,0 +1,340 @@
+"""Draw text and colorbars for figures with NumPy and PIL. """
+
+import numpy as np
+from . import plots
+from .lazy import lazy_import
+
+Image = lazy_import("PIL.Image")
+ImageDraw = lazy_import("PIL.ImageDraw")
+ImageFont = lazy_import("PIL.ImageFont")
+
+# Color of text drawn on figures
+TEXT_COLOR = (0, 0, 0, 255)
+
+# Positions of the colorbar or text within an image, as (x, y) fractions of
+# its width & height, and the corresponding PIL anchors
+LOCATIONS = {
+    "upper left": ((0., 0.), "la"), "upper center": ((0.5, 0.), "ma"),
+    "upper right": ((1., 0.), "ra"), "center left": ((0., 0.5), "lm"),
+    "center": ((0.5, 0.5), "mm"), "center right": ((1., 0.5), "rm"),
+    "lower left": ((0., 1.), "ld"), "lower center": ((0.5, 1.), "md"),
+    "lower right": ((1., 1.), "rd")}
+
+# Keyword arguments accepted by add_colorbar, besides cmap and vrange
+COLORBAR_OPTIONS = ['loc', 'length', 'thickness', 'orientation', 'margin',
+                    'ticks', 'tick_format', 'label', 'font_size', 'color']
+
+_fonts = {}
+
+
+def get_font(size):
+    """
+    Get the font in which text is drawn.
+
+    Parameters
+    ----------
+    size : int
+        font size, in pixels
+
+    Returns
+    -------
+    :class:~`PIL.ImageFont.ImageFont` or :class:~`PIL.ImageFont.FreeTypeFont`
+
+    """
+    font = _fonts.get(size)
+    if font is None:
+        try:
+            font = ImageFont.load_default(size=size)
+        except TypeError:  # Pillow < 10.1 has a single bitmap font
+            font = ImageFont.load_default()
+        _fonts[size] = font
+    return font
+
+
+def text_size(text, font):
+    """
+    Measure a line of text.
+
+    Parameters
+    ----------
+    text : str
+    font : :class:~`PIL.ImageFont.ImageFont`
+
+    Returns
+    -------
+    tuple
+        (width, height) of `text` in pixels
+
+    """
+    left, top, right, bottom = font.getbbox(text)
+    return right - left, bottom - top
+
+
+def draw_text(image, xy, text, font, anchor="mm", fill=TEXT_COLOR):
+    """
+    Draw a line of text onto an image, in place.
+
+    Parameters
+    ----------
+    image : :class:~`PIL.Image.Image`
+    xy : tuple
+        (x, y) position of the text's anchor, in pixels
+    text : str
+    font : :class:~`PIL.ImageFont.ImageFont`
+    anchor : str, default 'mm'
+        PIL text anchor, e.g. 'mm' to center the text on `xy`
+    fill : tuple, default TEXT_COLOR
+        RGBA color of the text
+
+    Returns
+    -------
+    None
+
+    """
+    if not text:
+        return
+    draw = ImageDraw.Draw(image)
+    try:
+        draw.text(xy, text, fill=fill, font=font, anchor=anchor)
+    except ValueError:  # anchors are not supported by bitmap fonts
+        w, h = text_size(text, font)
+        x = xy[0] - {"l": 0, "m": w / 2, "r": w}[anchor[0]]
+        y = xy[1] - {"a": 0, "t": 0, "m": h / 2, "b": h, "d": h}[anchor[1]]
+        draw.text((x, y), text, fill=fill, font=font)
+
+
+def colorbar(cmap, vrange, length, thickness, orientation='horizontal',
+             ticks=None, tick_format="{:.3g}", label=None, font_size=None,
+             color=TEXT_COLOR):
+    """
+    Draw a colorbar.
+
+    Parameters
+    ----------
+    cmap : str
+        matplotlib colormap
+    vrange : tuple
+        data (min, max) spanned by the colormap
+    length : int
+        length of the colored bar, in pixels
+    thickness : int
+        thickness of the colored bar, in pixels
+    orientation : 'horizontal' or 'vertical', default 'horizontal'
+        direction in which values increase along the bar
+    ticks : sequence of float or None, default None
+        values marked and labeled along the bar; if None, label the limits of
+        `vrange` at either end of the bar
+    tick_format : str, default '{:.3g}'
+        format string for the tick labels
+    label : str or None, default None
+        text drawn beneath (if horizontal) or above (if vertical) the bar
+    font_size : int or None, default None
+        size of the text, in pixels; if None, use `thickness`
+    color : tuple, default TEXT_COLOR
+        RGBA color of the text and tick marks
+
+    Returns
+    -------
+    numpy.ndarray
+        RGBA image of the colorbar on a transparent background, cropped to its
+        contents; dtype uint8
+
+    Raises
+    ------
+    ValueError : invalid `cmap`, `vrange` or `orientation` argument
+
+    """
+    cmap = plots.check_cmap_plt(cmap)
+    vrange = plots.check_vrange(vrange)
+    if orientation not in ['horizontal', 'vertical']:
+        raise ValueError("orientation must be 'horizontal' or 'vertical'")
+    length, thickness = int(length), int(thickness)
+    font = get_font(thickness if font_size is None else int(font_size))
+    pad = max(2, thickness // 4)
+    if ticks is not None:
+        ticks = [t for t in ticks if vrange[0] <= t <= vrange[1]]
+        strings = [tick_format.format(t) for t in ticks]
+    else:
+        strings = [tick_format.format(v) for v in vrange]
+    strings.append(label or "")
+
+    # Draw onto a canvas with room for text on every side, then crop it
+    margin = max(text_size(t, font)[0] for t in strings) + 2 * max(
+        text_size(t, font)[1] for t in strings) + 4 * pad
+    horizontal = orientation == 'horizontal'
+    w, h = (length, thickness) if horizontal else (thickness, length)
+    image = np.zeros((h + 2 * margin, w + 2 * margin, 4), dtype=np.uint8)
+    bar = gradient(cmap, length)
+    if horizontal:
+        image[margin:margin + h, margin:margin + w] = bar[None, :]
+    else:
+        image[margin:margin + h, margin:margin + w] = bar[::-1, None]
+    image = Image.fromarray(image, "RGBA")
+    draw = ImageDraw.Draw(image)
+    x0, y0, x1, y1 = margin, margin, margin + w, margin + h
+
+    if ticks is None:
+        lo, hi = strings[:2]
+        if horizontal:
+            draw_text(image, (x0 - pad, (y0 + y1) / 2), lo, font, "rm", color)
+            draw_text(image, (x1 + pad, (y0 + y1) / 2), hi, font, "lm", color)
+            bottom = y1
+        else:
+            draw_text(image, ((x0 + x1) / 2, y1 + pad), lo, font, "mt", color)
+            draw_text(image, ((x0 + x1) / 2, y0 - pad), hi, font, "md", color)
+    else:
+        for t, text in zip(ticks, strings):
+            f = (t - vrange[0]) / (vrange[1] - vrange[0])
+            if horizontal:
+                x = x0 + f * (w - 1)
+                draw.line([(x, y1), (x, y1 + pad)], fill=color)
+                draw_text(image, (x, y1 + 2 * pad), text, font, "ma", color)
+            else:
+                y = y1 - 1 - f * (h - 1)
+                draw.line([(x1, y), (x1 + pad, y)], fill=color)
+                draw_text(image, (x1 + 2 * pad, y), text, font, "lm", color)
+        bottom = y1 + 2 * pad + (text_size("0", font)[1] if horizontal else 0)
+    if label:
+        if horizontal:
+            draw_text(image, ((x0 + x1) / 2, bottom + pad), label, font, "ma",
+                      color)
+        else:
+            top = y0 - pad - (text_size(strings[1], font)[1] + pad
+                              if ticks is None else 0)
+            draw_text(image, ((x0 + x1) / 2, top), label, font, "md", color)
+    return np.asarray(image.crop(image.getbbox()))
+
+
+def add_colorbar(image, cmap, vrange, loc='lower center', length=0.3,
+                 thickness=None, orientation='horizontal', margin=0.02,
+                 **kwargs):
+    """
+    Draw a colorbar onto an image.
+
+    Parameters
+    ----------
+    image : numpy.ndarray
+        RGB or RGBA image of shape (height, width, 3 or 4), dtype uint8
+    cmap : str
+        matplotlib colormap
+    vrange : tuple
+        data (min, max) spanned by the colormap
+    loc : str or tuple, default 'lower center'
+        position of the colorbar: one of the keys of LOCATIONS, or the (x, y)
+        position of its center as fractions of the image's width and height
+    length : float, default 0.3
+        length of the colored bar, as a fraction of the image's width (if
+        horizontal) or height (if vertical)
+    thickness : int or None, default None
+        thickness of the colored bar, in pixels; if None, 1/15 of its length
+    orientation : 'horizontal' or 'vertical', default 'horizontal'
+        direction in which values increase along the bar
+    margin : float, default 0.02
+        gap between the colorbar and the edges of the image, as a fraction of
+        the image's smaller dimension
+    kwargs : dict
+        `ticks`, `tick_format`, `label`, `font_size` and `color`, passed to
+        :func:`colorbar`
+
+    Returns
+    -------
+    numpy.ndarray
+        RGBA image of shape (height, width, 4), dtype uint8
+
+    Raises
+    ------
+    ValueError : invalid arguments
+
+    """
+    size = image.shape[1] if orientation == 'horizontal' else image.shape[0]
+    length = max(2, int(round(length * size)))
+    thickness = max(2, length // 15) if thickness is None else thickness
+    bar = colorbar(cmap, vrange, length, thickness, orientation, **kwargs)
+    return _paste(image, bar, loc, margin)
+
+
+def add_text(image, text, loc='upper center', font_size=None, margin=0.02,
+             color=TEXT_COLOR):
+    """
+    Draw a line of text onto an image, e.g. a title.
+
+    Parameters
+    ----------
+    image : numpy.ndarray
+        RGB or RGBA image of shape (height, width, 3 or 4), dtype uint8
+    text : str
+    loc : str or tuple, default 'upper center'
+        position of the text: one of the keys of LOCATIONS, or the (x, y)
+        position of its center as fractions of the image's width and height
+    font_size : int or None, default None
+        size of the text, in pixels; if None, 1/30 of the image's height
+    margin : float, default 0.02
+        gap between the text and the edges of the image, as a fraction of the
+        image's smaller dimension
+    color : tuple, default TEXT_COLOR
+        RGBA color of the text
+
+    Returns
+    -------
+    numpy.ndarray
+        RGBA image of shape (height, width, 4), dtype uint8
+
+    Raises
+    ------
+    ValueError : invalid `loc` argument
+
+    """
+    font_size = max(6, image.shape[0] // 30) if font_size is None else font_size
+    font = get_font(int(font_size))
+    w, h = text_size(text, font)
+    pad = max(2, int(font_size) // 4)
+    label = Image.new("RGBA", (w + 2 * pad, h + 2 * pad), (0, 0, 0, 0))
+    draw_text(label, (label.width / 2, label.height / 2), text, font, "mm",
+              color)
+    return _paste(image, np.asarray(label), loc, margin)
+
+
+def gradient(cmap, length):
+    """
+    Sample a colormap at evenly spaced points.
+
+    Parameters
+    ----------
+    cmap : str
+        matplotlib colormap
+    length : int
+        number of samples
+
+    Returns
+    -------
+    numpy.ndarray
+        RGBA colors, shape (length, 4), dtype uint8
+
+    """
+    return plots.get_cmap(cmap)(np.linspace(0, 1, length), bytes=True)
+
+
+def _paste(image, overlay, loc, margin):
+    """Composite an RGBA overlay onto an image at the location `loc`."""
+    if image.shape[2] == 3:
+        image = np.concatenate(
+            [image, np.full(image.shape[:2] + (1,), 255, np.uint8)], axis=2)
+    height, width = image.shape[:2]
+    h, w = overlay.shape[:2]
+    if isinstance(loc, str):
+        if loc not in LOCATIONS:
+            raise ValueError("loc must be one of {} or an (x, y) tuple".format(
+                sorted(LOCATIONS)))
+        (fx, fy), anchor = LOCATIONS[loc]
+    else:
+        (fx, fy), anchor = loc, "mm"
+    m = int(round(margin * min(height, width)))
+    x = {"l": m, "m": fx * width - w / 2, "r": width - m - w}[anchor[0]]
+    y = {"a": m, "m": fy * height - h / 2, "d": height - m - h}[anchor[1]]
+    x = int(round(min(max(x, 0), max(width - w, 0))))
+    y = int(round(min(max(y, 0), max(height - h, 0))))
+    result = Image.fromarray(image, "RGBA")
+    result.alpha_composite(
+        Image.fromarray(overlay, "RGBA").crop((0, 0, width - x, height - y)),
+        (x, y))
+    return np.asarray(result)
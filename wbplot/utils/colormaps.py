@@ -0,0 +1,299 @@
+"""Map scalars to colors through cached colormap lookup tables. """
+
+import numpy as np
+from . import plots
+import hashlib
+
+# Normalizations which map values onto a colormap:
+#   linear - (x - vmin) / (vmax - vmin), as matplotlib.colors.Normalize
+#   log - the same in log10 space, as matplotlib.colors.LogNorm; values <= 0
+#       are drawn in the colormap's "bad" color
+#   symmetric - linear, over a range centered on zero which includes vrange,
+#       so that zero is drawn in the middle of a diverging colormap
+#   quantile - the fraction of the map's other finite values which are less
+#       than each value (after clipping to vrange), i.e. histogram equalized
+NORMS = ['linear', 'log', 'symmetric', 'quantile']
+
+# Normalizations under which colors vary linearly with values, so that the
+# colormap can be drawn as a colorbar
+LINEAR_NORMS = ['linear', 'symmetric']
+
+# Lookup tables built so far, by colormap name
+_luts = dict()
+
+
+def get_lut(cmap='magma'):
+    """
+    Get the lookup table of a matplotlib colormap.
+
+    Parameters
+    ----------
+    cmap : str or matplotlib.colors.Colormap, default 'magma'
+        name of a matplotlib colormap, or a colormap
+
+    Returns
+    -------
+    numpy.ndarray
+        read-only RGBA colors in [0, 1] of the colormap's N bins, followed by
+        its "under", "over" and "bad" colors; shape (N + 3, 4)
+
+    Raises
+    ------
+    ValueError : colormap is not available in matplotlib
+
+    Notes
+    -----
+    The table of a named colormap is built once and kept in memory. Colormap
+    instances may be modified after they are passed in, so their tables are
+    built each time.
+
+    """
+    if not isinstance(cmap, str) and cmap is not None:
+        return _build_lut(plots.get_cmap(cmap))
+    lut = _luts.get(cmap)
+    if lut is None:
+        lut = _build_lut(plots.get_cmap(cmap))
+        _luts[cmap] = lut
+    return lut
+
+
+def cmap_key(cmap):
+    """
+    Make a stable, hashable stand-in for a colormap, e.g. for cache keys.
+
+    Parameters
+    ----------
+    cmap : str or matplotlib.colors.Colormap
+
+    Returns
+    -------
+    str
+        `cmap` itself if it is a name, else a hash of its lookup table
+
+    """
+    if isinstance(cmap, str) or cmap is None:
+        return cmap
+    return "lut-" + hashlib.sha256(get_lut(cmap).tobytes()).hexdigest()
+
+
+def check_norm(norm):
+    """
+    Check that `norm` is one of NORMS.
+
+    Parameters
+    ----------
+    norm : str
+
+    Returns
+    -------
+    str
+
+    Raises
+    ------
+    ValueError : `norm` is not one of NORMS
+
+    """
+    if norm not in NORMS:
+        raise ValueError("norm must be one of {}".format(NORMS))
+    return norm
+
+
+def normalize(values, vrange=None, norm='linear'):
+    """
+    Scale values so that the colormap's range is [0, 1].
+
+    Parameters
+    ----------
+    values : numpy.ndarray
+        scalar values, of shape (n,) or (n_maps, n)
+    vrange : tuple or None, default None
+        data (min, max) mapped to the ends of the colormap; if None, each map
+        uses the range of its own finite values
+    norm : str, default 'linear'
+        one of NORMS
+
+    Returns
+    -------
+    numpy.ndarray
+        normalized values, of the same shape; NaN where a value cannot be
+        drawn (e.g. a NaN value, or one <= 0 with the 'log' norm)
+
+    Raises
+    ------
+    ValueError : invalid `norm` or `vrange`
+
+    """
+    check_norm(norm)
+    values = np.asarray(values)
+    if values.ndim not in (1, 2):
+        raise ValueError(
+            "values must have shape (n,) or (n_maps, n), got {}".format(
+                values.shape))
+    # Compute in the precision matplotlib.colors.Normalize would use
+    dtype = np.promote_types(values.dtype, np.float32)
+    if norm == 'log':
+        if vrange is not None and plots.check_vrange(vrange)[0] <= 0:
+            raise ValueError("vrange must be positive with the 'log' norm")
+        with np.errstate(invalid="ignore", divide="ignore"):
+            x = np.log10(np.where(values > 0, values, np.nan), dtype=dtype)
+            vrange = None if vrange is None else np.log10(vrange)
+    else:
+        x = np.array(values, dtype=dtype)
+    vmin, vmax = _limits(x, vrange)
+    if norm == 'symmetric':
+        vmax = np.maximum(np.abs(vmin), np.abs(vmax))
+        vmin = -vmax
+    elif norm == 'quantile':
+        if vrange is not None:
+            np.clip(x, vmin, vmax, out=x)
+        return _quantiles(x)
+    x -= vmin
+    with np.errstate(invalid="ignore", divide="ignore"):
+        x /= np.where(vmax > vmin, vmax - vmin, np.inf).astype(dtype)
+    return x
+
+
+def map_colors(values, cmap='magma', vrange=None, norm='linear'):
+    """
+    Map scalars to colors through a colormap's lookup table.
+
+    Parameters
+    ----------
+    values : numpy.ndarray
+        scalar values, of shape (n,) or (n_maps, n), e.g. bilateral pscalars
+        of shape (360,) or a batch of them
+    cmap : str, default 'magma'
+        name of a matplotlib colormap
+    vrange : tuple or None, default None
+        data (min, max) mapped to the ends of the colormap; if None, each map
+        uses the range of its own finite values
+    norm : str, default 'linear'
+        one of NORMS
+
+    Returns
+    -------
+    numpy.ndarray
+        RGBA colors in [0, 1], of shape values.shape + (4,)
+
+    Raises
+    ------
+    ValueError : invalid arguments
+
+    Notes
+    -----
+    Normalized values are binned into the lookup table exactly as matplotlib
+    does, so with the 'linear' norm colors are identical to those of a
+    :class:~`matplotlib.cm.ScalarMappable` with the same range.
+
+    """
+    lut = get_lut(cmap)
+    x = normalize(values, vrange, norm)
+
+    # index = floor(x * N), with x == 1 in the last bin; out-of-range and NaN
+    # values index the under, over and bad colors after the N bins
+    n = len(lut) - 3
+    x *= n
+    x[x == n] = n - 1
+    under = x < 0
+    over = x >= n
+    bad = np.isnan(x)
+    np.clip(x, 0, n - 1, out=x)
+    x[bad] = 0
+    index = x.astype(np.intp)
+    index[under] = n
+    index[over] = n + 1
+    index[bad] = n + 2
+    return np.take(lut, index, axis=0)
+
+
+def colorbar_range(values, vrange=None, norm='linear'):
+    """
+    Get the range of values spanned by the colorbar of a map.
+
+    Parameters
+    ----------
+    values : numpy.ndarray
+        scalar values of one map, of shape (n,); only used if `vrange` is None
+    vrange : tuple or None, default None
+        as passed to :func:`map_colors`
+    norm : str, default 'linear'
+        one of LINEAR_NORMS
+
+    Returns
+    -------
+    tuple
+        (min, max) of the colormap
+
+    Raises
+    ------
+    ValueError : invalid `vrange`, or `norm` is not one of LINEAR_NORMS
+
+    """
+    if norm not in LINEAR_NORMS:
+        check_norm(norm)
+        raise ValueError(
+            "colorbars cannot be drawn with the {!r} norm; use one of "
+            "{}".format(norm, LINEAR_NORMS))
+    x = np.asarray(values if vrange is None else (), dtype=np.float64)
+    vmin, vmax = (float(v) for v in np.ravel(_limits(x, vrange)))
+    if norm == 'symmetric':
+        vmax = max(abs(vmin), abs(vmax))
+        vmin = -vmax
+    return vmin, vmax
+
+
+def _build_lut(colormap):
+    """Build the read-only lookup table of a Colormap; see get_lut."""
+    n = colormap.N
+    lut = np.empty((n + 3, 4))
+    lut[:n] = colormap(np.arange(n))
+    lut[n:] = colormap(np.array([-1., 2., np.nan]))
+    lut.flags.writeable = False
+    return lut
+
+
+def _limits(x, vrange):
+    """Get the (min, max) of each map, broadcastable against the maps."""
+    if vrange is not None:
+        vmin, vmax = plots.check_vrange(tuple(vrange))
+        return x.dtype.type(vmin), x.dtype.type(vmax)
+    finite = np.isfinite(x)
+    with np.errstate(invalid="ignore"):
+        vmin = np.min(x, axis=-1, keepdims=True, where=finite, initial=np.inf)
+        vmax = np.max(
+            x, axis=-1, keepdims=True, where=finite, initial=-np.inf)
+    empty = ~finite.any(axis=-1, keepdims=True)
+    vmin[empty], vmax[empty] = 0., 1.
+    return vmin, vmax
+
+
+def _quantiles(x):
+    """
+    Replace each value by the fraction of the map's other finite values which
+    are less than it, counting ties as half; NaN and infinite values are NaN.
+    """
+    n = x.shape[-1]
+    order = np.argsort(x, axis=-1, kind="stable")  # NaNs sort last
+    ranked = np.take_along_axis(x, order, axis=-1)
+    finite = np.isfinite(ranked)
+    positions = np.broadcast_to(np.arange(n), ranked.shape)
+
+    # rank of a value = mean position of the run of values equal to it
+    starts = np.ones(ranked.shape, dtype=bool)
+    starts[..., 1:] = ranked[..., 1:] != ranked[..., :-1]
+    ends = np.ones(ranked.shape, dtype=bool)
+    ends[..., :-1] = starts[..., 1:]
+    first = np.maximum.accumulate(np.where(starts, positions, 0), axis=-1)
+    last = np.flip(np.minimum.accumulate(
+        np.flip(np.where(ends, positions, n), axis=-1), axis=-1), axis=-1)
+    ranks = (first + last) / 2.
+
+    # finite values are ranked after any -inf values
+    low = np.sum(ranked == -np.inf, axis=-1, keepdims=True)
+    count = np.sum(finite, axis=-1, keepdims=True)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        q = np.where(count > 1, (ranks - low) / (count - 1), 0.5)
+    q[~finite] = np.nan
+    result = np.empty(x.shape)
+    np.put_along_axis(result, order, q, axis=-1)
+    return result
@@ -1,14 +1,23 @@
 """Auxiliary functions pertaining to the manipulation of neuroimaging files. """
 
 import numpy as np
-import nibabel as nib
 from .. import constants, config
-from . import plots
-from os import system, remove
-from matplotlib import colors as clrs
-from matplotlib import cm
-import xml.etree.cElementTree as eT
-from nibabel.cifti2.parse_cifti2 import Cifti2Parser
+from . import plots, templates, palettes, workbench, profiling, colormaps
+from .lazy import lazy_import
+from io import BytesIO
+import os
+import re
+
+nib = lazy_import("nibabel")
+nifti1 = lazy_import("nibabel.nifti1")
+cifti2 = lazy_import("nibabel.cifti2")
+volumeutils = lazy_import("nibabel.volumeutils")
+
+# NIFTI extension code of the CIFTI-2 header XML
+CIFTI_ECODE = 32
+# Precompiled label tables & writers of template files, keyed by filename
+_label_tables = dict()
+_cifti_writers = dict()
 
 
 def map_unilateral_to_bilateral(pscalars, hemisphere):
@@ -216,7 +225,8 @@ def extract_gifti_data(of):
 
 
 def write_parcellated_image(
-        data, fout, hemisphere=None, cmap='magma', vrange=None):
+        data, fout, hemisphere=None, cmap='magma', vrange=None,
+        norm='linear'):
     """
     Change the colors for parcels in a dlabel file to illustrate pscalar data.
 
@@ -233,6 +243,9 @@ def write_parcellated_image(
         a valid MATPLOTLIB colormap used to plot the data
     vrange : tuple
         data (min, max) for plotting; if None, use (min(data), max(data))
+    norm : str, default 'linear'
+        normalization which maps values onto the colormap; one of
+        wbplot.utils.colormaps.NORMS
 
     Returns
     -------
@@ -256,7 +269,7 @@ def write_parcellated_image(
 
     # Change the colors assigned to each parcel and save to `fout`
     c = Cifti()
-    c.set_cmap(data=pscalars_lr, cmap=cmap, vrange=vrange)
+    c.set_cmap(data=pscalars_lr, cmap=cmap, vrange=vrange, norm=norm)
     c.save(fout)
 
 
@@ -274,8 +287,8 @@ def write_dense_image(dscalars, fout, palette='magma', palette_params=None):
     palette : str, default 'magma'
         name of color palette
     palette_params : dict or None, default None
-        additional (key: value) pairs passed to "wb_command -cifti-palette". for
-        more info, see
+        additional (key: value) pairs, as passed to "wb_command -cifti-palette".
+        for more info, see
         https://humanconnectome.org/software/workbench-command/-cifti-palette
 
     Returns
@@ -300,8 +313,8 @@ def write_dense_image(dscalars, fout, palette='magma', palette_params=None):
     Example usage of `palette_params`:
         palette_params = dict()
         palette_params["disp-zero"] = True
-        palette_params["disp-positive"] = True
-        palette_params["disp-negative"] = False
+        palette_params["disp-pos"] = True
+        palette_params["disp-neg"] = False
         palette_params["inversion"] = "POSITIVE_WITH_NEGATIVE"
     The above, passed to this function, would invert the color palette and
     display only positive- and zero-valued scalars (when `fout` is opened in
@@ -312,10 +325,10 @@ def write_dense_image(dscalars, fout, palette='magma', palette_params=None):
 
     >> palette_params = {
         "pos-user": (pos_min, pos_max), "neg-user": (neg_min, neg_max)}
-    where pos_min is the minimum positive value shown, pos_max is the maximum
-    positive value shown, neg_min is the minimum negative (ie, most negative)
-    value shown, and neg_max is the maximum negative (ie, least negative) value
-    shown
+    where pos_min and pos_max are the positive values mapped to the start and
+    the end of the positive half of the palette, and neg_min and neg_max are
+    the negative values mapped to the start (ie, least negative) and the end
+    (ie, most negative) of its negative half, e.g. (0, -3)
 
     or
 
@@ -324,9 +337,15 @@ def write_dense_image(dscalars, fout, palette='magma', palette_params=None):
     where pos_min, pos_max, neg_min, and neg_max are the same as before but
     expressed as *percentages* of the positive and negative values
 
+    The palette is written directly into the file's metadata, with the same
+    effect as "wb_command -cifti-palette", if every key of `palette_params` is
+    supported (see :func:`wbplot.utils.palettes.palette_mapping`). Otherwise
+    "wb_command -cifti-palette" is run, so any of its options may be given.
+
     Raises
     ------
     ValueError : palette_params contains an invalid key,value pair
+    WorkbenchError : "wb_command -cifti-palette" failed
 
     """
     # TODO: add function for users to map from 32k unilateral to CIFTI subset
@@ -335,63 +354,28 @@ def write_dense_image(dscalars, fout, palette='magma', palette_params=None):
     if fout[-12:] != ".dscalar.nii":  # TODO: improve input handling
         fout += ".dscalar.nii"
 
-    new_data = np.copy(dscalars)
-
-    # Load template dscalar file
-    of = nib.load(constants.DSCALAR_FILE)
-    temp_data = np.asanyarray(of.dataobj)
-
-    # Write new data to file
-    data_to_write = new_data.reshape(np.shape(temp_data))
-    new_img = nib.Cifti2Image(
-        dataobj=data_to_write, header=of.header, nifti_header=of.nifti_header)
-    prefix = fout.split(".")[0]
-    cifti_palette_input = prefix + "_temp.dscalar.nii"
-    nib.save(new_img, cifti_palette_input)
-
-    # Use Workbench's command line utilities to change color palette
-    mode = "MODE_AUTO_SCALE"  # default mode (not DMN, haha)
-    disp_zero = disp_neg = disp_pos = True
-    if palette_params:
-        args = list(palette_params.keys())
-        if "pos-percent" in args and "neg-percent" in args:
-            mode = "MODE_AUTO_SCALE_PERCENTAGE"
-        elif "pos-user" in args and "neg-user" in args:
-            mode = "MODE_USER_SCALE"
-        if "disp-pos" in args:
-            disp_pos = palette_params["disp-pos"]
-        if "disp-neg" in args:
-            disp_neg = palette_params["disp-neg"]
-        if "disp-zero" in args:
-            disp_zero = palette_params["disp-zero"]
-    cmd = "wb_command -cifti-palette {} {} {}".format(
-        cifti_palette_input, mode, fout)
-    cmd += " -palette-name {}".format(palette)
-    cmd += " -disp-zero {}".format(disp_zero)
-    cmd += " -disp-pos {}".format(disp_pos)
-    cmd += " -disp-neg {}".format(disp_neg)
-
-    # Update command with provided parameters. NOTE these must be consistent
-    # with the format expected by "wb_command -cifti-palette": see
-    # https://www.humanconnectome.org/software/workbench-command/-cifti-palette
-    if palette_params:
-        for k, v in palette_params.items():
-            if k in ["disp-zero", "disp-pos", "disp-neg"]:
-                continue
-            if hasattr(v, '__iter__'):
-                if len(v) != 2:
-                    raise ValueError(
-                        "palette params must be a dict with values which are "
-                        "either strings, numbers, or tuples")
-                cmd += " -{} {} {}".format(k, v[0], v[1])
-            else:
-                cmd += " -{} {}".format(k, v)
-
-    # We're ready to change palette and save new file to `fout`
-    system(cmd)
-
-    # Remove file which was only used temporarily
-    remove(cifti_palette_input)
+    # Write the color palette into the template's header XML (cached for each
+    # palette), and splice it & the new data into the template file
+    supported, other = palettes.split_params(palette_params)
+    with profiling.stage('colormap'):
+        xml = palettes.palette_xml(palette, supported)
+    writer = get_cifti_writer(constants.DSCALAR_FILE)
+    if not other:
+        with profiling.stage('cifti_write'):
+            writer.write(fout, xml=xml, data=dscalars)
+            profiling.add_file(fout)
+        return
+
+    # Options which are not written in-process are applied by wb_command
+    temp = fout[:-len(".dscalar.nii")] + "_temp.dscalar.nii"
+    with profiling.stage('cifti_write'):
+        writer.write(temp, xml=xml, data=dscalars)
+        profiling.add_file(temp)
+    mode, *options = palettes.palette_args(palette, palette_params)
+    try:
+        workbench.run(['-cifti-palette', temp, mode, fout] + options)
+    finally:
+        os.remove(temp)
 
 
 class Cifti(object):
@@ -402,17 +386,18 @@ class Cifti(object):
     """
 
     def __init__(self):
-        of = nib.load(config.PARCELLATION_FILE)  # must be a DLABEL file!!
-        self.data = np.asanyarray(of.dataobj)
+        # The template is loaded once per process and shared between instances
+        of = templates.load_template(config.PARCELLATION_FILE)  # DLABEL file!!
+        self.data = templates.template_data(config.PARCELLATION_FILE)
         self.header = of.header
         self.nifti_header = of.nifti_header
-        # self.extensions = eT.fromstring(  BROKEN AS OF NIBABEL 3.2
-        #     self.nifti_header.extensions[0].get_content().to_xml())
-        self.tree = eT.fromstring(self.header.to_xml())
+        self.label_table = get_label_table(config.PARCELLATION_FILE)
+        self.xml = None
         self.vrange = None
         self.ischanged = False
 
-    def set_cmap(self, data, cmap='magma', vrange=None, mappable=None):
+    def set_cmap(self, data, cmap='magma', vrange=None, mappable=None,
+                 norm='linear', vectorized=False):
         """
         Map scalar data to RGBA values and update file header metadata.
 
@@ -425,8 +410,16 @@ class Cifti(object):
         vrange : tuple or None, default None
             data (min, max) for illustration; if None, use (min(data),max(data))
         mappable : Callable[float] or None, default None
-            can be used to override arguments `cmap` and `vrange`, e.g. by
-            specifying your own map from scalar input to RGBA output
+            can be used to override arguments `cmap`, `vrange` and `norm`,
+            e.g. by specifying your own map from scalar input to RGBA output.
+            it is called once per parcel, unless `vectorized` is True
+        norm : str, default 'linear'
+            normalization which maps values onto the colormap; one of
+            wbplot.utils.colormaps.NORMS
+        vectorized : bool, default False
+            call `mappable` once, with all of `data`, instead of once per
+            parcel; it must then return RGBA values of shape (360, 4), as e.g.
+            a matplotlib colormap does
 
         Returns
         -------
@@ -439,28 +432,45 @@ class Cifti(object):
 
         # Check input arguments
         cmap = plots.check_cmap_plt(cmap)
+        colormaps.check_norm(norm)
         self.vrange = (
             np.min(data), np.max(data)) if vrange is None else vrange
         self.vrange = plots.check_vrange(self.vrange)
 
         # Map scalar data to colors (R, G, B, Alpha)
-        if mappable is None:
-            cnorm = clrs.Normalize(vmin=self.vrange[0], vmax=self.vrange[1])
-            clr_map = cm.ScalarMappable(cmap=cmap, norm=cnorm)
-            colors = clr_map.to_rgba(data)
-        else:
-            colors = np.array([mappable(d) for d in data])
-
-        # Update file header metadata
-        for ii in range(1, len(self.tree[0][1][0][0])):
-            self.tree[0][1][0][0][ii].set(
-                'Red', str(colors[ii - 1, 0]))
-            self.tree[0][1][0][0][ii].set(
-                'Green', str(colors[ii - 1, 1]))
-            self.tree[0][1][0][0][ii].set(
-                'Blue', str(colors[ii - 1, 2]))
-            self.tree[0][1][0][0][ii].set(
-                'Alpha', str(colors[ii - 1, 3]))
+        with profiling.stage('colormap'):
+            if mappable is None:
+                # other norms find their own range, e.g. of positive values
+                colors = colormaps.map_colors(
+                    data, cmap, self.vrange if norm == 'linear' else vrange,
+                    norm)
+            elif vectorized:
+                colors = np.asarray(mappable(data), dtype=np.float64)
+                if colors.shape != data.shape + (4,):
+                    raise ValueError(
+                        "mappable must return RGBA values of shape {}, got "
+                        "{}".format(data.shape + (4,), colors.shape))
+            else:
+                colors = np.array([mappable(d) for d in data])
+
+            # Update file header metadata
+            self.set_colors(colors)
+
+    def set_colors(self, colors):
+        """
+        Update file header metadata with the color of each parcel.
+
+        Parameters
+        ----------
+        colors : numpy.ndarray
+            RGBA values in [0, 1], of shape (360, 4)
+
+        Returns
+        -------
+        None
+
+        """
+        self.xml = self.label_table.fill(colors)
         self.ischanged = True
 
     def save(self, fout):
@@ -478,20 +488,301 @@ class Cifti(object):
 
         """
         if self.ischanged:
-            cp = Cifti2Parser()
-            cp.parse(string=eT.tostring(self.tree))
-            header = cp.header
+            xml = self.xml
         else:
-            header = self.header
+            xml = templates.template_xml(config.PARCELLATION_FILE)
         if fout[-11:] != ".dlabel.nii":  # TODO: improve input handling
             fout += ".dlabel.nii"
-        new_img = nib.Cifti2Image(
-            self.data, header=header, nifti_header=self.nifti_header)
-        nib.save(new_img, fout)
+        writer = get_cifti_writer(config.PARCELLATION_FILE)
+        with profiling.stage('cifti_write'):
+            writer.write(fout, xml=xml, data=self.data)
+            profiling.add_file(fout)
+
+
+class LabelTable(object):
+    """
+    The label table in the header XML of a DLABEL file, split once into static
+    fragments and slots for the colors of each label, so that the XML for a
+    new set of colors is built with a single join.
+    """
+
+    _label = re.compile(
+        rb'<Label Key="[^"]*" Red="([^"]*)" Green="([^"]*)" '
+        rb'Blue="([^"]*)" Alpha="([^"]*)">')
+
+    def __init__(self, xml):
+        """
+        Parameters
+        ----------
+        xml : bytes
+            CIFTI-2 header XML, as serialized by nibabel
+
+        Raises
+        ------
+        RuntimeError : `xml` contains no labels
+
+        """
+        # The first label (key 0, '???') is not colored
+        labels = list(self._label.finditer(xml))[1:]
+        if not labels:
+            raise RuntimeError("no labels found in CIFTI-2 header XML")
+        fragments = np.empty((len(labels), 4), dtype=object)
+        pos = 0
+        for ii, match in enumerate(labels):
+            for jj in range(4):
+                fragments[ii, jj] = xml[pos:match.start(jj + 1)]
+                pos = match.end(jj + 1)
+        self.fragments = fragments
+        self.tail = xml[pos:]
+        self.zero_one = _label_zero_one()
+
+    def __len__(self):
+        return self.fragments.shape[0]
+
+    def fill(self, colors):
+        """
+        Build the header XML for a set of label colors.
+
+        Parameters
+        ----------
+        colors : numpy.ndarray
+            RGBA values of shape (len(self), 4), one row per label
+
+        Returns
+        -------
+        bytes
+
+        Raises
+        ------
+        ValueError : `colors` does not have one row per label
+
+        """
+        colors = np.asarray(colors)
+        if colors.shape != self.fragments.shape:
+            raise ValueError(
+                "colors must have shape {}\ncolors.shape: {}".format(
+                    self.fragments.shape, colors.shape))
+        if not np.issubdtype(colors.dtype, np.floating):
+            colors = colors.astype(np.float64)
+        values = colors.astype(bytes)
+        values[colors == 0], values[colors == 1] = self.zero_one
+        slots = np.empty((len(self), 8), dtype=object)
+        slots[:, 0::2] = self.fragments
+        slots[:, 1::2] = values
+        return b"".join(slots.ravel()) + self.tail
+
+
+def _label_zero_one():
+    """Get how nibabel spells label color values of exactly zero and one."""
+    label = cifti2.Cifti2Label(
+        label='zero_one', red=0., green=1.)._to_xml_element()
+    return label.attrib['Red'].encode(), label.attrib['Green'].encode()
+
+
+def get_label_table(fname):
+    """
+    Get the precompiled label table of a template DLABEL file.
+
+    Parameters
+    ----------
+    fname : str
+        absolute path to the template DLABEL file
+
+    Returns
+    -------
+    :class:~`LabelTable`
+
+    """
+    label_table = _label_tables.get(fname)
+    if label_table is None:
+        xml = templates.template_xml(fname)
+        with profiling.stage('template'):
+            label_table = LabelTable(xml)
+        _label_tables[fname] = label_table
+    return label_table
+
+
+def save_cifti_xml(fout, data, nifti_header, xml):
+    """
+    Save a CIFTI-2 image whose header XML is already serialized.
+
+    Parameters
+    ----------
+    fout : str
+        absolute path to output neuroimaging file
+    data : numpy.ndarray
+        CIFTI data array, e.g. of shape (1, 59412)
+    nifti_header : :class:~`nibabel.Nifti2Header` instance
+        NIFTI-2 header of the template image; it is not modified
+    xml : bytes
+        CIFTI-2 header XML
+
+    Returns
+    -------
+    None
+
+    Notes
+    -----
+    This mirrors :meth:`nibabel.Cifti2Image.to_file_map`, except that `xml` is
+    written to the CIFTI-2 extension as-is instead of being (re-)serialized
+    from a :class:~`nibabel.Cifti2Header`. See :class:`CiftiWriter` for a
+    faster way to write many files which share the same template.
+
+    """
+    _cifti_xml_image(data, nifti_header, xml).to_filename(fout)
+
+
+def _cifti_xml_image(data, nifti_header, xml):
+    """Build the NIFTI-2 image which nibabel writes for a CIFTI-2 image."""
+    header = nib.Nifti2Header.from_header(nifti_header)
+    header.extensions = nifti1.Nifti1Extensions(
+        [ext for ext in header.extensions if ext.get_code() != CIFTI_ECODE])
+    header.extensions.append(nifti1.Nifti1Extension(CIFTI_ECODE, xml))
+    header.set_data_shape((1, 1, 1, 1) + data.shape)
+    if header.get_intent()[0] == 'none':
+        header.set_intent('NIFTI_INTENT_CONNECTIVITY_UNKNOWN')
+    if header['qform_code'] == 0:
+        header['pixdim'][:4] = 1
+    return nib.Nifti2Image(
+        data.reshape((1, 1, 1, 1) + data.shape), None, header)
+
+
+class CiftiWriter(object):
+    """
+    A class for writing CIFTI-2 files which share the NIFTI-2 header of a
+    template image, and differ from it only in their header XML or data.
+
+    The template's byte layout (NIFTI-2 header, extensions, data offset) is
+    computed once by writing it with nibabel. Each output file is then
+    assembled from the reused header bytes, the new header XML and the new
+    data buffer, and written with a single vectored write. Output is
+    byte-identical to what :func:`save_cifti_xml` (and thus nibabel) produces.
+    """
+
+    def __init__(self, data, nifti_header, xml):
+        """
+        Parameters
+        ----------
+        data : numpy.ndarray
+            the template's CIFTI data array, e.g. of shape (1, 59412)
+        nifti_header : :class:~`nibabel.Nifti2Header` instance
+            NIFTI-2 header of the template image; it is not modified
+        xml : bytes
+            the template's CIFTI-2 header XML
+
+        Raises
+        ------
+        RuntimeError : the template is written with unsupported extensions
+
+        """
+        block = _cifti_xml_image(data, nifti_header, xml).to_bytes()
+        header = nib.Nifti2Header.from_fileobj(BytesIO(block))
+        if len(header.extensions) != 1:
+            raise RuntimeError(
+                "CiftiWriter requires the CIFTI-2 extension to be the only "
+                "NIFTI extension")
+        self.header = header
+        self.shape = data.shape
+        self.dtype = header.get_data_dtype()
+        self.extension_flag = block[
+            header.sizeof_hdr:header.single_vox_offset]
+        self.data_bytes = self._data_bytes(data)
+        self.xml = xml
+
+    def write(self, fout, xml=None, data=None):
+        """
+        Write a new CIFTI-2 file.
+
+        Parameters
+        ----------
+        fout : str
+            absolute path to output neuroimaging file
+        xml : bytes or None, default None
+            CIFTI-2 header XML; if None, use the template's
+        data : numpy.ndarray or None, default None
+            CIFTI data with as many elements as the template's data; if None,
+            use the template's
+
+        Returns
+        -------
+        None
 
+        Raises
+        ------
+        ValueError : `data` has the wrong number of elements
 
-# Pythonic version of this workbench command (primarily so I don't forget)
+        """
+        xml = self.xml if xml is None else xml
+        data_bytes = self.data_bytes if data is None else self._data_bytes(
+            data)
+
+        # The extension is padded with zeros to the next multiple of 16 bytes
+        esize = len(xml) + 8
+        esize += -esize % 16
+        einfo = np.array((esize, CIFTI_ECODE), dtype=np.int32)
+        if self.header.endianness != volumeutils.native_code:
+            einfo = einfo.byteswap()
+        header = self.header.copy()
+        header['vox_offset'] = header.single_vox_offset + esize
+        buffers = [header.binaryblock, self.extension_flag, einfo.tobytes(),
+                   xml, bytes(esize - 8 - len(xml)), data_bytes]
+        _writev(fout, buffers)
+
+    def _data_bytes(self, data):
+        """Convert `data` to the bytes of the file's data block."""
+        data = np.asanyarray(data)
+        if data.size != np.prod(self.shape):
+            raise ValueError(
+                "data must have {} elements\ndata.shape: {}".format(
+                    np.prod(self.shape), data.shape))
+        data = data.reshape(self.shape).astype(self.dtype, copy=False)
+        return data.ravel(order='F').view(np.uint8)
+
+
+def get_cifti_writer(fname):
+    """
+    Get a :class:`CiftiWriter` for a template CIFTI file.
+
+    Parameters
+    ----------
+    fname : str
+        absolute path to the template CIFTI file
+
+    Returns
+    -------
+    :class:~`CiftiWriter`
+
+    """
+    writer = _cifti_writers.get(fname)
+    if writer is None:
+        of = templates.load_template(fname)
+        data = templates.template_data(fname)
+        xml = templates.template_xml(fname)
+        with profiling.stage('template'):
+            writer = CiftiWriter(data, of.nifti_header, xml)
+        _cifti_writers[fname] = writer
+    return writer
+
+
+def _writev(fout, buffers):
+    """Write `buffers` to a new file `fout`, in a single call if possible."""
+    with open(fout, "wb") as f:
+        if not hasattr(os, "writev"):
+            for buffer in buffers:
+                f.write(buffer)
+            return
+        fd = f.fileno()
+        buffers = [memoryview(b) for b in buffers if len(b)]
+        while buffers:
+            n = os.writev(fd, buffers)
+            while buffers and n >= len(buffers[0]):
+                n -= len(buffers.pop(0))
+            if n:
+                buffers[0] = buffers[0][n:]
+
+
+# Pythonic version of this workbench command (primarily so I don't forget). To
+# parcellate arrays in-process, see wbplot.utils.parcellation
 def cifti_parcellate(cifti_in, dlabel_in, cifti_out, direction='COLUMN'):
-    cmd = "wb_command -cifti-parcellate {} {} {} {}".format(
-        cifti_in, dlabel_in, direction, cifti_out)
-    system(cmd)
+    workbench.run(
+        ['-cifti-parcellate', cifti_in, dlabel_in, direction, cifti_out])
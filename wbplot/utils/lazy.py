@@ -0,0 +1,91 @@
+"""Defer importing heavy dependencies until they are first used. """
+
+from . import profiling
+from importlib import import_module
+from threading import RLock
+import types
+import time
+import sys
+
+# Seconds taken to import each lazily-loaded module, by name
+_import_times = dict()
+_lock = RLock()
+
+
+class LazyModule(types.ModuleType):
+    """
+    A stand-in for a module which is imported when one of its attributes is
+    first accessed.
+    """
+
+    def __init__(self, name):
+        super().__init__(name)
+        self.__module = None
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+    def __dir__(self):
+        return dir(self._load())
+
+    def __repr__(self):
+        state = "loaded" if self.__module is not None else "not loaded"
+        return "<lazy module {!r} ({})>".format(self.__name__, state)
+
+    def _load(self):
+        module = self.__module
+        if module is None:
+            with _lock:
+                module = self.__module
+                if module is None:
+                    module = _import(self.__name__)
+                    self.__module = module
+        return module
+
+
+def lazy_import(name):
+    """
+    Get a module which is only imported when one of its attributes is used.
+
+    Parameters
+    ----------
+    name : str
+        absolute name of the module, e.g. 'matplotlib.cm'
+
+    Returns
+    -------
+    :class:`LazyModule` or module
+        the module itself, if it has already been imported
+
+    """
+    module = sys.modules.get(name)
+    if module is not None:
+        return module
+    return LazyModule(name)
+
+
+def import_times():
+    """
+    Get the time taken to import each lazily-loaded module so far.
+
+    Returns
+    -------
+    dict
+        seconds by module name, in the order the modules were loaded. modules
+        imported as dependencies of earlier ones take little or no time
+
+    """
+    with _lock:
+        return dict(_import_times)
+
+
+def _import(name):
+    """Import module `name`, recording how long it takes."""
+    module = sys.modules.get(name)
+    if module is not None:  # already imported, e.g. by another LazyModule
+        return module
+    with profiling.stage('import'):
+        start = time.perf_counter()
+        module = import_module(name)
+        _import_times[name] = time.perf_counter() - start
+    return module
@@ -0,0 +1,380 @@
+"""Auxiliary functions for writing Workbench color palettes into DSCALAR files. """
+
+from .. import constants
+from . import templates, plots
+from .lazy import lazy_import
+import re
+
+saxutils = lazy_import("xml.sax.saxutils")  # imports urllib.request
+
+# Options of "wb_command -cifti-palette" which take a (min, max) pair, and the
+# positions of min and max in the corresponding PaletteColorMapping element.
+# UserScaleValues and AutoScalePercentageValues are ordered as (negMax, negMin,
+# posMin, posMax), where negMax is mapped to the negative end of the palette
+RANGE_PARAMS = {
+    "pos-percent": ("AutoScalePercentageValues", 2, 3),
+    "neg-percent": ("AutoScalePercentageValues", 1, 0),
+    "abs-percent": ("AutoScaleAbsolutePercentageValues", 0, 1),
+    "pos-user": ("UserScaleValues", 2, 3),
+    "neg-user": ("UserScaleValues", 1, 0),
+}
+
+# Options which take a single boolean, and the corresponding elements
+BOOL_PARAMS = {
+    "disp-pos": "DisplayPositiveData",
+    "disp-neg": "DisplayNegativeData",
+    "disp-zero": "DisplayZeroData",
+    "interpolate": "InterpolatePalette",
+}
+
+INVERSIONS = ["OFF", "POSITIVE_WITH_NEGATIVE", "POSITIVE_NEGATIVE_SWAP"]
+THRESHOLD_TYPES = {
+    "OFF": None,
+    "NORMAL": "ThresholdNormalValues",
+    "MAPPED": "ThresholdMappedValues",
+    "MAPPED_AVERAGE_AREA": "ThresholdMappedAvgAreaValues"}
+THRESHOLD_TESTS = ["SHOW_OUTSIDE", "SHOW_INSIDE"]
+
+# Options which are written into the header XML in-process; any others are
+# applied by running "wb_command -cifti-palette"
+SUPPORTED_PARAMS = sorted(
+    list(RANGE_PARAMS) + list(BOOL_PARAMS) + ["inversion", "thresholding"])
+
+# Workbench palettes which have an equivalent matplotlib colormap
+MPL_EQUIVALENTS = {
+    "magma": "magma",
+    "JET256": "jet",
+    "spectral": "Spectral",
+    "cool-warm": "coolwarm",
+    "Gray_Interp": "gray",
+    "Gray_Interp_Positive": "gray",
+    "RedWhiteBlue": "bwr",
+}
+
+# Header XML of the template DSCALAR file for each palette, keyed by the
+# palette name and parameters
+_palette_xml = dict()
+
+_mapping = re.compile(
+    rb"(<Name>PaletteColorMapping</Name><Value>)(.*?)(</Value>)", re.DOTALL)
+
+
+def palette_xml(palette='magma', palette_params=None):
+    """
+    Get the header XML of the template DSCALAR file with a new color palette.
+
+    Parameters
+    ----------
+    palette : str, default 'magma'
+        name of color palette
+    palette_params : dict or None, default None
+        additional (key: value) pairs, as passed to "wb_command -cifti-palette".
+        see :func:`palette_mapping`
+
+    Returns
+    -------
+    bytes
+        CIFTI-2 header XML
+
+    Raises
+    ------
+    RuntimeError : template file contains no palette metadata
+    ValueError : palette_params contains an invalid key,value pair
+
+    """
+    key = _params_key(palette, palette_params)
+    xml = _palette_xml.get(key) if key is not None else None
+    if xml is None:
+        template = templates.template_xml(constants.DSCALAR_FILE)
+        match = _mapping.search(template)
+        if match is None:
+            raise RuntimeError(
+                "no PaletteColorMapping found in {}".format(
+                    constants.DSCALAR_FILE))
+        mapping = palette_mapping(saxutils.unescape(
+            match.group(2).decode()), palette, palette_params)
+        xml = (template[:match.start(2)] + saxutils.escape(mapping).encode() +
+               template[match.end(2):])
+        if key is not None:
+            _palette_xml[key] = xml
+    return xml
+
+
+def palette_mapping(mapping, palette='magma', palette_params=None):
+    """
+    Update the settings in a Workbench PaletteColorMapping XML document.
+
+    Parameters
+    ----------
+    mapping : str
+        PaletteColorMapping XML document, as stored in the metadata of a CIFTI
+        map
+    palette : str, default 'magma'
+        name of color palette
+    palette_params : dict or None, default None
+        additional (key: value) pairs, as passed to "wb_command -cifti-palette".
+        supported keys are 'pos-percent', 'neg-percent', 'abs-percent',
+        'pos-user' and 'neg-user', whose values are (min, max) pairs;
+        'disp-pos', 'disp-neg', 'disp-zero' and 'interpolate', whose values are
+        booleans; 'inversion', whose value is 'OFF', 'POSITIVE_WITH_NEGATIVE' or
+        'POSITIVE_NEGATIVE_SWAP'; and 'thresholding', whose value is a (type,
+        test, min, max) tuple
+
+    Returns
+    -------
+    str
+        the updated document
+
+    Raises
+    ------
+    ValueError : palette_params contains an invalid key,value pair
+
+    Notes
+    -----
+    As with "wb_command -cifti-palette", the scale mode is set to
+    MODE_AUTO_SCALE_PERCENTAGE if both 'pos-percent' and 'neg-percent' are
+    given, MODE_USER_SCALE if both 'pos-user' and 'neg-user' are given, and
+    MODE_AUTO_SCALE otherwise; all positive, negative and zero values are
+    displayed unless 'disp-pos', 'disp-neg' or 'disp-zero' say otherwise.
+
+    """
+    params = dict() if palette_params is None else dict(palette_params)
+    mapping = _set(mapping, "ScaleMode", scale_mode(params))
+    mapping = _set(mapping, "PaletteName", palette)
+    for element in ["DisplayPositiveData", "DisplayNegativeData",
+                    "DisplayZeroData"]:
+        mapping = _set(mapping, element, "true")
+
+    for k, v in params.items():
+        if k in RANGE_PARAMS:
+            if isinstance(v, str) or not hasattr(v, '__iter__') or len(v) != 2:
+                raise ValueError(
+                    "palette param {} must be a (min, max) tuple".format(k))
+            element, imin, imax = RANGE_PARAMS[k]
+            values = _get(mapping, element).split()
+            values[imin], values[imax] = _number(v[0]), _number(v[1])
+            mapping = _set(mapping, element, " ".join(values))
+        elif k in BOOL_PARAMS:
+            mapping = _set(mapping, BOOL_PARAMS[k], _bool(v))
+        elif k == "inversion":
+            if v not in INVERSIONS:
+                raise ValueError(
+                    "palette param inversion must be one of {}".format(
+                        INVERSIONS))
+            mapping = _set(mapping, "InvertPalette", v)
+        elif k == "thresholding":
+            if isinstance(v, str) or not hasattr(v, '__iter__') or len(v) != 4:
+                raise ValueError(
+                    "palette param thresholding must be a (type, test, min, "
+                    "max) tuple")
+            kind = str(v[0]).replace("THRESHOLD_TYPE_", "")
+            test = str(v[1]).replace("THRESHOLD_TEST_", "")
+            if kind not in THRESHOLD_TYPES or test not in THRESHOLD_TESTS:
+                raise ValueError(
+                    "invalid thresholding type {} or test {}".format(
+                        v[0], v[1]))
+            mapping = _set(mapping, "ThresholdType", "THRESHOLD_TYPE_" + kind)
+            mapping = _set(mapping, "ThresholdTest", "THRESHOLD_TEST_" + test)
+            if THRESHOLD_TYPES[kind] is not None:
+                mapping = _set(mapping, THRESHOLD_TYPES[kind], "{} {}".format(
+                    _number(v[2]), _number(v[3])))
+        else:
+            raise ValueError(
+                "palette params must be a dict with values which are either "
+                "strings, numbers, or tuples; {} is not a supported "
+                "key".format(k))
+    return mapping
+
+
+def scale_mode(palette_params=None):
+    """
+    Get the scale mode which "wb_command -cifti-palette" would be given for
+    a set of palette params; see :func:`palette_mapping`.
+    """
+    params = palette_params or {}
+    if "pos-percent" in params and "neg-percent" in params:
+        return "MODE_AUTO_SCALE_PERCENTAGE"
+    if "pos-user" in params and "neg-user" in params:
+        return "MODE_USER_SCALE"
+    return "MODE_AUTO_SCALE"  # default mode (not DMN, haha)
+
+
+def scale_values(palette_params, element):
+    """
+    Get the values of a PaletteColorMapping element of RANGE_PARAMS, as
+    :func:`palette_mapping` writes them.
+
+    Parameters
+    ----------
+    palette_params : dict or None
+        see :func:`palette_mapping`
+    element : str
+        e.g. 'UserScaleValues'
+
+    Returns
+    -------
+    list of (float or None)
+        the element's four values, in Workbench's order (see RANGE_PARAMS);
+        None where `palette_params` does not set them
+
+    """
+    values = [None] * 4
+    for k, (name, imin, imax) in RANGE_PARAMS.items():
+        if name == element and k in (palette_params or {}):
+            v = palette_params[k]
+            values[imin], values[imax] = float(v[0]), float(v[1])
+    return values
+
+
+def split_params(palette_params):
+    """
+    Split palette params into those which can be written in-process (see
+    SUPPORTED_PARAMS) and the rest.
+
+    Returns
+    -------
+    (dict, dict)
+
+    """
+    supported, other = dict(), dict()
+    for k, v in (palette_params or {}).items():
+        (supported if k in SUPPORTED_PARAMS else other)[k] = v
+    return supported, other
+
+
+def palette_args(palette='magma', palette_params=None):
+    """
+    Get the options of "wb_command -cifti-palette" which apply a palette.
+
+    Parameters
+    ----------
+    palette : str, default 'magma'
+        name of color palette
+    palette_params : dict or None, default None
+        see :func:`palette_mapping`; any other "wb_command -cifti-palette"
+        option may also be given, without its leading '-'
+
+    Returns
+    -------
+    list of str
+        the scale mode, followed by the options
+
+    """
+    params = dict() if palette_params is None else dict(palette_params)
+    args = [scale_mode(params), "-palette-name", palette]
+    for k in ["disp-pos", "disp-neg", "disp-zero"]:
+        args += ["-" + k, _bool(params.pop(k, True))]
+    for k, v in params.items():
+        args.append("-" + k)
+        if isinstance(v, bool):
+            args.append(_bool(v))
+        elif hasattr(v, '__iter__') and not isinstance(v, str):
+            args += [str(x) for x in v]
+        else:
+            args.append(str(v))
+    return args
+
+
+def mpl_cmap(palette):
+    """
+    Get the matplotlib colormap equivalent to a Workbench color palette.
+
+    Parameters
+    ----------
+    palette : str
+        name of a Workbench color palette, or of a matplotlib colormap
+
+    Returns
+    -------
+    str
+        name of the matplotlib colormap
+
+    Raises
+    ------
+    ValueError : `palette` has no matplotlib equivalent
+
+    """
+    if palette in MPL_EQUIVALENTS:
+        return MPL_EQUIVALENTS[palette]
+    if palette in constants.CMAPS:
+        raise ValueError(
+            'Workbench palette "{}" has no matplotlib equivalent; use one of '
+            '{}'.format(palette, sorted(MPL_EQUIVALENTS)))
+    return plots.check_cmap_plt(palette)
+
+
+def colorbar_cmap(palette):
+    """
+    Get the matplotlib colormap with which the colorbar of a dense map is drawn.
+
+    Parameters
+    ----------
+    palette : str
+        name of a Workbench color palette, or of a matplotlib colormap
+
+    Returns
+    -------
+    str
+        name of the matplotlib colormap
+
+    Raises
+    ------
+    ValueError : `palette` has no matplotlib equivalent, so its colorbar
+        cannot be drawn
+
+    """
+    try:
+        return mpl_cmap(palette)
+    except ValueError:
+        raise ValueError(
+            'cannot draw a colorbar for Workbench palette "{}", which has no '
+            'matplotlib equivalent; use one of {}, or draw the map without a '
+            'colorbar'.format(palette, sorted(MPL_EQUIVALENTS))) from None
+
+
+def _params_key(palette, palette_params):
+    """Make a hashable cache key, or return None if that is not possible."""
+    if not palette_params:
+        return palette, ()
+    items = []
+    for k, v in sorted(palette_params.items()):
+        if hasattr(v, '__iter__') and not isinstance(v, str):
+            v = tuple(v)
+        items.append((k, v))
+    key = palette, tuple(items)
+    try:
+        hash(key)
+    except TypeError:
+        return None
+    return key
+
+
+def _get(mapping, element):
+    """Get the text of `element` in a PaletteColorMapping document."""
+    match = re.search(r"<{0}>(.*?)</{0}>".format(element), mapping, re.DOTALL)
+    if match is None:
+        raise ValueError(
+            "{} not found in PaletteColorMapping".format(element))
+    return match.group(1)
+
+
+def _set(mapping, element, text):
+    """Set the text of `element` in a PaletteColorMapping document."""
+    _get(mapping, element)  # check that the element exists
+    return re.sub(r"<{0}>.*?</{0}>".format(element),
+                  lambda _: "<{0}>{1}</{0}>".format(element, text), mapping,
+                  count=1, flags=re.DOTALL)
+
+
+def _number(value):
+    """Format a number so that it is read back exactly, however small."""
+    return repr(float(value))
+
+
+def _bool(value):
+    """Format a boolean the way Workbench writes it."""
+    if isinstance(value, str):
+        if value.lower() not in ["true", "false"]:
+            raise ValueError("{} is not a valid boolean".format(value))
+        return value.lower()
+    return "true" if value else "false"
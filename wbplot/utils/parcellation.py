@@ -0,0 +1,190 @@
+"""Convert between parcellated and dense scalars in-process with NumPy. """
+
+import numpy as np
+from .. import config
+from . import templates
+from collections import namedtuple
+
+# Number of parcels in the HCP MMP1.0 parcellation
+N_PARCELS = 360
+
+# Maximum number of elements in the temporary arrays made when parcellating a
+# batch of maps, which are processed in chunks of rows to bound memory use
+CHUNK_SIZE = 1 << 23
+
+# Reductions supported by dscalars_to_pscalars, and the ufuncs which do them
+METHODS = {"mean": np.add, "sum": np.add, "min": np.minimum,
+           "max": np.maximum}
+
+ParcelMap = namedtuple(
+    "ParcelMap", ["labels", "indptr", "indices", "counts"])
+ParcelMap.__doc__ = """
+Sparse (CSR) mapping between parcels and grayordinates.
+
+Attributes
+----------
+labels : numpy.ndarray
+    index of the parcel containing each grayordinate, or -1 if it is
+    unlabeled; shape (59412,), dtype intp
+indptr : numpy.ndarray
+    the grayordinates of parcel i are indices[indptr[i]:indptr[i+1]]; shape
+    (361,)
+indices : numpy.ndarray
+    labeled grayordinates, sorted by parcel
+counts : numpy.ndarray
+    number of grayordinates in each parcel; shape (360,)
+"""
+
+_parcel_maps = dict()
+
+
+def get_parcel_map(fname=None):
+    """
+    Get the mapping between parcels and grayordinates of a parcellation.
+
+    Parameters
+    ----------
+    fname : str or None, default None
+        absolute path to a DLABEL file whose keys 1 to 360 label the parcels,
+        in the order of bilateral pscalars; if None, use
+        wbplot.config.PARCELLATION_FILE
+
+    Returns
+    -------
+    ParcelMap
+
+    Raises
+    ------
+    RuntimeError : a parcel contains no grayordinates
+
+    Notes
+    -----
+    The mapping is built once per file and kept in memory.
+
+    """
+    fname = config.PARCELLATION_FILE if fname is None else fname
+    parcel_map = _parcel_maps.get(fname)
+    if parcel_map is None:
+        keys = np.asarray(templates.template_data(fname)).ravel()
+        labels = np.rint(keys).astype(np.intp) - 1
+        labels[(labels < 0) | (labels >= N_PARCELS)] = -1
+        indices = np.argsort(labels, kind="stable")
+        indices = indices[labels[indices] >= 0]
+        counts = np.bincount(labels[indices], minlength=N_PARCELS)
+        if not counts.all():
+            raise RuntimeError(
+                "parcels {} of {} contain no grayordinates".format(
+                    np.flatnonzero(counts == 0).tolist(), fname))
+        indptr = np.zeros(N_PARCELS + 1, dtype=np.intp)
+        np.cumsum(counts, out=indptr[1:])
+        for a in (labels, indices, indptr, counts):
+            a.flags.writeable = False
+        parcel_map = ParcelMap(labels, indptr, indices, counts)
+        _parcel_maps[fname] = parcel_map
+    return parcel_map
+
+
+def pscalars_to_dscalars(pscalars, fill=np.nan, fname=None):
+    """
+    Project parcellated scalars onto the grayordinates of each parcel.
+
+    Parameters
+    ----------
+    pscalars : numpy.ndarray
+        bilateral parcel scalar values, of shape (360,) or (n_maps, 360)
+    fill : float, default numpy.nan
+        value of grayordinates which belong to no parcel
+    fname : str or None, default None
+        see :func:`get_parcel_map`
+
+    Returns
+    -------
+    numpy.ndarray
+        dense scalar values, of shape (59412,) or (n_maps, 59412)
+
+    Raises
+    ------
+    ValueError : `pscalars` does not have 360 columns
+
+    """
+    pscalars = np.asarray(pscalars)
+    if pscalars.ndim not in (1, 2) or pscalars.shape[-1] != N_PARCELS:
+        raise ValueError(
+            "pscalars must have shape (360,) or (n_maps, 360), got {}".format(
+                pscalars.shape))
+    parcel_map = get_parcel_map(fname)
+    dscalars = np.take(pscalars, np.maximum(parcel_map.labels, 0), axis=-1)
+    unlabeled = parcel_map.labels < 0
+    if unlabeled.any():
+        dscalars = dscalars.astype(np.result_type(dscalars, fill), copy=False)
+        dscalars[..., unlabeled] = fill
+    return dscalars
+
+
+def dscalars_to_pscalars(dscalars, method="mean", only_numeric=False,
+                         fname=None):
+    """
+    Summarize dense scalars within each parcel, like "wb_command
+    -cifti-parcellate" (see :func:`wbplot.utils.images.cifti_parcellate`) but
+    without writing CIFTI files.
+
+    Parameters
+    ----------
+    dscalars : numpy.ndarray
+        dense scalar values, of shape (59412,) or (n_maps, 59412)
+    method : 'mean' or 'sum' or 'min' or 'max', default 'mean'
+        how the grayordinates in each parcel are summarized
+    only_numeric : bool, default False
+        exclude NaN and infinite values, like the -only-numeric option of
+        "wb_command -cifti-parcellate"; parcels with no finite values are NaN.
+        otherwise, non-finite values propagate
+    fname : str or None, default None
+        see :func:`get_parcel_map`
+
+    Returns
+    -------
+    numpy.ndarray
+        bilateral parcel scalar values, of shape (360,) or (n_maps, 360),
+        dtype float64
+
+    Raises
+    ------
+    ValueError : invalid `method`, or `dscalars` does not have 59412 columns
+
+    """
+    if method not in METHODS:
+        raise ValueError("method must be one of {}".format(sorted(METHODS)))
+    dscalars = np.asarray(dscalars)
+    parcel_map = get_parcel_map(fname)
+    n = len(parcel_map.labels)
+    if dscalars.ndim not in (1, 2) or dscalars.shape[-1] != n:
+        raise ValueError(
+            "dscalars must have shape ({0},) or (n_maps, {0}), got {1}".format(
+                n, dscalars.shape))
+    x = np.atleast_2d(dscalars)
+    pscalars = np.empty((x.shape[0], N_PARCELS))
+    rows = max(1, CHUNK_SIZE // n)
+    for i in range(0, x.shape[0], rows):
+        pscalars[i:i + rows] = _reduce(
+            x[i:i + rows], parcel_map, method, only_numeric)
+    return pscalars[0] if dscalars.ndim == 1 else pscalars
+
+
+def _reduce(x, parcel_map, method, only_numeric):
+    """Summarize each parcel of a chunk of dense maps."""
+    values = np.take(x, parcel_map.indices, axis=1).astype(
+        np.float64, copy=False)
+    starts = parcel_map.indptr[:-1]
+    if not only_numeric:
+        result = METHODS[method].reduceat(values, starts, axis=1)
+        return result / parcel_map.counts if method == "mean" else result
+    finite = np.isfinite(values)
+    identity = {"mean": 0., "sum": 0., "min": np.inf, "max": -np.inf}[method]
+    values[~finite] = identity
+    result = METHODS[method].reduceat(values, starts, axis=1)
+    counts = np.add.reduceat(finite, starts, axis=1, dtype=np.intp)
+    if method == "mean":
+        with np.errstate(invalid="ignore", divide="ignore"):
+            result /= counts
+    result[counts == 0] = np.nan
+    return result
@@ -0,0 +1,429 @@
+"""Cached images of the parcel drawn in each pixel, for re-colouring pscalars. """
+
+import numpy as np
+from .. import config, constants
+from . import images, templates, raster, workspaces, workbench, plots
+from . import profiling, colormaps
+from .lazy import lazy_import
+from collections import namedtuple
+from os.path import join, split
+from threading import Lock
+import hashlib
+
+Image = lazy_import("PIL.Image")
+
+# Subdirectory of config.CACHE_DIR in which parcel images are saved
+PARCEL_DIR = "parcels"
+
+# Scenes of plots.map_params_to_scene which show parcellated scalars
+PSCALAR_SCENES = [1, 2, 3, 4, 5]
+
+# Number of levels to which shading is quantized when rendering
+SHADE_LEVELS = 256
+
+ParcelImage = namedtuple(
+    "ParcelImage", ["shape", "pixels", "labels", "shade", "unlabeled"])
+ParcelImage.__doc__ = """
+The parcel drawn in each pixel of a scene, and how brightly it is lit.
+
+Attributes
+----------
+shape : tuple of int
+    (height, width) of the image
+pixels : numpy.ndarray
+    flat indices of the pixels covered by the surface, shape (n,)
+labels : numpy.ndarray
+    label key of the parcel drawn in each covered pixel, shape (n,). key k
+    shows pscalars[k - 1]; key 0 marks unlabeled surface (the medial wall)
+shade : numpy.ndarray
+    shading factor of each covered pixel, in [0, 1], shape (n,)
+unlabeled : numpy.ndarray
+    RGB color of unlabeled surface in [0, 255] before shading, shape (3,)
+"""
+
+# Parcel images (or None, if not calibrated) & renderers, keyed by backend,
+# scene and size
+_parcel_images = dict()
+_renderers = dict()
+_lock = Lock()
+
+
+def get_parcel_image(scene, width, height, backend='workbench'):
+    """
+    Get the parcel image of a pscalar scene.
+
+    Parameters
+    ----------
+    scene : int
+        scene number, one of PSCALAR_SCENES
+    width, height : int
+        size of the image, in pixels
+    backend : 'workbench' or 'numpy', default 'workbench'
+        whether the image was calibrated from Connectome Workbench renders
+        (see :func:`calibrate`), or is derived from the NumPy rasterizer's
+        projection of the scene (see :func:`wbplot.utils.raster.get_projection`)
+
+    Returns
+    -------
+    :class:`ParcelImage` or None
+        None if the backend is 'workbench' and the scene has not been
+        calibrated
+
+    """
+    key = backend, scene, width, height
+    if key in _parcel_images:
+        return _parcel_images[key]
+    with _lock:
+        if key not in _parcel_images:
+            if backend == 'numpy':
+                parcel_image = from_projection(
+                    raster.get_projection(scene, width, height))
+            else:
+                parcel_image = raster.load_record(
+                    parcel_image_file(scene, width, height), ParcelImage)
+            _parcel_images[key] = parcel_image
+    return _parcel_images[key]
+
+
+def parcel_image_file(scene, width, height):
+    """
+    Get the path at which the calibrated parcel image of a scene is saved.
+
+    The path depends on the contents of the scene zip file (see
+    :func:`wbplot.utils.workspaces.scene_key`), so calibrations are not reused
+    with a different scene file.
+
+    Parameters
+    ----------
+    scene : int
+        scene number, one of PSCALAR_SCENES
+    width, height : int
+        size of the image, in pixels
+
+    Returns
+    -------
+    str
+
+    """
+    key = split(workspaces.get_workspace())[1][len(
+        workspaces.WORKSPACE_PREFIX):]
+    return join(config.CACHE_DIR, PARCEL_DIR, "{}-{}x{}-{}.npz".format(
+        scene, width, height, key))
+
+
+def calibrate(scenes=None, tol=5):
+    """
+    Render each pscalar scene with Connectome Workbench to find the parcel
+    drawn in each pixel, and save the result for :func:`get_parcel_image`.
+
+    Parameters
+    ----------
+    scenes : list of int or None, default None
+        scenes to calibrate; if None, use PSCALAR_SCENES
+    tol : int, default 5
+        pixels whose color channels all lie within `tol` of 255 in the
+        calibration renders are treated as background
+
+    Returns
+    -------
+    list of str
+        paths to the saved parcel images
+
+    Raises
+    ------
+    ValueError : a scene is not one of PSCALAR_SCENES
+    WorkbenchError : Connectome Workbench failed to render an image
+
+    Notes
+    -----
+    Each scene is rendered five times: with every parcel black, which
+    separates the background, the parcels and the unlabeled surface; with
+    every parcel white, which records the shading; and three times with each
+    parcel's label key encoded in the on/off state of the color channels, three
+    bits per render. Once a scene is calibrated, :func:`wbplot.pscalar` renders
+    it by re-colouring the parcel image instead of running Workbench (see
+    wbplot.config.PARCEL_IMAGES). Pixels on the boundary between parcels are
+    assigned to one of them, so edges may differ slightly from Workbench's.
+
+    """
+    scenes = PSCALAR_SCENES if scenes is None else scenes
+    for scene in scenes:
+        if scene not in PSCALAR_SCENES:
+            raise ValueError(
+                "scenes must be in {}".format(PSCALAR_SCENES))
+    keys = np.arange(1, 361)
+    codes = [np.zeros(360), np.ones(360)] + [
+        (keys[:, None] >> (3 * r + np.arange(3))) & 1 for r in range(3)]
+
+    sizes = _scene_sizes()
+    cifti = images.Cifti()
+    fnames = []
+    with workspaces.render_workspace(constants.DLABEL_FILE) as render_dir:
+        scene_file = join(render_dir, "Human.scene")
+        temp_cifti = join(render_dir, split(constants.DLABEL_FILE)[1])
+        for scene in scenes:
+            width, height = sizes[scene]
+            renders = []
+            for i, code in enumerate(codes):
+                rgb = np.broadcast_to(
+                    np.asarray(code, dtype=np.float64).reshape(360, -1),
+                    (360, 3))
+                colors = np.concatenate([rgb, np.ones((360, 1))], axis=1)
+                cifti.set_colors(colors)
+                cifti.save(temp_cifti)
+                png = join(render_dir, "calibration-{}.png".format(i))
+                workbench.run(
+                    ['-show-scene', scene_file, scene, png, width, height])
+                renders.append(
+                    np.asarray(Image.open(png).convert("RGB"), dtype=np.int16))
+            parcel_image = decode(renders, tol=tol)
+            fname = parcel_image_file(scene, width, height)
+            raster.save_record(fname, parcel_image)
+            with _lock:
+                _parcel_images.pop(('workbench', scene, width, height), None)
+                _renderers.pop(('workbench', scene, width, height), None)
+            fnames.append(fname)
+    return fnames
+
+
+def decode(renders, tol=5):
+    """
+    Decode the calibration renders made by :func:`calibrate`.
+
+    Parameters
+    ----------
+    renders : list of numpy.ndarray
+        the black, white and three bit-encoded RGB renders of a scene
+    tol : int, default 5
+        background tolerance; see :func:`calibrate`
+
+    Returns
+    -------
+    :class:`ParcelImage`
+
+    """
+    black, white = renders[0], renders[1]
+    height, width = black.shape[:2]
+    lum = white.mean(axis=2)
+
+    # Parcels are black in the first render but not the second; unlabeled
+    # surface is drawn identically in both
+    background = (black >= 255 - tol).all(axis=2)
+    labeled = ~background & (black.mean(axis=2) < 0.5 * lum)
+    labels = np.zeros((height, width), dtype=np.int64)
+    for r, render in enumerate(renders[2:]):
+        bits = render > 0.5 * white
+        for c in range(3):
+            labels |= bits[..., c].astype(np.int64) << (3 * r + c)
+    labels[~labeled | (labels > 360)] = 0
+
+    pixels = np.flatnonzero(~background)
+    shade = lum.ravel()[pixels] / 255.
+    return ParcelImage(
+        (height, width), pixels.astype(np.int32),
+        labels.ravel()[pixels].astype(np.uint16), shade.astype(np.float32),
+        np.full(3, 255., dtype=np.float32))
+
+
+def from_projection(projection):
+    """
+    Derive a parcel image from the NumPy rasterizer's projection of a scene.
+
+    Parameters
+    ----------
+    projection : :class:`wbplot.utils.raster.Projection`
+
+    Returns
+    -------
+    :class:`ParcelImage`
+
+    """
+    n_vertices = sum(len(raster.load_surface(h)[0]) for h in ["left", "right"])
+    vertex_labels = np.zeros(n_vertices, dtype=np.uint16)
+    vertex_labels[raster.grayordinate_vertices(config.PARCELLATION_FILE)] = \
+        np.asarray(templates.template_data(config.PARCELLATION_FILE)).ravel()
+    nearest = projection.weights.argmax(axis=1)
+    vertices = projection.vertices[np.arange(len(nearest)), nearest]
+    return ParcelImage(
+        projection.shape, projection.pixels, vertex_labels[vertices],
+        projection.shade,
+        np.asarray(raster.SURFACE_COLOR, dtype=np.float32) * 255)
+
+
+def get_renderer(scene, width, height, backend='workbench'):
+    """
+    Get the :class:`ParcelRenderer` for a pscalar scene.
+
+    Parameters
+    ----------
+    scene : int
+        scene number, one of PSCALAR_SCENES
+    width, height : int
+        size of the image, in pixels
+    backend : 'workbench' or 'numpy', default 'workbench'
+        see :func:`get_parcel_image`
+
+    Returns
+    -------
+    :class:`ParcelRenderer` or None
+        None if the backend is 'workbench' and the scene has not been
+        calibrated
+
+    """
+    key = backend, scene, width, height
+    renderer = _renderers.get(key)
+    if renderer is None:
+        with profiling.stage('raster'):
+            parcel_image = get_parcel_image(scene, width, height, backend)
+            if parcel_image is None:
+                return None
+            renderer = ParcelRenderer(parcel_image)
+        _renderers[key] = renderer
+    return renderer
+
+
+class ParcelRenderer(object):
+    """
+    Render parcellated maps by re-colouring a :class:`ParcelImage`.
+
+    Every pixel's label key and quantized shading are combined into one index
+    into a table of (label, shading level) colors. Rendering a map fills that
+    small table from the map's parcel colors and then looks up every pixel at
+    once.
+
+    Parameters
+    ----------
+    parcel_image : :class:`ParcelImage`
+
+    """
+
+    def __init__(self, parcel_image):
+        self.parcel_image = parcel_image
+        self.shape = parcel_image.shape
+        self.n_labels = 361
+        levels = np.rint(np.clip(parcel_image.shade, 0, 1) * (
+            SHADE_LEVELS - 1)).astype(np.int32)
+        # Widen the (uint16) keys so that key * SHADE_LEVELS cannot overflow
+        labels = np.minimum(
+            parcel_image.labels, self.n_labels - 1).astype(np.int32)
+
+        # Background pixels point past the end of the table, at a white entry
+        index = np.full(
+            self.shape[0] * self.shape[1], self.n_labels * SHADE_LEVELS,
+            dtype=np.int32)
+        index[parcel_image.pixels] = labels * SHADE_LEVELS + levels
+        self.index = index
+        self.levels = np.linspace(0, 1, SHADE_LEVELS, dtype=np.float32)
+        self._digest = None
+
+    def digest(self):
+        """
+        Hash the parcel image, e.g. for cache keys.
+
+        Returns
+        -------
+        str
+            hash of the parcel image's arrays, computed on the first call
+
+        """
+        if self._digest is None:
+            h = hashlib.sha256(repr(self.shape).encode())
+            for name in ParcelImage._fields[1:]:
+                h.update(np.ascontiguousarray(
+                    getattr(self.parcel_image, name)).view(np.uint8).ravel())
+            self._digest = h.hexdigest()
+        return self._digest
+
+    def render(self, colors):
+        """
+        Draw one map.
+
+        Parameters
+        ----------
+        colors : numpy.ndarray
+            RGB color of each parcel in [0, 255], shape (360, 3)
+
+        Returns
+        -------
+        numpy.ndarray
+            RGB image of dtype uint8, shape (height, width, 3)
+
+        """
+        lut = np.empty((self.n_labels, 3), dtype=np.float32)
+        lut[0] = self.parcel_image.unlabeled
+        lut[1:] = colors
+        table = np.empty((self.n_labels * SHADE_LEVELS + 1, 3), dtype=np.uint8)
+        shaded = lut[:, None, :] * self.levels[None, :, None] + 0.5
+        np.copyto(table[:-1], shaded.reshape(-1, 3), casting="unsafe")
+        table[-1] = np.round(np.asarray(raster.BACKGROUND) * 255)
+
+        # Look up whole pixels at once by viewing each RGB triple as one item
+        image = np.empty(self.shape + (3,), dtype=np.uint8)
+        np.take(table.view("V3").ravel(), self.index,
+                out=image.reshape(-1, 3).view("V3").ravel())
+        return image
+
+
+def pscalar_colors(pscalars, cmap='magma', vrange=None, norm='linear'):
+    """
+    Map bilateral parcellated scalars to colors, as :class:`images.Cifti` does.
+
+    Parameters
+    ----------
+    pscalars : numpy.ndarray
+        bilateral parcel scalar values, of shape (360,), or a batch of maps of
+        shape (n_maps, 360)
+    cmap : str, default 'magma'
+        matplotlib colormap
+    vrange : tuple or None, default None
+        data (min, max) for plotting; if None, each map uses its own range
+    norm : str, default 'linear'
+        one of wbplot.utils.colormaps.NORMS
+
+    Returns
+    -------
+    numpy.ndarray
+        RGB color of each parcel in [0, 255], of shape pscalars.shape + (3,)
+
+    """
+    return colormaps.map_colors(pscalars, cmap, vrange, norm)[..., :3] * 255
+
+
+def render_pscalars(renderer, pscalars, cmap='magma', vrange=None,
+                    norm='linear'):
+    """
+    Render bilateral parcellated scalars by re-colouring a parcel image.
+
+    Parameters
+    ----------
+    renderer : :class:`ParcelRenderer`
+    pscalars : numpy.ndarray
+        bilateral parcel scalar values
+    cmap : str, default 'magma'
+        matplotlib colormap
+    vrange : tuple or None, default None
+        data (min, max) for plotting; if None, use (min(data), max(data))
+    norm : str, default 'linear'
+        one of wbplot.utils.colormaps.NORMS
+
+    Returns
+    -------
+    numpy.ndarray
+        RGB image of dtype uint8, shape (height, width, 3)
+
+    """
+    with profiling.stage('colormap'):
+        colors = pscalar_colors(pscalars, cmap, vrange, norm)
+    with profiling.stage('raster'):
+        return renderer.render(colors)
+
+
+def _scene_sizes():
+    """Get the (width, height) of each pscalar scene."""
+    sizes = dict()
+    for orientation in ['landscape', 'portrait']:
+        for hemisphere in [None, 'left', 'right']:
+            scene, width, height = plots.map_params_to_scene(
+                'pscalars', orientation, hemisphere)
+            sizes[scene] = width, height
+    return sizes
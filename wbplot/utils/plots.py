@@ -1,39 +1,141 @@
 """Auxiliary functions for Connectome Workbench & Matplotlib plots. """
 
 from .. import constants
-from PIL import Image
+from .lazy import lazy_import
+import numpy as np
 # from matplotlib import colors, pyplot as plt, colorbar
 # from mpl_toolkits.axes_grid1 import make_axes_locatable
-from matplotlib import cm
 
+Image = lazy_import("PIL.Image")
+mpl = lazy_import("matplotlib")
+cm = lazy_import("matplotlib.cm")
 
-def make_transparent(img_file):
+
+def make_transparent(img_file, tol=0, ramp=0):
     """
     Make each white pixel in an image transparent.
 
     Parameters
     ----------
-    img_file : str
-        absolute path to a PNG image file
+    img_file : str or :class:~`PIL.Image.Image` or numpy.ndarray
+        absolute path to a PNG image file, or an image in memory. arrays must
+        have shape (height, width, 3) or (height, width, 4) and dtype uint8
+    tol : int, default 0
+        pixels whose color channels all lie within `tol` of 255 are treated as
+        white
+    ramp : int, default 0
+        width of a linear ramp over which alpha increases from zero (at `tol`)
+        to its original value (at `tol` + `ramp`), softening anti-aliased
+        edges. if zero, transparency is all-or-nothing
+
+    Returns
+    -------
+    None or :class:~`PIL.Image.Image` or numpy.ndarray
+        None if `img_file` is a path, otherwise an RGBA image of the same type
+        as `img_file`
+
+    Notes
+    -----
+    If `img_file` is a path, this function overwrites the existing file.
+
+    """
+    if isinstance(img_file, np.ndarray):
+        return transparent_rgba(img_file, tol=tol, ramp=ramp)
+    img = Image.open(img_file) if isinstance(img_file, str) else img_file
+    rgba = transparent_rgba(
+        np.asarray(img.convert("RGBA")), tol=tol, ramp=ramp)
+    img = Image.fromarray(rgba, "RGBA")
+    if isinstance(img_file, str):
+        img.save(img_file, "PNG")
+        return None
+    return img
+
+
+def transparent_rgba(rgba, tol=0, ramp=0):
+    """
+    Lower the alpha channel of white pixels in an image array.
+
+    Parameters
+    ----------
+    rgba : numpy.ndarray
+        image of shape (height, width, 3) or (height, width, 4), dtype uint8
+    tol : int, default 0
+        pixels whose color channels all lie within `tol` of 255 are treated as
+        white
+    ramp : int, default 0
+        width of the linear alpha ramp beyond `tol`; see
+        :func:`make_transparent`
+
+    Returns
+    -------
+    numpy.ndarray
+        new RGBA image of shape (height, width, 4), dtype uint8
+
+    Raises
+    ------
+    ValueError : image does not have 3 or 4 color channels
+
+    """
+    rgba = np.asarray(rgba, dtype=np.uint8)
+    if rgba.ndim != 3 or rgba.shape[2] not in (3, 4):
+        raise ValueError(
+            "image must have shape (height, width, 3 or 4)\nshape: {}".format(
+                rgba.shape))
+    if rgba.shape[2] == 3:
+        alpha = np.full(rgba.shape[:2] + (1,), 255, dtype=np.uint8)
+        rgba = np.concatenate([rgba, alpha], axis=2)
+    else:
+        rgba = rgba.copy()
+
+    # Distance from white is the largest deficit of any color channel
+    distance = 255 - rgba[..., :3].min(axis=2)
+    if ramp > 0:
+        scale = np.clip((distance - tol) / ramp, 0., 1.)
+        alpha = (scale * 255. + 0.5).astype(np.uint8)
+        np.minimum(rgba[..., 3], alpha, out=rgba[..., 3])
+    else:
+        rgba[..., 3][distance <= tol] = 0
+    return rgba
+
+
+def get_cmap(cmap=None):
+    """
+    Get a matplotlib colormap by name.
+
+    Parameters
+    ----------
+    cmap : str or matplotlib.colors.Colormap or None, default None
+        name of a matplotlib colormap, which is returned unchanged if it is a
+        colormap itself; if None, matplotlib's default colormap
 
     Returns
     -------
-    None
+    :class:~`matplotlib.colors.Colormap`
+
+    Raises
+    ------
+    ValueError : colormap is not available in matplotlib
 
     Notes
     -----
-    This function overwrites the existing file.
+    Colormaps are looked up in the registry matplotlib.colormaps, or with
+    matplotlib.cm.get_cmap (removed in matplotlib 3.9) in versions of
+    matplotlib older than 3.5, which have no registry.
 
     """
-    img = Image.open(img_file)
-    img = img.convert("RGBA")
-    pixdata = img.load()
-    width, height = img.size
-    for y in range(height):
-        for x in range(width):
-            if pixdata[x, y] == (255, 255, 255, 255):  # if white
-                pixdata[x, y] = (255, 255, 255, 0)  # set alpha = 0
-    img.save(img_file, "PNG")
+    if isinstance(cmap, mpl.colors.Colormap):
+        return cmap
+    registry = getattr(mpl, "colormaps", None)
+    if registry is None:
+        return cm.get_cmap(cmap)
+    if cmap is None:
+        cmap = mpl.rcParams["image.cmap"]
+    try:
+        return registry[cmap]
+    except KeyError:
+        raise ValueError(
+            "{!r} is not a valid value for cmap; supported values are "
+            "{}".format(cmap, ", ".join(sorted(registry)))) from None
 
 
 def check_cmap_plt(cmap):
@@ -42,23 +144,20 @@ def check_cmap_plt(cmap):
 
     Parameters
     ----------
-    cmap : str or None
+    cmap : str or matplotlib.colors.Colormap or None
         a valid matplotlib colormap; if None, return default colormap
         defined in wbplot.config
 
     Returns
     -------
-    cmap : str
+    cmap : str or matplotlib.colors.Colormap
 
     Raises
     ------
     ValueError : colormap is not available matplotlib
 
     """
-    try:
-        _ = cm.get_cmap(cmap)
-    except ValueError as e:
-        raise ValueError(e)
+    get_cmap(cmap)
     return cmap
 
 
@@ -0,0 +1,422 @@
+"""Per-stage timing, I/O and memory statistics of render calls. """
+
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+from functools import wraps
+from threading import Lock
+from os.path import getsize
+import time
+import sys
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+# Stages of a render recorded by profile(), besides the top-level calls (e.g.
+# 'pscalar') whose own time is the Python overhead not spent in any stage:
+#   import - importing dependencies on first use (see wbplot.utils.lazy)
+#   validation - checking the arguments
+#   template - loading a template CIFTI file from disk
+#   colormap - mapping scalars to colors
+#   cifti_write - writing the CIFTI file read by the scene
+#   workspace - extracting the scene and setting up/removing render directories
+#   workbench - running Connectome Workbench
+#   raster - rendering in-process (NumPy backend & calibrated parcel images)
+#   postprocess - transparency, drawing, encoding and writing the image
+STAGES = ['import', 'validation', 'template', 'colormap', 'cifti_write',
+          'workspace', 'workbench', 'raster', 'postprocess']
+
+# Profiles currently recording; stages are not timed while this is empty
+_profiles = []
+_profiles_lock = Lock()
+
+# Innermost stage being recorded by the current thread or asyncio task
+_current = ContextVar("wbplot_stage", default=None)
+
+# Flag of the code of "async def" functions (inspect.CO_COROUTINE)
+_CO_COROUTINE = 0x80
+
+# Context manager returned by stage() when no profile is recording
+_NOT_RECORDING = nullcontext()
+
+
+class StageStats(object):
+    """
+    Statistics of all calls to one stage.
+
+    Attributes
+    ----------
+    calls : int
+        number of times the stage was entered
+    seconds : float
+        wall time spent in the stage, excluding the stages nested inside it
+    cpu_seconds : float
+        CPU time used by this process's thread in the stage, excluding nested
+        stages
+    bytes_written : int
+        bytes of files and images written by the stage
+    subprocess_seconds : float
+        wall time of child processes (i.e. Workbench) run by the stage
+    subprocess_cpu_seconds : float
+        user & system CPU time of those child processes
+    peak_memory : int
+        largest increase in memory allocated by Python during a call,
+        including nested stages, in bytes (only if tracked; see
+        :func:`profile`)
+
+    """
+
+    FIELDS = ['calls', 'seconds', 'cpu_seconds', 'bytes_written',
+              'subprocess_seconds', 'subprocess_cpu_seconds', 'peak_memory']
+
+    def __init__(self, calls=0, seconds=0., cpu_seconds=0., bytes_written=0,
+                 subprocess_seconds=0., subprocess_cpu_seconds=0.,
+                 peak_memory=0):
+        self.calls = calls
+        self.seconds = seconds
+        self.cpu_seconds = cpu_seconds
+        self.bytes_written = bytes_written
+        self.subprocess_seconds = subprocess_seconds
+        self.subprocess_cpu_seconds = subprocess_cpu_seconds
+        self.peak_memory = peak_memory
+
+    def __iadd__(self, other):
+        for field in self.FIELDS[:-1]:
+            setattr(self, field, getattr(self, field) + getattr(other, field))
+        self.peak_memory = max(self.peak_memory, other.peak_memory)
+        return self
+
+    def __repr__(self):
+        return "StageStats({})".format(", ".join(
+            "{}={!r}".format(f, getattr(self, f)) for f in self.FIELDS))
+
+    def to_dict(self):
+        """Get the statistics as a dict, keyed by attribute name."""
+        return {field: getattr(self, field) for field in self.FIELDS}
+
+
+class Stats(object):
+    """
+    Statistics of the stages of every render made while profiling.
+
+    Stats of several batches can be added together, e.g.
+    ``sum(stats_list, Stats())``.
+
+    Attributes
+    ----------
+    stages : dict
+        :class:`StageStats` by stage name, in the order stages were first
+        entered; see STAGES
+    wall_seconds : float
+        wall time spent inside the :func:`profile` block
+    peak_rss : int or None
+        peak resident memory of this process so far, in bytes, when the block
+        exited; None where it cannot be measured
+
+    """
+
+    def __init__(self):
+        self.stages = {}
+        self.wall_seconds = 0.
+        self.peak_rss = None
+        self._lock = Lock()
+
+    def __getitem__(self, name):
+        return self.stages[name]
+
+    def __add__(self, other):
+        if other == 0:  # so that sum() works without a start value
+            return self
+        result = Stats()
+        for stats in (self, other):
+            for name, stage_stats in stats.stages.items():
+                result.stages.setdefault(name, StageStats())
+                result.stages[name] += stage_stats
+        result.wall_seconds = self.wall_seconds + other.wall_seconds
+        peaks = [p for p in (self.peak_rss, other.peak_rss) if p is not None]
+        result.peak_rss = max(peaks) if peaks else None
+        return result
+
+    __radd__ = __add__
+
+    def __repr__(self):
+        return "Stats(stages={}, wall_seconds={:.6g})".format(
+            list(self.stages), self.wall_seconds)
+
+    def record(self, name, stage_stats):
+        """
+        Add a call of a stage to the statistics. Thread-safe.
+
+        Parameters
+        ----------
+        name : str
+        stage_stats : :class:`StageStats`
+
+        Returns
+        -------
+        None
+
+        """
+        with self._lock:
+            self.stages.setdefault(name, StageStats())
+            self.stages[name] += stage_stats
+
+    @property
+    def seconds(self):
+        """Total time spent in all stages."""
+        return sum(s.seconds for s in self.stages.values())
+
+    @property
+    def bytes_written(self):
+        """Total bytes written by all stages."""
+        return sum(s.bytes_written for s in self.stages.values())
+
+    def to_dict(self):
+        """
+        Get the statistics as a dict which can be serialized as JSON.
+
+        Returns
+        -------
+        dict
+            with keys 'stages' (a dict of dicts; see :class:`StageStats`),
+            'seconds', 'bytes_written', 'wall_seconds' and 'peak_rss'
+
+        """
+        return {"stages": {name: s.to_dict()
+                           for name, s in self.stages.items()},
+                "seconds": self.seconds, "bytes_written": self.bytes_written,
+                "wall_seconds": self.wall_seconds, "peak_rss": self.peak_rss}
+
+    def to_json(self, fp=None, **kwargs):
+        """
+        Serialize the statistics as JSON.
+
+        Parameters
+        ----------
+        fp : file-like or None, default None
+            text file to which the JSON is written; if None, return it
+        kwargs : dict
+            passed to :func:`json.dumps`, e.g. ``indent=2``
+
+        Returns
+        -------
+        str or None
+
+        """
+        import json
+        text = json.dumps(self.to_dict(), **kwargs)
+        if fp is None:
+            return text
+        fp.write(text)
+
+
+class _Frame(object):
+    """A stage being recorded: its statistics, and the enclosing stage."""
+
+    def __init__(self, name, parent, memory):
+        self.name = name
+        self.parent = parent
+        self.stats = StageStats(calls=1)
+        self.child_seconds = 0.
+        self.child_cpu_seconds = 0.
+        self.memory = memory
+        self.peak = 0
+        if memory:
+            import tracemalloc
+            self.start_memory, peak = tracemalloc.get_traced_memory()
+            if parent is not None and parent.memory:
+                parent.peak = max(parent.peak, peak)
+            if hasattr(tracemalloc, "reset_peak"):  # Python >= 3.9
+                tracemalloc.reset_peak()
+        self.start = time.perf_counter()
+        self.start_cpu = time.thread_time()
+
+    def finish(self):
+        """Fill in the statistics of the stage once it has exited."""
+        seconds = time.perf_counter() - self.start
+        cpu_seconds = time.thread_time() - self.start_cpu
+        self.stats.seconds = seconds - self.child_seconds
+        self.stats.cpu_seconds = max(0., cpu_seconds - self.child_cpu_seconds)
+        if self.parent is not None:
+            self.parent.child_seconds += seconds
+            self.parent.child_cpu_seconds += cpu_seconds
+        if self.memory:
+            import tracemalloc
+            peak = max(self.peak, tracemalloc.get_traced_memory()[1])
+            self.stats.peak_memory = max(0, peak - self.start_memory)
+            if self.parent is not None and self.parent.memory:
+                self.parent.peak = max(self.parent.peak, peak)
+        return self.stats
+
+
+@contextmanager
+def profile(memory=False, hook=None):
+    """
+    Record statistics of every stage of the renders made inside the block.
+
+    Parameters
+    ----------
+    memory : bool, default False
+        also track the peak memory allocated by Python in each stage, with
+        :mod:`tracemalloc`. this slows rendering down noticeably
+    hook : Callable[str, StageStats] or None, default None
+        called with the name and statistics of each stage as soon as it exits,
+        e.g. to log slow stages
+
+    Yields
+    ------
+    :class:`Stats`
+        filled in as renders are made
+
+    Notes
+    -----
+    Renders in all threads of this process are recorded, including those made
+    by :func:`wbplot.render_many` and the asyncio functions, but not those in
+    worker processes. When renders run concurrently, the CPU time of child
+    processes is attributed to whichever Workbench call finished first, the
+    CPU time of stages awaited by asyncio tasks includes that of other tasks,
+    and tracemalloc's peaks are shared, so these are approximate.
+
+    Example
+    -------
+    >>> with wbplot.profile() as stats:
+    ...     wbplot.pscalar_batch(files, X)
+    >>> stats['workbench'].seconds, stats.to_json(indent=2)
+
+    """
+    import tracemalloc
+    stats = Stats()
+    tracing = memory and not tracemalloc.is_tracing()
+    if tracing:
+        tracemalloc.start()
+    entry = (stats, bool(memory), hook)
+    with _profiles_lock:
+        _profiles.append(entry)
+    start = time.perf_counter()
+    try:
+        yield stats
+    finally:
+        stats.wall_seconds = time.perf_counter() - start
+        with _profiles_lock:
+            _profiles.remove(entry)
+        if tracing:
+            tracemalloc.stop()
+        stats.peak_rss = peak_rss()
+
+
+def stage(name):
+    """
+    Record a stage of a render in every active :func:`profile`.
+
+    Parameters
+    ----------
+    name : str
+        one of STAGES, or the name of a top-level rendering function
+
+    Returns
+    -------
+    context manager
+        which does nothing if no profile is active
+
+    """
+    if not _profiles:
+        return _NOT_RECORDING
+    return _record(name)
+
+
+def profiled(func):
+    """
+    Decorate a rendering function so that each call is recorded as a stage
+    named after the function, which contains the stages of the render.
+    """
+    name = func.__name__
+    if func.__code__.co_flags & _CO_COROUTINE:
+        @wraps(func)
+        async def wrapper(*args, **kwargs):
+            with stage(name):
+                return await func(*args, **kwargs)
+    else:
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with stage(name):
+                return func(*args, **kwargs)
+    return wrapper
+
+
+@contextmanager
+def _record(name):
+    parent = _current.get()
+    memory = any(m for _, m, _ in _profiles)
+    frame = _Frame(name, parent, memory)
+    token = _current.set(frame)
+    try:
+        yield frame
+    finally:
+        _current.reset(token)
+        stage_stats = frame.finish()
+        with _profiles_lock:
+            profiles = list(_profiles)
+        for stats, _, hook in profiles:
+            stats.record(name, stage_stats)
+            if hook is not None:
+                hook(name, stage_stats)
+
+
+def recording():
+    """Check whether a stage is being recorded in this thread or task."""
+    return _current.get() is not None
+
+
+def add_bytes(n):
+    """Count `n` bytes as written by the current stage, if profiling."""
+    frame = _current.get()
+    if frame is not None:
+        frame.stats.bytes_written += int(n)
+
+
+def add_file(path):
+    """Count the size of file `path` as written by the current stage."""
+    frame = _current.get()
+    if frame is not None:
+        frame.stats.bytes_written += getsize(path)
+
+
+def add_subprocess(seconds, cpu_seconds):
+    """Count a child process as run by the current stage, if profiling."""
+    frame = _current.get()
+    if frame is not None:
+        frame.stats.subprocess_seconds += seconds
+        frame.stats.subprocess_cpu_seconds += cpu_seconds
+
+
+def children_cpu_time():
+    """
+    Get the CPU time used by this process's terminated child processes.
+
+    Returns
+    -------
+    float
+        user & system time, in seconds; 0 where it cannot be measured
+
+    """
+    if resource is None:
+        return 0.
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+def peak_rss():
+    """
+    Get the peak resident memory of this process.
+
+    Returns
+    -------
+    int or None
+        in bytes; None where it cannot be measured
+
+    """
+    if resource is None:
+        return None
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxrss if sys.platform == "darwin" else maxrss * 1024
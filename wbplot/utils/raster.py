@@ -0,0 +1,745 @@
+"""Software rasterizer which renders the package's scenes with NumPy. """
+
+import numpy as np
+from .. import config, constants
+from . import palettes, templates, profiling, colormaps
+from .lazy import lazy_import
+from collections import namedtuple
+from os import makedirs, replace, remove
+from os.path import join, exists, split
+from threading import Lock
+import tempfile
+import hashlib
+
+nib = lazy_import("nibabel")
+
+# Surface on which maps are drawn
+SURFACE = "very_inflated_MSMAll"
+
+# Rows of each view's rotation matrix: the world-space directions which point
+# to the right of the image, to its top, and towards the viewer
+VIEWS = {
+    ("left", "lateral"): [[0, -1, 0], [0, 0, 1], [-1, 0, 0]],
+    ("left", "medial"): [[0, 1, 0], [0, 0, 1], [1, 0, 0]],
+    ("right", "lateral"): [[0, 1, 0], [0, 0, 1], [1, 0, 0]],
+    ("right", "medial"): [[0, -1, 0], [0, 0, 1], [-1, 0, 0]],
+}
+
+# Layout of each scene in plots.map_params_to_scene: the (columns, rows) of
+# its grid of panels, and the (hemisphere, view, column, row) of each panel
+_BILATERAL = ((2, 2), (("left", "lateral", 0, 0), ("right", "lateral", 1, 0),
+                       ("left", "medial", 0, 1), ("right", "medial", 1, 1)))
+_LANDSCAPE_LEFT = ((2, 1), (("left", "lateral", 0, 0),
+                            ("left", "medial", 1, 0)))
+_LANDSCAPE_RIGHT = ((2, 1), (("right", "lateral", 0, 0),
+                             ("right", "medial", 1, 0)))
+_PORTRAIT_LEFT = ((1, 2), (("left", "lateral", 0, 0),
+                           ("left", "medial", 0, 1)))
+_PORTRAIT_RIGHT = ((1, 2), (("right", "lateral", 0, 0),
+                            ("right", "medial", 0, 1)))
+SCENES = {1: _BILATERAL, 2: _LANDSCAPE_LEFT, 3: _LANDSCAPE_RIGHT,
+          4: _PORTRAIT_RIGHT, 5: _PORTRAIT_LEFT, 6: _BILATERAL,
+          7: _LANDSCAPE_LEFT, 8: _LANDSCAPE_RIGHT, 9: _PORTRAIT_LEFT,
+          10: _PORTRAIT_RIGHT}
+
+# Fraction of each panel left empty around the surface
+MARGIN = 0.04
+# Shading is AMBIENT + DIFFUSE * cos(angle between normal & view direction)
+AMBIENT = 0.3
+DIFFUSE = 0.7
+# Colors of the background, and of vertices without data
+BACKGROUND = (1., 1., 1.)
+SURFACE_COLOR = (0.7, 0.7, 0.7)
+
+Projection = namedtuple(
+    "Projection", ["shape", "pixels", "vertices", "weights", "shade"])
+Projection.__doc__ = """
+Pixels of a scene covered by the surface, and the vertices drawn in each.
+
+Attributes
+----------
+shape : tuple of int
+    (height, width) of the image
+pixels : numpy.ndarray
+    flat indices of the covered pixels, shape (n,)
+vertices : numpy.ndarray
+    the three vertices of the triangle drawn in each pixel, shape (n, 3).
+    left hemisphere vertices are numbered first, then right hemisphere vertices
+weights : numpy.ndarray
+    barycentric weights of the vertices at each pixel center, shape (n, 3)
+shade : numpy.ndarray
+    shading factor of each pixel, in [0, 1], shape (n,)
+"""
+
+# Subdirectory of config.CACHE_DIR in which projections are saved
+PROJECTION_DIR = "projections"
+
+# Loaded surfaces, computed projections & dense renderers
+_surfaces = dict()
+_projections = dict()
+_dense_renderers = dict()
+_luts = dict()
+_grayordinates = dict()
+_lock = Lock()
+
+
+def load_surface(hemisphere, surface=SURFACE):
+    """
+    Load one hemisphere's S1200 surface mesh.
+
+    Parameters
+    ----------
+    hemisphere : 'left' or 'right'
+    surface : str, default SURFACE
+        surface type, e.g. 'very_inflated_MSMAll' or 'midthickness_MSMAll'
+
+    Returns
+    -------
+    coords : numpy.ndarray
+        vertex coordinates, shape (32492, 3)
+    triangles : numpy.ndarray
+        vertex indices of each triangle, shape (n, 3)
+
+    """
+    key = hemisphere, surface
+    if key not in _surfaces:
+        fname = join(config.PARCELLATIONS_DIR, "S1200.{}.{}.32k_fs_LR.surf.gii"
+                     .format(hemisphere[0].upper(), surface))
+        of = nib.load(fname)
+        coords = of.get_arrays_from_intent("NIFTI_INTENT_POINTSET")[0].data
+        triangles = of.get_arrays_from_intent("NIFTI_INTENT_TRIANGLE")[0].data
+        _surfaces[key] = (np.asarray(coords, dtype=np.float64),
+                          np.asarray(triangles, dtype=np.int32))
+    return _surfaces[key]
+
+
+def grayordinate_vertices(fname):
+    """
+    Get the surface vertex of each cortical grayordinate in a CIFTI file.
+
+    Parameters
+    ----------
+    fname : str
+        absolute path to a dense CIFTI file, e.g. constants.DSCALAR_FILE
+
+    Returns
+    -------
+    numpy.ndarray
+        vertex index of each grayordinate, numbered as in
+        :class:`Projection`
+
+    Raises
+    ------
+    ValueError : file has no cortical surface brain models
+
+    """
+    if fname not in _grayordinates:
+        header = templates.load_template(fname).header
+        left, right = None, None
+        for bm in header.get_index_map(1).brain_models:
+            if bm.brain_structure == "CIFTI_STRUCTURE_CORTEX_LEFT":
+                left = bm
+            elif bm.brain_structure == "CIFTI_STRUCTURE_CORTEX_RIGHT":
+                right = bm
+        if left is None or right is None:
+            raise ValueError(
+                "{} does not contain both cortical hemispheres".format(fname))
+        vertices = np.empty(left.index_count + right.index_count, np.int64)
+        vertices[left.index_offset:left.index_offset + left.index_count] = \
+            np.asarray(left.vertex_indices)
+        vertices[right.index_offset:right.index_offset + right.index_count] = \
+            np.asarray(right.vertex_indices) + left.surface_number_of_vertices
+        _grayordinates[fname] = vertices
+    return _grayordinates[fname]
+
+
+def get_projection(scene, width, height):
+    """
+    Get the projection of a scene, computing it if necessary.
+
+    Parameters
+    ----------
+    scene : int
+        scene number, as returned by :func:`plots.map_params_to_scene`
+    width, height : int
+        size of the image, in pixels
+
+    Returns
+    -------
+    :class:`Projection`
+
+    Notes
+    -----
+    Projections are cached in memory, and saved as compressed .npz files in
+    the "projections" subdirectory of wbplot.config.CACHE_DIR, for each layout
+    and size; scenes which differ only in their data (e.g. scenes 1 and 6)
+    share a projection. Saved projections are keyed by a hash of the package
+    version and every rasterizer setting, so they are recomputed when either
+    changes.
+
+    """
+    if scene not in SCENES:
+        raise ValueError("scene must be one of {}".format(sorted(SCENES)))
+    key = SCENES[scene], width, height
+    projection = _projections.get(key)
+    if projection is None:
+        with _lock:
+            projection = _projections.get(key)
+            if projection is None:
+                fname = projection_file(scene, width, height)
+                projection = load_record(fname, Projection)
+                if projection is None:
+                    projection = project_scene(scene, width, height)
+                    save_record(fname, projection)
+                _projections[key] = projection
+    return projection
+
+
+def projection_file(scene, width, height):
+    """
+    Get the path at which the projection of a scene is cached.
+
+    Parameters
+    ----------
+    scene : int
+        scene number, as returned by :func:`plots.map_params_to_scene`
+    width, height : int
+        size of the image, in pixels
+
+    Returns
+    -------
+    str
+
+    """
+    from .. import __version__
+    settings = (__version__, SURFACE, sorted(VIEWS.items()), SCENES[scene],
+                width, height, MARGIN, AMBIENT, DIFFUSE)
+    key = hashlib.sha256(repr(settings).encode()).hexdigest()[:16]
+    return join(config.CACHE_DIR, PROJECTION_DIR, "{}x{}-{}.npz".format(
+        width, height, key))
+
+
+def load_record(fname, record_type=Projection):
+    """
+    Load a record of arrays saved by :func:`save_record`.
+
+    Parameters
+    ----------
+    fname : str
+        absolute path to the .npz file
+    record_type : namedtuple class, default Projection
+        type of the record; its 'shape' field, if any, is loaded as a tuple
+
+    Returns
+    -------
+    record_type or None
+        None if the file does not exist or cannot be read
+
+    """
+    if not exists(fname):
+        return None
+    try:
+        with np.load(fname) as f:
+            return record_type(*(
+                tuple(int(n) for n in f[name]) if name == "shape" else f[name]
+                for name in record_type._fields))
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def save_record(fname, record):
+    """
+    Save a record of arrays (e.g. a :class:`Projection`) as a compressed .npz
+    file.
+
+    The file is written to a temporary name and then renamed, so concurrent
+    readers never see a partial file. Failure to write (e.g. to a read-only
+    cache directory) is not an error.
+
+    Parameters
+    ----------
+    fname : str
+        absolute path to the .npz file
+    record : namedtuple
+        record whose fields are arrays or tuples of numbers
+
+    Returns
+    -------
+    None
+
+    """
+    try:
+        makedirs(split(fname)[0], exist_ok=True)
+        fd, temp = tempfile.mkstemp(
+            prefix=".tmp-", suffix=".npz", dir=split(fname)[0])
+    except OSError:
+        return
+    try:
+        with open(fd, "wb") as f:
+            np.savez_compressed(f, **record._asdict())
+        replace(temp, fname)
+    except OSError:
+        if exists(temp):
+            remove(temp)
+
+
+def get_dense_renderer(scene, width, height):
+    """
+    Get the :class:`DenseRenderer` for a scene, creating it if necessary.
+
+    Parameters
+    ----------
+    scene : int
+        scene number, as returned by :func:`plots.map_params_to_scene`
+    width, height : int
+        size of the image, in pixels
+
+    Returns
+    -------
+    :class:`DenseRenderer`
+
+    """
+    key = SCENES.get(scene), width, height
+    renderer = _dense_renderers.get(key)
+    if renderer is None:
+        renderer = DenseRenderer(get_projection(scene, width, height))
+        _dense_renderers[key] = renderer
+    return renderer
+
+
+class DenseRenderer(object):
+    """
+    Render dense maps into a projected scene with a NumPy gather.
+
+    The grayordinates drawn in each pixel, and their barycentric weights
+    premultiplied by the pixel's shading, are computed once from the scene's
+    :class:`Projection`. Each map is then drawn by looking up the colors of
+    those grayordinates and summing them, without rasterizing again.
+
+    Parameters
+    ----------
+    projection : :class:`Projection`
+    fname : str, default constants.DSCALAR_FILE
+        dense CIFTI file which defines the grayordinates
+
+    """
+
+    def __init__(self, projection, fname=constants.DSCALAR_FILE):
+        vertices = grayordinate_vertices(fname)
+        self.n_grayordinates = len(vertices)
+
+        # Vertices without a grayordinate (i.e., the medial wall) point to an
+        # extra, last row of the colors passed to render()
+        n_vertices = len(_blank_vertex_colors())
+        index = np.full(n_vertices, self.n_grayordinates, dtype=np.int32)
+        index[vertices] = np.arange(self.n_grayordinates, dtype=np.int32)
+        self.index = np.ascontiguousarray(index[projection.vertices].T)
+        self.weights = np.ascontiguousarray(
+            (projection.weights * projection.shade[:, None]).T,
+            dtype=np.float32)
+        self.pixels = projection.pixels
+        self.shape = projection.shape
+        self.background = np.empty(self.shape + (3,), dtype=np.uint8)
+        self.background[:] = np.round(np.asarray(BACKGROUND) * 255)
+
+    def render(self, colors):
+        """
+        Draw one map.
+
+        Parameters
+        ----------
+        colors : numpy.ndarray
+            RGB color of each grayordinate in [0, 255], followed by the color
+            of vertices without data; shape (n_grayordinates + 1, 3)
+
+        Returns
+        -------
+        numpy.ndarray
+            RGB image of dtype uint8, shape (height, width, 3)
+
+        """
+        colors = np.asarray(colors, dtype=np.float32)
+        rgb = np.take(colors, self.index[0], axis=0)
+        rgb *= self.weights[0][:, None]
+        temp = np.empty_like(rgb)
+        for i in (1, 2):
+            np.take(colors, self.index[i], axis=0, out=temp)
+            temp *= self.weights[i][:, None]
+            rgb += temp
+        rgb += 0.5
+        pixel_colors = np.empty(rgb.shape, dtype=np.uint8)
+        np.copyto(pixel_colors, rgb, casting="unsafe")
+
+        # Scatter whole pixels at once by viewing each RGB triple as one item
+        image = self.background.copy()
+        np.put(image.reshape(-1, 3).view("V3").ravel(), self.pixels,
+               pixel_colors.view("V3").ravel())
+        return image
+
+
+def project_scene(scene, width, height):
+    """
+    Rasterize the surfaces of a scene.
+
+    Parameters
+    ----------
+    scene : int
+        scene number, as returned by :func:`plots.map_params_to_scene`
+    width, height : int
+        size of the image, in pixels
+
+    Returns
+    -------
+    :class:`Projection`
+
+    Raises
+    ------
+    ValueError : unknown scene
+
+    """
+    if scene not in SCENES:
+        raise ValueError("scene must be one of {}".format(sorted(SCENES)))
+    (ncols, nrows), panels = SCENES[scene]
+    cell_w, cell_h = width / ncols, height / nrows
+    n_left = len(load_surface("left")[0])
+
+    # Rotate each panel's surface into view, then fit all panels at one scale
+    views = []
+    for hemisphere, view, col, row in panels:
+        coords, triangles = load_surface(hemisphere)
+        rotation = np.array(VIEWS[(hemisphere, view)], dtype=np.float64)
+        xyz = coords.dot(rotation.T)
+        normals = vertex_normals(coords, triangles).dot(rotation.T)
+        offset = n_left if hemisphere == "right" else 0
+        views.append((xyz, normals, triangles, offset, col, row))
+    scale = min(min(cell_w * (1 - 2 * MARGIN) / np.ptp(xyz[:, 0]),
+                    cell_h * (1 - 2 * MARGIN) / np.ptp(xyz[:, 1]))
+                for xyz, _, _, _, _, _ in views)
+
+    parts = []
+    for xyz, normals, triangles, offset, col, row in views:
+        center = (xyz.min(axis=0) + xyz.max(axis=0)) / 2
+        x = (xyz[:, 0] - center[0]) * scale + (col + 0.5) * cell_w
+        y = (center[1] - xyz[:, 1]) * scale + (row + 0.5) * cell_h
+        pixels, tri, weights = rasterize(
+            x, y, xyz[:, 2], triangles, width, height)
+        vertices = triangles[tri]
+        normal = np.einsum("ij,ijk->ik", weights, normals[vertices])
+        normal_z = normal[:, 2] / np.maximum(
+            np.linalg.norm(normal, axis=1), 1e-12)
+        shade = AMBIENT + DIFFUSE * np.clip(normal_z, 0., 1.)
+        parts.append((pixels, vertices + offset, weights, shade))
+
+    return Projection(
+        (height, width),
+        np.concatenate([p[0] for p in parts]).astype(np.int32),
+        np.concatenate([p[1] for p in parts]).astype(np.int32),
+        np.concatenate([p[2] for p in parts]).astype(np.float32),
+        np.concatenate([p[3] for p in parts]).astype(np.float32))
+
+
+def rasterize(x, y, z, triangles, width, height):
+    """
+    Find the front-most triangle covering each pixel, using a z-buffer.
+
+    Parameters
+    ----------
+    x, y : numpy.ndarray
+        image coordinates of each vertex, in pixels (y increases downwards)
+    z : numpy.ndarray
+        depth of each vertex; larger values are closer to the viewer
+    triangles : numpy.ndarray
+        vertex indices of each triangle, shape (n, 3), counterclockwise when
+        seen from the front
+    width, height : int
+        size of the image, in pixels
+
+    Returns
+    -------
+    pixels : numpy.ndarray
+        flat indices of the covered pixels
+    tri : numpy.ndarray
+        index of the triangle drawn in each covered pixel
+    weights : numpy.ndarray
+        barycentric weights of the triangle's vertices at each pixel center,
+        shape (len(pixels), 3)
+
+    """
+    xt, yt, zt = x[triangles], y[triangles], z[triangles]
+
+    # Drop triangles facing away from the viewer. y points down in the image,
+    # so front-facing triangles have negative signed area there
+    area = ((xt[:, 1] - xt[:, 0]) * (yt[:, 2] - yt[:, 0]) -
+            (xt[:, 2] - xt[:, 0]) * (yt[:, 1] - yt[:, 0]))
+    front = np.flatnonzero(area < 0)
+    xt, yt, zt, area = xt[front], yt[front], zt[front], area[front]
+
+    # Enumerate the pixel centers in each triangle's bounding box
+    x0 = np.maximum(np.ceil(xt.min(axis=1) - 0.5), 0).astype(np.int64)
+    x1 = np.minimum(np.floor(xt.max(axis=1) - 0.5), width - 1).astype(np.int64)
+    y0 = np.maximum(np.ceil(yt.min(axis=1) - 0.5), 0).astype(np.int64)
+    y1 = np.minimum(np.floor(yt.max(axis=1) - 0.5), height - 1).astype(
+        np.int64)
+    bw = np.maximum(x1 - x0 + 1, 0)
+    counts = bw * np.maximum(y1 - y0 + 1, 0)
+    tri = np.repeat(np.arange(len(front)), counts)
+    local = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts,
+                                                counts)
+    px = x0[tri] + local % bw[tri]
+    py = y0[tri] + local // bw[tri]
+
+    # Barycentric weights of each pixel center; keep those inside a triangle
+    qx, qy = px + 0.5, py + 0.5
+    xt, yt = xt[tri], yt[tri]
+    weights = np.empty((len(tri), 3))
+    for i in range(3):
+        j, k = (i + 1) % 3, (i + 2) % 3
+        weights[:, i] = ((xt[:, j] - qx) * (yt[:, k] - qy) -
+                         (xt[:, k] - qx) * (yt[:, j] - qy))
+    weights /= area[tri, None]
+    inside = np.flatnonzero((weights >= -1e-9).all(axis=1))
+    tri, weights = tri[inside], weights[inside]
+    pixels = py[inside] * width + px[inside]
+    depth = (weights * zt[tri]).sum(axis=1)
+
+    # Keep the closest fragment in each pixel
+    order = np.lexsort((depth, pixels))
+    last = np.ones(len(order), dtype=bool)
+    last[:-1] = pixels[order[1:]] != pixels[order[:-1]]
+    keep = order[last]
+    return pixels[keep], front[tri[keep]], weights[keep]
+
+
+def vertex_normals(coords, triangles):
+    """
+    Compute unit vertex normals as the area-weighted mean of face normals.
+
+    Parameters
+    ----------
+    coords : numpy.ndarray
+        vertex coordinates, shape (n, 3)
+    triangles : numpy.ndarray
+        vertex indices of each triangle, shape (m, 3)
+
+    Returns
+    -------
+    numpy.ndarray
+        shape (n, 3)
+
+    """
+    a, b, c = (coords[triangles[:, i]] for i in range(3))
+    faces = np.cross(b - a, c - a)
+    normals = np.zeros_like(coords)
+    for i in range(3):
+        for d in range(3):
+            normals[:, d] += np.bincount(
+                triangles[:, i], faces[:, d], minlength=len(coords))
+    return normals / np.maximum(
+        np.linalg.norm(normals, axis=1, keepdims=True), 1e-12)
+
+
+def shade_vertex_colors(projection, colors, interpolate=True):
+    """
+    Draw per-vertex colors into a projected scene.
+
+    Parameters
+    ----------
+    projection : :class:`Projection`
+    colors : numpy.ndarray
+        RGB color of each vertex, in [0, 1], shape (n_vertices, 3)
+    interpolate : bool, default True
+        blend the colors of each triangle's vertices; if False, draw the color
+        of the nearest vertex, which keeps boundaries between labels sharp
+
+    Returns
+    -------
+    numpy.ndarray
+        RGB image of dtype uint8, shape (height, width, 3)
+
+    """
+    if interpolate:
+        rgb = np.einsum("ij,ijk->ik", projection.weights,
+                        colors[projection.vertices])
+    else:
+        nearest = projection.weights.argmax(axis=1)
+        rgb = colors[projection.vertices[np.arange(len(nearest)), nearest]]
+    height, width = projection.shape
+    image = np.empty((height * width, 3), dtype=np.uint8)
+    image[:] = np.round(np.asarray(BACKGROUND) * 255).astype(np.uint8)
+    image[projection.pixels] = np.clip(
+        rgb * projection.shade[:, None] * 255 + 0.5, 0, 255).astype(np.uint8)
+    return image.reshape(height, width, 3)
+
+
+def dscalar_colors(dscalars, palette='magma', palette_params=None):
+    """
+    Color each grayordinate by its dense scalar value.
+
+    Parameters
+    ----------
+    dscalars : numpy.ndarray
+        dense scalar values, of length 59412
+    palette : str, default 'magma'
+        Workbench color palette with a matplotlib equivalent (see
+        palettes.MPL_EQUIVALENTS), or a matplotlib colormap
+    palette_params : dict or None, default None
+        only 'pos-user', 'neg-user', 'pos-percent', 'neg-percent', 'disp-pos',
+        'disp-neg' and 'disp-zero' are supported. the colormap spans the range
+        given by :func:`dscalar_range`
+
+    Returns
+    -------
+    numpy.ndarray
+        RGB color of each grayordinate in [0, 255], followed by the color of
+        vertices without data; shape (len(dscalars) + 1, 3), dtype float32.
+        see :meth:`DenseRenderer.render`
+
+    Raises
+    ------
+    ValueError : `palette` or `palette_params` is not supported
+
+    Notes
+    -----
+    Values are binned into the colormap's lookup table exactly as matplotlib
+    does, so colors are identical to those of a
+    :class:~`matplotlib.cm.ScalarMappable` with the same range.
+
+    """
+    lut = colormap_lut(palettes.mpl_cmap(palette))
+    params = dict() if palette_params is None else dict(palette_params)
+    unsupported = sorted(set(params) - set(_DENSE_PARAMS))
+    if unsupported:
+        raise ValueError(
+            "palette params {} are not supported by the numpy backend".format(
+                unsupported))
+
+    x = np.asarray(dscalars, dtype=np.float64)
+    finite = np.isfinite(x)
+    shown = finite.copy()
+    for k, test in _DENSE_PARAMS.items():
+        if test is not None and palettes._bool(params.get(k, True)) == "false":
+            shown &= ~test(x)
+    vmin, vmax = _dense_range(x[finite], params)
+
+    # Bin values as matplotlib.colors.Colormap does: index = floor(x * N),
+    # with x == 1 in the last bin. row N of the table is SURFACE_COLOR
+    n = len(lut) - 1
+    with np.errstate(invalid="ignore"):
+        scaled = (x - vmin) / (vmax - vmin) * n if vmax > vmin else x * 0.
+        index = np.clip(scaled, 0, n - 1, out=scaled).astype(np.intp)
+    index[~shown] = n
+    colors = np.empty((len(x) + 1, 3), dtype=np.float32)
+    np.take(lut, index, axis=0, out=colors[:-1])
+    colors[-1] = lut[n]
+    return colors
+
+
+def dscalar_range(dscalars, palette_params=None):
+    """
+    Find the range of values spanned by the colormap of dense scalars.
+
+    Parameters
+    ----------
+    dscalars : numpy.ndarray
+        dense scalar values
+    palette_params : dict or None, default None
+        see :func:`dscalar_colors`
+
+    Returns
+    -------
+    tuple
+        (min, max) of the colormap, as drawn by :func:`dscalar_colors`
+
+    Notes
+    -----
+    The range follows Workbench's scale mode (see
+    :func:`wbplot.utils.palettes.scale_mode`): the user values if both
+    'pos-user' and 'neg-user' are given, percentiles of the positive and
+    negative values if both 'pos-percent' and 'neg-percent' are given, and
+    otherwise the most negative and most positive values. As Workbench scales
+    positive values up from zero and negative values down from zero, the
+    range always includes zero in the last two modes.
+
+    """
+    x = np.asarray(dscalars, dtype=np.float64)
+    vmin, vmax = _dense_range(x[np.isfinite(x)], dict(palette_params or {}))
+    return float(vmin), float(vmax)
+
+
+def colormap_lut(cmap):
+    """
+    Get the lookup table of a matplotlib colormap.
+
+    Parameters
+    ----------
+    cmap : str
+        name of a matplotlib colormap
+
+    Returns
+    -------
+    numpy.ndarray
+        RGB color of each of the colormap's N bins in [0, 255], followed by
+        SURFACE_COLOR; shape (N + 1, 3), dtype float32
+
+    """
+    lut = _luts.get(cmap)
+    if lut is None:
+        rgba = colormaps.get_lut(cmap)[:-3]
+        lut = np.empty((len(rgba) + 1, 3), dtype=np.float32)
+        lut[:-1] = rgba[:, :3] * 255
+        lut[-1] = np.asarray(SURFACE_COLOR) * 255
+        _luts[cmap] = lut
+    return lut
+
+
+def render_dscalars(dscalars, scene, width, height, palette='magma',
+                    palette_params=None):
+    """
+    Render dense scalars with the NumPy rasterizer.
+
+    Returns
+    -------
+    numpy.ndarray
+        RGB image of dtype uint8, shape (height, width, 3)
+
+    """
+    with profiling.stage('colormap'):
+        colors = dscalar_colors(dscalars, palette, palette_params)
+    with profiling.stage('raster'):
+        return get_dense_renderer(scene, width, height).render(colors)
+
+
+# palette_params supported for dense maps, and the values each 'disp-' key hides
+_DENSE_PARAMS = {
+    "pos-user": None, "neg-user": None, "pos-percent": None,
+    "neg-percent": None, "disp-pos": lambda x: x > 0,
+    "disp-neg": lambda x: x < 0, "disp-zero": lambda x: x == 0}
+
+
+def _dense_range(x, params):
+    """Find the (min, max) of the colormap for finite dense scalars `x`."""
+    mode = palettes.scale_mode(params)
+    # the (negMax, negMin, posMin, posMax) values written into the file
+    if mode == "MODE_USER_SCALE":
+        neg_max, _, _, pos_max = palettes.scale_values(
+            params, "UserScaleValues")
+        return neg_max, pos_max
+    pos, neg = x[x > 0], -x[x < 0]
+    vmin = -neg.max() if neg.size else 0.
+    vmax = pos.max() if pos.size else 0.
+    if mode == "MODE_AUTO_SCALE_PERCENTAGE":
+        neg_max, _, _, pos_max = palettes.scale_values(
+            params, "AutoScalePercentageValues")
+        if pos.size:
+            vmax = np.percentile(pos, pos_max)
+        if neg.size:
+            vmin = -np.percentile(neg, neg_max)
+    if vmin == vmax:  # no nonzero values
+        return 0., 1.
+    return vmin, vmax
+
+
+def _blank_vertex_colors():
+    """Make an array of vertex colors which are all SURFACE_COLOR."""
+    n = len(load_surface("left")[0]) + len(load_surface("right")[0])
+    return np.tile(np.asarray(SURFACE_COLOR, dtype=np.float64), (n, 1))
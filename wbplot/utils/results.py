@@ -0,0 +1,246 @@
+"""On-disk cache of rendered images, keyed by their data and parameters. """
+
+import numpy as np
+from .. import config, constants
+from os import close, makedirs, replace, remove, scandir, stat, utime
+from os.path import join, exists
+from shutil import copyfile
+from threading import Lock
+import tempfile
+import hashlib
+
+# Subdirectory of config.CACHE_DIR in which rendered images are cached
+RESULT_DIR = "results"
+
+# Fraction of wbplot.config.RESULT_CACHE_BYTES to which an oversized cache is
+# shrunk, so that the cache directory is only scanned once in a while
+EVICT_TO = 0.9
+
+# Running total of the bytes stored in each cache directory by this process,
+# since it was last scanned
+_totals = dict()
+_lock = Lock()
+
+
+def enabled(cache=None):
+    """
+    Check whether rendered images are cached.
+
+    Parameters
+    ----------
+    cache : bool or None, default None
+        if None, use wbplot.config.RESULT_CACHE
+
+    Returns
+    -------
+    bool
+
+    """
+    return config.RESULT_CACHE if cache is None else bool(cache)
+
+
+def result_key(kind, data, **params):
+    """
+    Compute the key under which a rendered image is cached.
+
+    Parameters
+    ----------
+    kind : str
+        the rendering function, e.g. 'pscalar'
+    data : numpy.ndarray
+        the scalar map
+    params : dict
+        the function's other arguments, which must have stable reprs
+
+    Returns
+    -------
+    str
+        hash of the data's dtype, shape and bytes, the parameters, the package
+        version and the size and modification time of the template files
+
+    """
+    from .. import __version__
+    data = np.ascontiguousarray(data)
+    h = hashlib.sha256()
+    h.update(repr((kind, __version__, _template_stamp(), str(data.dtype),
+                   data.shape, sorted(params.items()))).encode())
+    h.update(data.view(np.uint8).ravel())
+    return h.hexdigest()
+
+
+def result_file(key):
+    """
+    Get the path at which the image for `key` is cached.
+
+    Parameters
+    ----------
+    key : str
+        as returned by :func:`result_key`
+
+    Returns
+    -------
+    str
+
+    """
+    return join(config.CACHE_DIR, RESULT_DIR, key + ".png")
+
+
+def lookup(key):
+    """
+    Read the cached image for `key`, marking it as recently used.
+
+    Parameters
+    ----------
+    key : str
+        as returned by :func:`result_key`
+
+    Returns
+    -------
+    bytes or None
+        contents of the cached PNG image, or None if there is none
+
+    Notes
+    -----
+    The image is read here, rather than its path returned, so that an image
+    evicted by another process is simply a cache miss.
+
+    """
+    fname = result_file(key)
+    try:
+        utime(fname)  # mark as recently used
+        with open(fname, "rb") as f:
+            return f.read()
+    except OSError:
+        return None
+
+
+def store(key, png):
+    """
+    Add a rendered image to the cache, evicting the least recently used
+    images if the cache grows beyond wbplot.config.RESULT_CACHE_BYTES.
+
+    The cache directory is only scanned when the running total of the images
+    stored since the last scan exceeds that limit; the cache is then shrunk
+    to a fraction EVICT_TO of it.
+
+    The image is copied to a temporary name and then renamed, so concurrent
+    readers never see a partial file. Failure to write (e.g. to a read-only
+    cache directory) is not an error.
+
+    Parameters
+    ----------
+    key : str
+        as returned by :func:`result_key`
+    png : str or bytes
+        absolute path to the rendered PNG image, or its contents
+
+    Returns
+    -------
+    None
+
+    """
+    directory = join(config.CACHE_DIR, RESULT_DIR)
+    try:
+        makedirs(directory, exist_ok=True)
+        fd, temp = tempfile.mkstemp(prefix=".tmp-", dir=directory)
+    except OSError:
+        return
+    try:
+        if isinstance(png, bytes):
+            with open(fd, "wb") as f:
+                f.write(png)
+        else:
+            close(fd)
+            copyfile(png, temp)
+        replace(temp, result_file(key))
+        size = len(png) if isinstance(png, bytes) else stat(png).st_size
+    except OSError:
+        if exists(temp):
+            remove(temp)
+        return
+    max_bytes = config.RESULT_CACHE_BYTES
+    with _lock:
+        total = _totals.get(directory)
+        if total is not None and total + size <= max_bytes:
+            _totals[directory] = total + size
+            return
+    _evict(directory, max_bytes, int(max_bytes * EVICT_TO))
+
+
+def evict(max_bytes):
+    """
+    Remove the least recently used images until the cache is no larger than
+    `max_bytes`.
+
+    Parameters
+    ----------
+    max_bytes : int
+        maximum total size of the cached images, in bytes
+
+    Returns
+    -------
+    int
+        number of images removed
+
+    """
+    return _evict(join(config.CACHE_DIR, RESULT_DIR), max_bytes, max_bytes)
+
+
+def clear():
+    """
+    Remove every cached image.
+
+    Returns
+    -------
+    int
+        number of images removed
+
+    """
+    return evict(0)
+
+
+def _evict(directory, max_bytes, target):
+    """
+    If the images in `directory` take up more than `max_bytes`, remove the
+    least recently used until they take up no more than `target`, and record
+    the total that remains. Returns the number of images removed.
+    """
+    with _lock:
+        entries = []
+        try:
+            with scandir(directory) as it:
+                for entry in it:
+                    if entry.name.endswith(".png") and entry.is_file():
+                        st = entry.stat()
+                        entries.append(
+                            (st.st_mtime_ns, st.st_size, entry.path))
+        except OSError:
+            _totals.pop(directory, None)
+            return 0
+        total = sum(size for _, size, _ in entries)
+        removed = 0
+        if total > max_bytes:
+            for _, size, path in sorted(entries):
+                if total <= target:
+                    break
+                try:
+                    remove(path)
+                except OSError:
+                    continue
+                total -= size
+                removed += 1
+        _totals[directory] = total
+        return removed
+
+
+def _template_stamp():
+    """Get the size & modification time of each file used for rendering."""
+    stamp = []
+    for fname in [config.SCENE_ZIP_FILE, config.PARCELLATION_FILE,
+                  constants.DLABEL_FILE, constants.DSCALAR_FILE]:
+        try:
+            st = stat(fname)
+            stamp.append((fname, st.st_size, st.st_mtime_ns))
+        except OSError:
+            stamp.append((fname, None, None))
+    return stamp
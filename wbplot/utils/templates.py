@@ -0,0 +1,118 @@
+"""Process-wide cache of the template neuroimaging files. """
+
+import numpy as np
+from .. import constants, config
+from . import profiling
+from .lazy import lazy_import
+from threading import Lock
+
+nib = lazy_import("nibabel")
+
+# Loaded templates, keyed by filename
+_templates = dict()
+_lock = Lock()
+
+
+def load_template(fname):
+    """
+    Load a template CIFTI file, reusing the image if it was loaded before.
+
+    Parameters
+    ----------
+    fname : str
+        absolute path to the template file
+
+    Returns
+    -------
+    of : :class:~`nibabel.Cifti2Image` instance
+        the template image. it is shared by all callers and must not be
+        modified; its data block is memory-mapped read-only
+
+    """
+    return _get(fname)["image"]
+
+
+def template_data(fname):
+    """
+    Get the data array of a template CIFTI file.
+
+    Parameters
+    ----------
+    fname : str
+        absolute path to the template file
+
+    Returns
+    -------
+    numpy.ndarray
+        read-only, memory-mapped view of the template's data block
+
+    """
+    return _get(fname)["data"]
+
+
+def template_xml(fname):
+    """
+    Get the CIFTI-2 header XML of a template CIFTI file.
+
+    Parameters
+    ----------
+    fname : str
+        absolute path to the template file
+
+    Returns
+    -------
+    bytes
+
+    """
+    entry = _get(fname)
+    if entry["xml"] is None:
+        with profiling.stage('template'):
+            entry["xml"] = entry["image"].header.to_xml()
+    return entry["xml"]
+
+
+def preload_templates():
+    """
+    Load the package's template files into the cache.
+
+    Call this before forking worker processes so that the workers share the
+    memory-mapped pages of the templates rather than each loading their own.
+
+    Returns
+    -------
+    None
+
+    """
+    for fname in [config.PARCELLATION_FILE, constants.DSCALAR_FILE]:
+        template_xml(fname)
+
+
+def clear_templates():
+    """
+    Remove all templates from the cache.
+
+    Returns
+    -------
+    None
+
+    """
+    with _lock:
+        _templates.clear()
+
+
+def _get(fname):
+    """Get the cache entry for `fname`, loading the file if necessary."""
+    entry = _templates.get(fname)
+    if entry is not None:
+        return entry
+    with _lock:
+        entry = _templates.get(fname)
+        if entry is None:
+            with profiling.stage('template'):
+                of = nib.load(fname, mmap='r')
+                data = np.asanyarray(of.dataobj)
+                if isinstance(data, np.ndarray):
+                    data.flags.writeable = False
+            entry = {"image": of, "data": data, "xml": None}
+            _templates[fname] = entry
+    return entry
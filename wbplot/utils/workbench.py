@@ -0,0 +1,238 @@
+"""Auxiliary functions for running Connectome Workbench commands. """
+
+from .. import config
+from . import profiling
+from .lazy import lazy_import
+from collections import namedtuple
+from subprocess import Popen, PIPE, TimeoutExpired
+import signal
+import time
+import os
+
+asyncio = lazy_import("asyncio")
+
+WorkbenchCall = namedtuple(
+    "WorkbenchCall", ["args", "returncode", "stdout", "stderr", "elapsed"])
+WorkbenchCall.__doc__ = """
+Record of a completed call to a Connectome Workbench command.
+
+Attributes
+----------
+args : list of str
+    the command and its arguments
+returncode : int
+    exit status of the command
+stdout : str
+    captured standard output
+stderr : str
+    captured standard error
+elapsed : float
+    wall time of the call, in seconds
+"""
+
+
+class WorkbenchError(RuntimeError):
+    """
+    Raised when a Connectome Workbench command cannot be run, exits with a
+    non-zero status, or times out.
+
+    Attributes
+    ----------
+    cmd : list of str
+        the command and its arguments
+    returncode : int or None
+        exit status of the command; None if it could not be run or timed out
+    stderr : str
+        captured standard error
+    elapsed : float
+        wall time of the call, in seconds
+    timed_out : bool
+        whether the command was killed because it exceeded its timeout
+
+    """
+
+    def __init__(self, message, cmd=(), returncode=None, stderr="", elapsed=0.,
+                 timed_out=False):
+        super().__init__(message)
+        self.cmd = list(cmd)
+        self.returncode = returncode
+        self.stderr = stderr
+        self.elapsed = elapsed
+        self.timed_out = timed_out
+
+    def __reduce__(self):
+        return self.__class__, (
+            self.args[0], self.cmd, self.returncode, self.stderr, self.elapsed,
+            self.timed_out)
+
+    def __str__(self):
+        msg = super().__str__()
+        if self.stderr.strip():
+            msg += "\nstderr:\n{}".format(self.stderr.strip())
+        return msg
+
+
+def run(args, timeout=None):
+    """
+    Run a Connectome Workbench command.
+
+    Parameters
+    ----------
+    args : list of str
+        the command's arguments, not including wb_command itself, e.g.
+        ['-show-scene', scene_file, '1', file_out, '1263', '835']
+    timeout : float or None, default None
+        seconds after which the command (and any processes it started) is
+        killed; if None, use wbplot.config.WB_TIMEOUT
+
+    Returns
+    -------
+    :class:~`WorkbenchCall`
+
+    Raises
+    ------
+    WorkbenchError : command could not be run, exited with a non-zero status,
+        or timed out
+
+    Notes
+    -----
+    The command is run directly from an argument list, never through a shell,
+    so paths need no quoting. On POSIX systems it is started in its own process
+    group, so that the whole group can be killed on timeout.
+
+    """
+    with profiling.stage('workbench'):
+        args, timeout = _prepare(args, timeout)
+        start = time.perf_counter()
+        start_cpu = profiling.children_cpu_time()
+        try:
+            proc = Popen(args, stdout=PIPE, stderr=PIPE,
+                         start_new_session=(os.name == "posix"))
+        except OSError as e:
+            raise _launch_error(args, e)
+
+        try:
+            stdout, stderr = proc.communicate(timeout=timeout)
+        except TimeoutExpired:
+            _kill(proc)
+            stdout, stderr = proc.communicate()
+            raise _timeout_error(args, timeout, stderr, start)
+        except BaseException:
+            _kill(proc)
+            proc.wait()
+            raise
+        finally:
+            _record(args, start, start_cpu)
+        return _finish(args, proc.returncode, stdout, stderr, start)
+
+
+async def run_async(args, timeout=None):
+    """
+    Run a Connectome Workbench command without blocking the event loop.
+
+    Parameters
+    ----------
+    args : list of str
+        the command's arguments, not including wb_command itself
+    timeout : float or None, default None
+        seconds after which the command (and any processes it started) is
+        killed; if None, use wbplot.config.WB_TIMEOUT
+
+    Returns
+    -------
+    :class:~`WorkbenchCall`
+
+    Raises
+    ------
+    WorkbenchError : command could not be run, exited with a non-zero status,
+        or timed out
+
+    Notes
+    -----
+    This is the coroutine counterpart of :func:`run`. If the awaiting task is
+    cancelled, the command's process group is killed and reaped before the
+    cancellation propagates, so no orphaned Workbench processes are left
+    behind.
+
+    """
+    with profiling.stage('workbench'):
+        args, timeout = _prepare(args, timeout)
+        start = time.perf_counter()
+        start_cpu = profiling.children_cpu_time()
+        try:
+            proc = await asyncio.create_subprocess_exec(
+                *args, stdout=PIPE, stderr=PIPE,
+                start_new_session=(os.name == "posix"))
+        except OSError as e:
+            raise _launch_error(args, e)
+
+        try:
+            stdout, stderr = await asyncio.wait_for(
+                proc.communicate(), timeout)
+        except asyncio.TimeoutError:
+            _kill(proc)
+            await proc.wait()
+            raise _timeout_error(args, timeout, b"", start)
+        except BaseException:
+            _kill(proc)
+            await asyncio.shield(proc.wait())
+            raise
+        finally:
+            _record(args, start, start_cpu)
+        return _finish(args, proc.returncode, stdout, stderr, start)
+
+
+def _prepare(args, timeout):
+    """Prepend wb_command to `args` and fill in the default timeout."""
+    args = [config.WB_COMMAND] + [str(a) for a in args]
+    timeout = config.WB_TIMEOUT if timeout is None else timeout
+    return args, timeout
+
+
+def _launch_error(args, e):
+    """Make the error raised when the command cannot be started."""
+    return WorkbenchError(
+        "could not run {}: {}. is Connectome Workbench installed?".format(
+            args[0], e), args)
+
+
+def _timeout_error(args, timeout, stderr, start):
+    """Make the error raised when the command is killed after `timeout`."""
+    return WorkbenchError(
+        "{} {} timed out after {} s".format(args[0], args[1], timeout),
+        args, None, stderr.decode(errors="replace"),
+        time.perf_counter() - start, timed_out=True)
+
+
+def _finish(args, returncode, stdout, stderr, start):
+    """Check the exit status of a finished command and record the call."""
+    elapsed = time.perf_counter() - start
+    stdout = stdout.decode(errors="replace")
+    stderr = stderr.decode(errors="replace")
+    if returncode != 0:
+        raise WorkbenchError(
+            "{} {} failed with exit status {}".format(
+                args[0], args[1], returncode),
+            args, returncode, stderr, elapsed)
+    return WorkbenchCall(args, returncode, stdout, stderr, elapsed)
+
+
+def _record(args, start, start_cpu):
+    """Count a finished command, and the image it rendered, if profiling."""
+    if not profiling.recording():
+        return
+    profiling.add_subprocess(time.perf_counter() - start,
+                             profiling.children_cpu_time() - start_cpu)
+    if args[1] == "-show-scene" and len(args) > 4 and os.path.exists(args[4]):
+        profiling.add_file(args[4])
+
+
+def _kill(proc):
+    """Kill a process and, on POSIX systems, its process group."""
+    if os.name == "posix":
+        try:
+            os.killpg(proc.pid, signal.SIGKILL)
+            return
+        except OSError:
+            pass
+    proc.kill()
@@ -0,0 +1,323 @@
+"""Auxiliary functions for managing the cached scene workspace directory. """
+
+from .. import constants, config
+from . import profiling
+from os import listdir, makedirs, rename, stat, symlink, link, remove
+from os.path import join, exists, isdir, isfile, getsize, split, realpath
+from contextlib import contextmanager
+from zipfile import ZipFile
+from shutil import copyfile, rmtree
+import tempfile
+import hashlib
+import zlib
+
+try:
+    import fcntl
+except ImportError:  # not available on Windows
+    fcntl = None
+
+# Prefix of workspace directory names inside config.CACHE_DIR
+WORKSPACE_PREFIX = "scene-"
+
+# Suffix of the file next to each workspace which renders lock (shared) while
+# they use it, and which clean_workspaces locks (exclusive) to remove it
+LOCK_SUFFIX = ".lock"
+
+# Workspaces already materialized by this process, keyed by the scene zip
+# file's path, size and modification time
+_workspaces = dict()
+
+
+def scene_key(zip_file=None):
+    """
+    Compute the key identifying the workspace for a scene zip file.
+
+    Parameters
+    ----------
+    zip_file : str or None, default None
+        path to the scene zip file; if None, use wbplot.config.SCENE_ZIP_FILE
+
+    Returns
+    -------
+    str
+        hash of the zip file's contents and the package version
+
+    """
+    from .. import __version__
+    zip_file = config.SCENE_ZIP_FILE if zip_file is None else zip_file
+    h = hashlib.sha256(__version__.encode())
+    with open(zip_file, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()[:16]
+
+
+def get_workspace(zip_file=None):
+    """
+    Get the directory containing the extracted scene file, materializing it in
+    wbplot.config.CACHE_DIR if it does not yet exist.
+
+    Parameters
+    ----------
+    zip_file : str or None, default None
+        path to the scene zip file; if None, use wbplot.config.SCENE_ZIP_FILE
+
+    Returns
+    -------
+    str
+        absolute path to the workspace directory
+
+    Raises
+    ------
+    RuntimeError : scene file was not extracted to the workspace
+
+    Notes
+    -----
+    Workspaces are keyed by a hash of the zip file's contents and the package
+    version, so the zip file is only extracted once per package version. Files
+    in the zip archive which are identical to files shipped in the package's
+    data directory are linked rather than extracted, as are the neuroimaging
+    files which are pre-loaded into the scene file. Workspaces for other keys
+    are removed when a new workspace is materialized.
+
+    """
+    zip_file = config.SCENE_ZIP_FILE if zip_file is None else zip_file
+    st = stat(zip_file)
+    memo = (zip_file, st.st_size, st.st_mtime_ns)
+    workspace = _workspaces.get(memo)
+    if workspace is not None and exists(join(workspace, "Human.scene")):
+        return workspace
+
+    key = scene_key(zip_file)
+    workspace = join(config.CACHE_DIR, WORKSPACE_PREFIX + key)
+    if not exists(workspace):
+        _materialize(zip_file, workspace)
+        clean_workspaces(keep=key)
+    if not exists(join(workspace, "Human.scene")):
+        raise RuntimeError(
+            "scene file was not successfully extracted to {}".format(workspace))
+    _workspaces[memo] = workspace
+    return workspace
+
+
+def clean_workspaces(keep=None):
+    """
+    Remove cached workspaces which are not in use from wbplot.config.CACHE_DIR.
+
+    Parameters
+    ----------
+    keep : str or None, default None
+        key of a workspace to keep (see :func:`scene_key`); if None, all
+        unused workspaces are removed
+
+    Returns
+    -------
+    None
+
+    Notes
+    -----
+    A workspace is in use while a render, in any process and by any version
+    of wbplot, has a render directory linked to it; such workspaces are
+    skipped. Where file locks are not available (i.e. on Windows), in-use
+    workspaces cannot be detected, so this must not be called while renders
+    are in progress.
+
+    """
+    if not exists(config.CACHE_DIR):
+        return
+    for name in listdir(config.CACHE_DIR):
+        if not name.startswith(WORKSPACE_PREFIX) or name.endswith(LOCK_SUFFIX):
+            continue
+        if keep is not None and name == WORKSPACE_PREFIX + keep:
+            continue
+        workspace = join(config.CACHE_DIR, name)
+        lock = _lock(workspace, exclusive=True)
+        if lock is None:  # in use
+            continue
+        try:
+            rmtree(workspace, ignore_errors=True)
+            _remove(workspace + LOCK_SUFFIX)
+        finally:
+            lock.close()
+    for workspace in [w for w in _workspaces.values() if not exists(w)]:
+        for memo in [m for m, w in _workspaces.items() if w == workspace]:
+            del _workspaces[memo]
+
+
+@contextmanager
+def render_workspace(image_file):
+    """
+    Create an isolated directory in which a single render is performed.
+
+    Parameters
+    ----------
+    image_file : str
+        the neuroimaging file which is written by the render, i.e. either
+        wbplot.constants.DLABEL_FILE or wbplot.constants.DSCALAR_FILE
+
+    Yields
+    ------
+    str
+        absolute path to the render directory
+
+    Raises
+    ------
+    RuntimeError : scene file was not extracted to the workspace
+
+    Notes
+    -----
+    The render directory contains a copy of the scene file, which refers to the
+    neuroimaging files in the same directory, and links to every other file in
+    the cached workspace except `image_file`, which is left to be written by
+    the caller. Concurrent renders therefore never write to the same files.
+    The directory and its contents are removed on exit.
+
+    """
+    with profiling.stage('workspace'):
+        workspace, lock = _use_workspace()
+        try:
+            render_dir = tempfile.mkdtemp(prefix="wbplot-")
+        except BaseException:
+            lock.close()
+            raise
+        try:
+            for name in listdir(workspace):
+                if name == split(image_file)[1]:
+                    continue
+                source = join(workspace, name)
+                target = join(render_dir, name)
+                if name == "Human.scene":
+                    copyfile(source, target)
+                else:
+                    _link_tree(source, target)
+        except BaseException:
+            rmtree(render_dir, ignore_errors=True)
+            lock.close()
+            raise
+    try:
+        yield render_dir
+    finally:
+        with profiling.stage('workspace'):
+            rmtree(render_dir, ignore_errors=True)
+            lock.close()
+
+
+def _use_workspace():
+    """
+    Get the workspace, with a shared lock which stops :func:`clean_workspaces`
+    from removing it until the returned lock file is closed.
+    """
+    while True:
+        workspace = get_workspace()
+        lock = _lock(workspace)
+        if lock is not None:
+            return workspace, lock
+        # removed by another process after it was found; make it again
+        for memo in [m for m, w in _workspaces.items() if w == workspace]:
+            del _workspaces[memo]
+
+
+def _lock(workspace, exclusive=False):
+    """
+    Lock `workspace`, waiting for a shared lock or failing at once to get an
+    exclusive one.
+
+    Returns
+    -------
+    file or None
+        the open lock file, which releases the lock when closed; None if the
+        workspace does not exist or is locked by another render
+
+    """
+    try:
+        f = open(workspace + LOCK_SUFFIX, "a")
+    except FileNotFoundError:  # config.CACHE_DIR was removed
+        return None
+    if fcntl is not None:
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB if exclusive
+                        else fcntl.LOCK_SH)
+        except OSError:  # held by another process
+            f.close()
+            return None
+    if not exists(join(workspace, "Human.scene")):
+        f.close()
+        return None
+    return f
+
+
+def _remove(path):
+    """Remove file `path`, if it exists."""
+    try:
+        remove(path)
+    except OSError:
+        pass
+
+
+def _materialize(zip_file, workspace):
+    """Extract `zip_file` to a new `workspace` directory."""
+    makedirs(config.CACHE_DIR, exist_ok=True)
+    temp_dir = tempfile.mkdtemp(prefix=".tmp-", dir=config.CACHE_DIR)
+    try:
+        with ZipFile(zip_file, "r") as z:
+            for info in z.infolist():
+                if info.is_dir():
+                    continue
+                target = join(temp_dir, info.filename)
+                source = join(constants.DATA_DIR, info.filename)
+                if _same_file(source, info):
+                    makedirs(split(target)[0], exist_ok=True)
+                    if _link(source, target):
+                        continue
+                z.extract(info, temp_dir)
+
+        # Link the neuroimaging files which are pre-loaded into the scene file
+        for image_file in [constants.DLABEL_FILE, constants.DSCALAR_FILE]:
+            target = join(temp_dir, split(image_file)[1])
+            if not exists(target) and not _link(image_file, target):
+                copyfile(image_file, target)
+
+        # Another process may have materialized the same workspace meanwhile
+        try:
+            rename(temp_dir, workspace)
+        except OSError:
+            if not exists(workspace):
+                raise
+    finally:
+        if exists(temp_dir):
+            rmtree(temp_dir, ignore_errors=True)
+
+
+def _same_file(source, info):
+    """Check whether `source` has the same contents as zip member `info`."""
+    if not isfile(source) or getsize(source) != info.file_size:
+        return False
+    crc = 0
+    with open(source, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            crc = zlib.crc32(block, crc)
+    return crc == info.CRC
+
+
+def _link_tree(source, target):
+    """Link `target` to file or directory `source`, copying as a fallback."""
+    source = realpath(source)
+    if _link(source, target):
+        return
+    if isdir(source):
+        makedirs(target)
+        for name in listdir(source):
+            _link_tree(join(source, name), join(target, name))
+    else:
+        copyfile(source, target)
+
+
+def _link(source, target):
+    """Link `target` to `source`, returning False if links are unsupported."""
+    for make_link in (symlink, link):
+        try:
+            make_link(source, target)
+            return True
+        except (OSError, NotImplementedError):
+            continue
+    return False
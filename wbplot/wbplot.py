@@ -1,22 +1,31 @@
 from wbplot.utils import plots, images
-from wbplot import config, constants
-from os import system
-import platform
-from os.path import join, exists, split
-from zipfile import ZipFile
-import tempfile
+from wbplot.utils import workspaces, workbench, raster, parcels, results
+from wbplot.utils import outputs, palettes, annotate, profiling, colormaps
+from wbplot import constants, config
+from os.path import join, split
+from functools import partial
+from itertools import islice
+import numpy as np
 
+# Number of maps of pscalar_batch which are mapped to colors in one call
+BATCH_SIZE = 256
 
+
+@profiling.profiled
 def pscalar(file_out, pscalars, orientation='landscape',
-            hemisphere=None, vrange=None, cmap='magma', transparent=False):
+            hemisphere=None, vrange=None, cmap='magma', transparent=False,
+            backend='workbench', cache=None, output='array', colorbar=None,
+            norm='linear'):
     """
     Save an image of parcellated scalars using Connnectome Workbench.
 
     Parameters
     ----------
-    file_out : str
+    file_out : str or file-like or None
         absolute path to filename where image is saved. if `filename` has an
-        extension, it must be .png, e.g. fout="/Users/jbb/Desktop/test.png"
+        extension, it must be .png, e.g. fout="/Users/jbb/Desktop/test.png".
+        may also be a binary file-like object to which the PNG image is
+        written, or None to return the image in the format set by `output`
     pscalars : numpy.ndarray
         parcel scalar values
     orientation : 'portrait' or 'landscape', default 'landscape'
@@ -30,85 +39,90 @@ def pscalar(file_out, pscalars, orientation='landscape',
         MATPLOTLIB colormap to use for plotting
     transparent : bool, default False
         make all white pixels in resultant image transparent
+    backend : 'workbench' or 'numpy', default 'workbench'
+        render with Connectome Workbench, or in-process with the NumPy
+        rasterizer in :mod:`wbplot.utils.raster`, which does not need
+        Workbench installed. the two backends draw similar, but not identical,
+        images
+    cache : bool or None, default None
+        serve the image from, and add it to, the on-disk cache of rendered
+        images (see :mod:`wbplot.utils.results`); if None, use
+        wbplot.config.RESULT_CACHE
+    output : 'array' or 'image' or 'png', default 'array'
+        if `file_out` is None, return the image as an RGBA array of shape
+        (height, width, 4), a :class:~`PIL.Image.Image`, or PNG bytes
+    colorbar : bool or dict or None, default None
+        draw a colorbar onto the image, spanning the same colormap and range
+        of values as the map. if a dict, its items (e.g. 'loc', 'ticks' and
+        'label') are passed to :func:`wbplot.utils.annotate.add_colorbar`.
+        only drawn with the 'linear' and 'symmetric' norms
+    norm : str, default 'linear'
+        normalization which maps values onto the colormap: 'linear', 'log',
+        'symmetric' (centered on zero) or 'quantile' (histogram equalized);
+        see wbplot.utils.colormaps.NORMS
 
     Returns
     -------
-    None
+    None or numpy.ndarray or PIL.Image.Image or bytes
+        the image, if `file_out` is None
+
+    Notes
+    -----
+    Once a scene has been calibrated by :func:`wbplot.utils.parcels.calibrate`,
+    it is drawn by re-colouring a cached image of the parcel in each pixel
+    rather than by running Connectome Workbench. Set
+    wbplot.config.PARCEL_IMAGES to False to always run Workbench.
 
     Raises
     ------
-    RuntimeError : scene file was not copied to temp directory
+    RuntimeError : scene file was not extracted to the workspace directory
+    WorkbenchError : Connectome Workbench failed to render the image, or timed
+        out (see wbplot.config.WB_TIMEOUT)
 
     """
 
-    # Check file extension
-    if file_out[-4:] != ".png":  # TODO: improve input handling
-        file_out += ".png"
-
-    # Perform checks on inputs
-    cmap = plots.check_cmap_plt(cmap)
-    orientation = plots.check_orientation(orientation)
-    hemisphere = images.check_parcel_hemi(pscalars, hemisphere)
-    if hemisphere is not None:
-        images.check_pscalars_unilateral(pscalars)
-    else:
-        images.check_pscalars_bilateral(pscalars)
-
-    # If `pscalars` is unilateral, pad other hemisphere with zeros
-    pscalars = images.map_unilateral_to_bilateral(
-        pscalars=pscalars, hemisphere=hemisphere)
-
-    # Write `pscalars` to the neuroimaging file which is pre-loaded into the
-    # scene file, and update the colors for each parcel using the file metadata
-    temp_dir = tempfile.gettempdir()
-    temp_cifti = join(temp_dir, split(constants.DLABEL_FILE)[1])
-    images.write_parcellated_image(
-        data=pscalars, fout=temp_cifti, cmap=cmap, vrange=vrange)
-
-    # This is just to prevent error messages written to console because
-    # ImageDense.dscalar.nii doesn't exist in the scene directory
-    dscalar_out = join(temp_dir, split(constants.DSCALAR_FILE)[1])
-    # if 'windows' in platform.system().lower():
-    #     cmd = f'xcopy /I {constants.DSCALAR_FILE} {dscalar_out}'
-    # else:
-    cmd = "cp {} {}".format(constants.DSCALAR_FILE, dscalar_out)
-    system(cmd)
-
-    # Now copy the scene file & HumanCorticalParcellations directory to the
-    # temp directory as well
-    with ZipFile(config.SCENE_ZIP_FILE, "r") as z:  # unzip to temp dir
-        z.extractall(temp_dir)
-    scene_file = join(temp_dir, "Human.scene")
-    if not exists(scene_file):
-        raise RuntimeError(
-            "scene file was not successfully copied to {}".format(scene_file))
-
-    # Map the input parameters to the appropriate scene in the scene file
-    scene, width, height = plots.map_params_to_scene(
-        dtype='pscalars', orientation=orientation, hemisphere=hemisphere)
-
-    # Call Connectome Workbench's command-line utilities to generate an image
-    cmd = 'wb_command -show-scene "{}" {} "{}" {} {}'.format(
-        scene_file, scene, file_out, width, height)
-    # cmd += " >/dev/null 2>&1"
-    system(cmd)
-
-    if transparent:  # Make background (defined as white pixels) transparent
-        plots.make_transparent(file_out)
+    with profiling.stage('validation'):
+        outputs.check_output(file_out, output)
+        file_out = _check_file_out(file_out)
+        backend = _check_backend(backend)
+        pscalars, cmap, scene, width, height = _check_pscalar_args(
+            pscalars, orientation, hemisphere, cmap)
+        norm = colormaps.check_norm(norm)
+    key = None
+    if results.enabled(cache):
+        key = results.result_key(
+            'pscalar', pscalars, cmap=colormaps.cmap_key(cmap),
+            vrange=_vrange_key(vrange), norm=norm, scene=scene, width=width,
+            height=height, transparent=bool(transparent), backend=backend,
+            parcel_image=_parcel_image_key(scene, width, height, backend),
+            colorbar=_colorbar_key(colorbar))
+    draw = None
+    if colorbar:
+        draw = _colorbar_drawer(colorbar, cmap, colormaps.colorbar_range(
+            pscalars, vrange, norm))
+    render = partial(
+        _render_pscalar, pscalars=pscalars, cmap=cmap, vrange=vrange,
+        norm=norm, scene=scene, width=width, height=height,
+        transparent=transparent, backend=backend, draw=draw)
+    return _cached_render(render, key, file_out, output)
 
 
+@profiling.profiled
 def dscalar(file_out, dscalars, orientation='landscape',
             hemisphere=None, palette='magma', transparent=False,
-            palette_params=None):
+            palette_params=None, backend='workbench', cache=None,
+            output='array', colorbar=None):
 
     """
     Save an image of dense scalars using Connnectome Workbench.
 
     Parameters
     ----------
-    file_out : str
+    file_out : str or file-like or None
         absolute path to filename where image is saved. if `filename` has an
-        extension, it must be .png, e.g. fout="/Users/jbb/Desktop/test.png"
+        extension, it must be .png, e.g. fout="/Users/jbb/Desktop/test.png".
+        may also be a binary file-like object to which the PNG image is
+        written, or None to return the image in the format set by `output`
     dscalars : numpy.ndarray
         dense scalar values
     orientation : 'portrait' or 'landscape', default 'landscape'
@@ -120,13 +134,34 @@ def dscalar(file_out, dscalars, orientation='landscape',
     transparent : bool, default False
         make all white pixels in resultant image transparent
     palette_params : dict or None, default None
-        additional (key: value) pairs passed to "wb_command -cifti-palette". for
-        more info, see
+        additional (key: value) pairs, as passed to "wb_command -cifti-palette".
+        for more info, see
         https://humanconnectome.org/software/workbench-command/-cifti-palette
+    backend : 'workbench' or 'numpy', default 'workbench'
+        render with Connectome Workbench, or in-process with the NumPy
+        rasterizer in :mod:`wbplot.utils.raster`, which does not need
+        Workbench installed. the two backends draw similar, but not identical,
+        images. the numpy backend supports only palettes with a matplotlib
+        equivalent, and a subset of `palette_params`
+    cache : bool or None, default None
+        serve the image from, and add it to, the on-disk cache of rendered
+        images (see :mod:`wbplot.utils.results`); if None, use
+        wbplot.config.RESULT_CACHE
+    output : 'array' or 'image' or 'png', default 'array'
+        if `file_out` is None, return the image as an RGBA array of shape
+        (height, width, 4), a :class:~`PIL.Image.Image`, or PNG bytes
+    colorbar : bool or dict or None, default None
+        draw a colorbar onto the image, spanning the same colormap and range
+        of values as the map (see :func:`wbplot.utils.raster.dscalar_range`).
+        if a dict, its items (e.g. 'loc', 'ticks' and 'label') are passed to
+        :func:`wbplot.utils.annotate.add_colorbar`. only palettes with a
+        matplotlib equivalent (see wbplot.utils.palettes.MPL_EQUIVALENTS) are
+        supported
 
     Returns
     -------
-    None
+    None or numpy.ndarray or PIL.Image.Image or bytes
+        the image, if `file_out` is None
 
     Notes
     -----
@@ -140,54 +175,536 @@ def dscalar(file_out, dscalars, orientation='landscape',
         palette_params["disp-zero"] = True
         palette_params["inversion"] = "POSITIVE_WITH_NEGATIVE"
     The above, passed to this function, would invert the color palette and
-    display zero-valued scalars (when `fout` is opened in wb_view). Note that
-    arguments pos-percent, pos-user, neg-percent, & neg-user are currently not
-    supported.
+    display zero-valued scalars (when `fout` is opened in wb_view). The keys
+    listed in :func:`wbplot.utils.palettes.palette_mapping` are written into
+    the file in-process; any other "wb_command -cifti-palette" option makes
+    the Workbench backend run that command too, and is not supported by the
+    numpy backend.
+
+    The colorbar is drawn linearly from the bottom to the top of the palette's
+    range, following its scale mode. Workbench, however, maps positive and
+    negative values onto the two halves of the palette separately, so for maps
+    with both the colorbar is exact only if the positive and negative ranges
+    are the same size. Palettes without a matplotlib equivalent, e.g.
+    ROY-BIG-BL and videen_style, are rejected before rendering.
+
+    Raises
+    ------
+    ValueError : invalid arguments, or `colorbar` was requested for a palette
+        which has no matplotlib equivalent
+    RuntimeError : scene file was not extracted to the workspace directory
+    WorkbenchError : Connectome Workbench failed to render the image, or timed
+        out (see wbplot.config.WB_TIMEOUT)
+
+    """
+
+    with profiling.stage('validation'):
+        outputs.check_output(file_out, output)
+        backend = _check_backend(backend)
+        palette, scene, width, height = _check_dscalar_args(
+            dscalars, orientation, hemisphere, palette)
+    key = None
+    if results.enabled(cache):
+        key = results.result_key(
+            'dscalar', dscalars, palette=palette,
+            palette_params=repr(sorted((palette_params or {}).items())),
+            scene=scene, width=width, height=height,
+            transparent=bool(transparent), backend=backend,
+            colorbar=_colorbar_key(colorbar))
+    draw = None
+    if colorbar:
+        draw = _colorbar_drawer(
+            colorbar, palettes.colorbar_cmap(palette),
+            raster.dscalar_range(dscalars, palette_params))
+    render = partial(
+        _render_dscalar, dscalars=dscalars, palette=palette,
+        palette_params=palette_params, scene=scene, width=width, height=height,
+        transparent=transparent, backend=backend, draw=draw)
+    return _cached_render(render, key, file_out, output)
+
+
+@profiling.profiled
+def pscalar_batch(files_out, pscalars, orientation='landscape',
+                  hemisphere=None, vrange=None, cmap='magma',
+                  transparent=False, backend='workbench', norm='linear'):
+    """
+    Save images of many parcellated scalar maps using Connectome Workbench.
+
+    Input checks, scene extraction and loading of the template DLABEL file are
+    performed once for the whole batch, rather than once per map as they would
+    be by repeated calls to :func:`pscalar`, and up to BATCH_SIZE maps at a
+    time are mapped to colors in a single call.
+
+    Parameters
+    ----------
+    files_out : sequence of str
+        absolute paths to filenames where images are saved, one per map. if a
+        filename has an extension, it must be .png
+    pscalars : numpy.ndarray or iterable of numpy.ndarray
+        parcel scalar values; either a two-dimensional array with one map per
+        row, or an iterable yielding one-dimensional arrays
+    orientation : 'portrait' or 'landscape', default 'landscape'
+        orientation of the output images. if hemisphere is None (i.e., if data
+        are bilateral), this argument is ignored.
+    hemisphere : 'left' or 'right' or None, default None
+        which hemisphere `pscalars` correspond to. if bilateral, use None
+    vrange : tuple or None, default None
+        data (min, max) for plotting; if None, each map uses its own range
+    cmap : str, default 'magma'
+        MATPLOTLIB colormap to use for plotting
+    transparent : bool, default False
+        make all white pixels in resultant images transparent
+    backend : 'workbench' or 'numpy', default 'workbench'
+        render with Connectome Workbench, or in-process with the NumPy
+        rasterizer in :mod:`wbplot.utils.raster`, which does not need
+        Workbench installed. the two backends draw similar, but not identical,
+        images
+    norm : str, default 'linear'
+        normalization which maps values onto the colormap; see
+        :func:`pscalar`
+
+    Returns
+    -------
+    None
+
+    Raises
+    ------
+    RuntimeError : scene file was not extracted to the workspace directory
+    WorkbenchError : Connectome Workbench failed to render the image, or timed
+        out (see wbplot.config.WB_TIMEOUT)
+    ValueError : number of maps does not match number of output files
+
+    """
+
+    # Perform checks on inputs which are shared by all maps
+    with profiling.stage('validation'):
+        backend = _check_backend(backend)
+        cmap = plots.check_cmap_plt(cmap)
+        orientation = plots.check_orientation(orientation)
+        hemisphere = images.check_dense_hemi(hemisphere)
+        if vrange is not None:
+            vrange = plots.check_vrange(vrange)
+        norm = colormaps.check_norm(norm)
+        scene, width, height = plots.map_params_to_scene(
+            dtype='pscalars', orientation=orientation, hemisphere=hemisphere)
+    batches = _batch_colors(
+        files_out, pscalars, hemisphere, cmap, vrange, norm)
+
+    renderer = _parcel_renderer(scene, width, height, backend)
+    if renderer is not None:
+        for file_out, colors in batches:
+            with profiling.stage('raster'):
+                image = renderer.render(colors[:, :3] * 255)
+            outputs.from_array(image, file_out, transparent=transparent)
+        return
+
+    # Set up the render directory and the template DLABEL file only once
+    c = images.Cifti()
+    with workspaces.render_workspace(constants.DLABEL_FILE) as render_dir:
+        scene_file = join(render_dir, "Human.scene")
+        temp_cifti = join(render_dir, split(constants.DLABEL_FILE)[1])
+
+        for file_out, colors in batches:
+            c.set_colors(colors)
+            c.save(temp_cifti)
+            _show_scene(scene_file, scene, file_out, width, height)
+            if transparent:
+                _make_transparent(file_out)
+
+
+@profiling.profiled
+def dscalar_batch(files_out, dscalars, orientation='landscape',
+                  hemisphere=None, palette='magma', transparent=False,
+                  palette_params=None, backend='workbench'):
+    """
+    Save images of many dense scalar maps using Connectome Workbench.
+
+    Input checks, scene extraction and loading of the template DSCALAR file are
+    performed once for the whole batch, rather than once per map as they would
+    be by repeated calls to :func:`dscalar`.
+
+    Parameters
+    ----------
+    files_out : sequence of str
+        absolute paths to filenames where images are saved, one per map. if a
+        filename has an extension, it must be .png
+    dscalars : numpy.ndarray or iterable of numpy.ndarray
+        dense scalar values; either a two-dimensional array with one map per
+        row, or an iterable yielding one-dimensional arrays
+    orientation : 'portrait' or 'landscape', default 'landscape'
+        orientation of the output images. if hemisphere is None (i.e., if data
+        are bilateral), this argument is ignored.
+    hemisphere : 'left' or 'right' or None, default None
+    palette : str, default 'magma'
+        name of color palette
+    transparent : bool, default False
+        make all white pixels in resultant images transparent
+    palette_params : dict or None, default None
+        additional (key: value) pairs, as passed to "wb_command
+        -cifti-palette"; see :func:`dscalar`
+    backend : 'workbench' or 'numpy', default 'workbench'
+        render with Connectome Workbench, or in-process with the NumPy
+        rasterizer in :mod:`wbplot.utils.raster`, which does not need
+        Workbench installed. the two backends draw similar, but not identical,
+        images
+
+    Returns
+    -------
+    None
 
     Raises
     ------
-    RuntimeError : scene file was not copied to temp directory
+    RuntimeError : scene file was not extracted to the workspace directory
+    WorkbenchError : Connectome Workbench failed to render the image, or timed
+        out (see wbplot.config.WB_TIMEOUT)
+    ValueError : number of maps does not match number of output files
+
+    """
+
+    with profiling.stage('validation'):
+        backend = _check_backend(backend)
+        hemisphere = images.check_dense_hemi(hemisphere)
+        palette = plots.check_cmap_wb(palette)
+        orientation = plots.check_orientation(orientation)
+        scene, width, height = plots.map_params_to_scene(
+            dtype='dscalars', orientation=orientation, hemisphere=hemisphere)
+
+    if backend == 'numpy':
+        for file_out, data in _pair_outputs(files_out, dscalars):
+            with profiling.stage('validation'):
+                images.check_dscalars(data)
+            image = raster.render_dscalars(
+                data, scene, width, height, palette, palette_params)
+            outputs.from_array(
+                image, _check_file_out(file_out), transparent=transparent)
+        return
+
+    # Set up the render directory only once
+    with workspaces.render_workspace(constants.DSCALAR_FILE) as render_dir:
+        scene_file = join(render_dir, "Human.scene")
+        temp_cifti = join(render_dir, split(constants.DSCALAR_FILE)[1])
+
+        for file_out, data in _pair_outputs(files_out, dscalars):
+            file_out = _check_file_out(file_out)
+            with profiling.stage('validation'):
+                images.check_dscalars(data)
+            images.write_dense_image(
+                dscalars=data, fout=temp_cifti, palette=palette,
+                palette_params=palette_params)
+            _show_scene(scene_file, scene, file_out, width, height)
+            if transparent:
+                _make_transparent(file_out)
+
+
+def _check_pscalar_args(pscalars, orientation, hemisphere, cmap):
+    """
+    Check the inputs of :func:`pscalar` and map them to a scene.
+
+    Returns
+    -------
+    pscalars : numpy.ndarray
+        bilateral parcel scalar values
+    cmap : str
+    scene, width, height : int
+        see :func:`wbplot.utils.plots.map_params_to_scene`
+
+    """
+
+    # Perform checks on inputs
+    cmap = plots.check_cmap_plt(cmap)
+    orientation = plots.check_orientation(orientation)
+    hemisphere = images.check_parcel_hemi(pscalars, hemisphere)
+    if hemisphere is not None:
+        images.check_pscalars_unilateral(pscalars)
+    else:
+        images.check_pscalars_bilateral(pscalars)
 
+    # If `pscalars` is unilateral, pad other hemisphere with zeros
+    pscalars = images.map_unilateral_to_bilateral(
+        pscalars=pscalars, hemisphere=hemisphere)
+
+    # Map the input parameters to the appropriate scene in the scene file
+    scene, width, height = plots.map_params_to_scene(
+        dtype='pscalars', orientation=orientation, hemisphere=hemisphere)
+    return pscalars, cmap, scene, width, height
+
+
+def _check_dscalar_args(dscalars, orientation, hemisphere, palette):
     """
+    Check the inputs of :func:`dscalar` and map them to a scene.
+
+    Returns
+    -------
+    palette : str
+    scene, width, height : int
+        see :func:`wbplot.utils.plots.map_params_to_scene`
 
+    """
     hemisphere = images.check_dense_hemi(hemisphere)
     palette = plots.check_cmap_wb(palette)
     orientation = plots.check_orientation(orientation)
     images.check_dscalars(dscalars)
 
-    # Write `dscalars` to a new neuroimaging file in a temp directory & update
-    # color palette
-    temp_dir = tempfile.gettempdir()
-    temp_cifti = join(temp_dir, split(constants.DSCALAR_FILE)[1])
+    scene, width, height = plots.map_params_to_scene(
+        dtype='dscalars', orientation=orientation, hemisphere=hemisphere)
+    return palette, scene, width, height
+
+
+def _check_batch_pscalars(pscalars, hemisphere):
+    """Check one map of :func:`pscalar_batch` and make it bilateral."""
+    with profiling.stage('validation'):
+        if hemisphere is not None:
+            images.check_pscalars_unilateral(pscalars)
+        else:
+            images.check_pscalars_bilateral(pscalars)
+        return images.map_unilateral_to_bilateral(
+            pscalars=pscalars, hemisphere=hemisphere)
+
+
+def _batch_colors(files_out, pscalars, hemisphere, cmap, vrange, norm):
+    """
+    Check the maps of :func:`pscalar_batch` and yield the output file and RGBA
+    parcel colors of each, mapping up to BATCH_SIZE maps to colors at once.
+    """
+    pairs = _pair_outputs(files_out, pscalars)
+    while True:
+        batch = list(islice(pairs, BATCH_SIZE))
+        if not batch:
+            return
+        files = [_check_file_out(file_out) for file_out, _ in batch]
+        data = np.stack(
+            [_check_batch_pscalars(x, hemisphere) for _, x in batch])
+        with profiling.stage('colormap'):
+            colors = colormaps.map_colors(data, cmap, vrange, norm)
+        yield from zip(files, colors)
+
+
+def _check_backend(backend):
+    """Check the `backend` argument of the rendering functions."""
+    if backend not in ['workbench', 'numpy']:
+        raise ValueError("backend must be 'workbench' or 'numpy'")
+    return backend
+
+
+def _render_pscalar(file_out, output, pscalars, cmap, vrange, scene, width,
+                    height, transparent, backend, draw=None, norm='linear'):
+    """Render checked, bilateral `pscalars`; see :func:`_cached_render`."""
+    renderer = _parcel_renderer(scene, width, height, backend)
+    if renderer is not None:
+        return outputs.from_array(parcels.render_pscalars(
+            renderer, pscalars, cmap, vrange, norm), file_out, output,
+            transparent, draw)
+
+    # Render inside a private copy of the scene directory, which links to the
+    # cached scene file & HumanCorticalParcellations directory
+    with workspaces.render_workspace(constants.DLABEL_FILE) as render_dir:
+        scene_file = _write_pscalars(
+            render_dir, pscalars, cmap, vrange, norm)
+
+        # Call Connectome Workbench's command-line utilities to generate an
+        # image, then make its background (defined as white pixels)
+        # transparent, draw on it and/or load it into memory if necessary
+        png = _png_file(file_out, render_dir)
+        _show_scene(scene_file, scene, png, width, height)
+        return outputs.from_png(png, file_out, output, transparent, draw)
+
+
+def _render_dscalar(file_out, output, dscalars, palette, palette_params, scene,
+                    width, height, transparent, backend, draw=None):
+    """Render checked `dscalars`; see :func:`_cached_render`."""
+    if backend == 'numpy':
+        return outputs.from_array(raster.render_dscalars(
+            dscalars, scene, width, height, palette, palette_params),
+            file_out, output, transparent, draw)
+
+    # Render inside a private copy of the scene directory, which links to the
+    # cached scene file & HumanCorticalParcellations directory
+    with workspaces.render_workspace(constants.DSCALAR_FILE) as render_dir:
+        scene_file = _write_dscalars(
+            render_dir, dscalars, palette, palette_params)
+        png = _png_file(file_out, render_dir)
+        _show_scene(scene_file, scene, png, width, height)
+        return outputs.from_png(png, file_out, output, transparent, draw)
+
+
+def _png_file(file_out, render_dir):
+    """Get the path to which Workbench writes the image for `file_out`."""
+    if isinstance(file_out, str):
+        return file_out
+    return join(render_dir, "image.png")
+
+
+def _cached_render(render, key, file_out, output):
+    """
+    Deliver an image rendered by ``render(file_out, output)``, serving it from
+    and adding it to the result cache if `key` is not None.
+    """
+    if key is None:
+        return render(file_out, output)
+    cached = results.lookup(key)
+    if cached is not None:
+        return outputs.from_png(cached, file_out, output)
+    if isinstance(file_out, str):
+        render(file_out, output)
+        results.store(key, file_out)
+        return None
+    png = render(None, 'png')
+    results.store(key, png)
+    return outputs.from_png(png, file_out, output)
+
+
+def _colorbar_drawer(colorbar, cmap, vrange):
+    """Make a function which draws the colorbar described by `colorbar`."""
+    kwargs = dict(colorbar) if isinstance(colorbar, dict) else {}
+    unsupported = sorted(set(kwargs) - set(annotate.COLORBAR_OPTIONS))
+    if unsupported:
+        raise ValueError("colorbar options {} are not supported; use {}".format(
+            unsupported, annotate.COLORBAR_OPTIONS))
+    loc = kwargs.get('loc')
+    if isinstance(loc, str) and loc not in annotate.LOCATIONS:
+        raise ValueError("colorbar loc must be one of {}".format(
+            sorted(annotate.LOCATIONS)))
+    return partial(annotate.add_colorbar, cmap=cmap,
+                   vrange=plots.check_vrange(tuple(vrange)), **kwargs)
+
+
+def _colorbar_key(colorbar):
+    """Make a stable version of the `colorbar` argument for the result cache."""
+    if isinstance(colorbar, dict):
+        return repr(sorted(colorbar.items()))
+    return bool(colorbar)
+
+
+def _vrange_key(vrange):
+    """Make a stable, hashable version of `vrange` for the result cache."""
+    return None if vrange is None else tuple(float(v) for v in vrange)
+
+
+def _parcel_renderer(scene, width, height, backend):
+    """
+    Get the renderer which re-colours a parcel image of a pscalar scene, or
+    None if the scene must be rendered by Connectome Workbench.
+    """
+    if backend == 'numpy':
+        return parcels.get_renderer(scene, width, height, backend)
+    if config.PARCEL_IMAGES:
+        return parcels.get_renderer(scene, width, height)
+    return None
+
+
+def _parcel_image_key(scene, width, height, backend):
+    """
+    Identify the parcel image, if any, with which a pscalar scene is rendered
+    for the result cache, so that calibrating a scene (or recalibrating it, or
+    setting wbplot.config.PARCEL_IMAGES) does not serve stale images.
+    """
+    if backend == 'numpy':  # derived from the templates, already in the key
+        return None
+    renderer = _parcel_renderer(scene, width, height, backend)
+    return None if renderer is None else renderer.digest()
+
+
+def _write_pscalars(render_dir, pscalars, cmap, vrange, norm='linear'):
+    """
+    Write `pscalars` to the neuroimaging file which is pre-loaded into the scene
+    file in `render_dir`, and update the colors for each parcel using the file
+    metadata.
+
+    Returns
+    -------
+    str
+        absolute path to the scene file in `render_dir`
+
+    """
+    temp_cifti = join(render_dir, split(constants.DLABEL_FILE)[1])
+    images.write_parcellated_image(
+        data=pscalars, fout=temp_cifti, cmap=cmap, vrange=vrange, norm=norm)
+    return join(render_dir, "Human.scene")
+
+
+def _write_dscalars(render_dir, dscalars, palette, palette_params):
+    """
+    Write `dscalars` to the neuroimaging file which is pre-loaded into the scene
+    file in `render_dir` & update color palette.
+
+    Returns
+    -------
+    str
+        absolute path to the scene file in `render_dir`
+
+    """
+    temp_cifti = join(render_dir, split(constants.DSCALAR_FILE)[1])
     images.write_dense_image(
         dscalars=dscalars, fout=temp_cifti, palette=palette,
         palette_params=palette_params)
+    return join(render_dir, "Human.scene")
 
-    # This is just to prevent error messages written to console because
-    # ImageParcellated.dlabel.nii doesn't exist in the scene directory
-    dlabel_out = join(temp_dir, split(constants.DLABEL_FILE)[1])
-    if 'windows' in platform.system().lower():
-        cmd = f'xcopy /I {constants.DLABEL_FILE} {dlabel_out}'
-    else:
-        cmd = "cp {} {}".format(constants.DLABEL_FILE, dlabel_out)
-    system(cmd)
-
-    # Now copy the scene file & HumanCorticalParcellations directory to the
-    # temp directory as well
-    with ZipFile(config.SCENE_ZIP_FILE, "r") as z:  # unzip to temp dir
-        z.extractall(temp_dir)
-    scene_file = join(temp_dir, "Human.scene")
-    if not exists(scene_file):
-        raise RuntimeError(
-            "scene file was not successfully copied to {}".format(scene_file))
 
-    scene, width, height = plots.map_params_to_scene(
-        dtype='dscalars', orientation=orientation, hemisphere=hemisphere)
+def _check_file_out(file_out):
+    """Append the .png extension to `file_out` if it was not provided."""
+    if not isinstance(file_out, str):  # file-like object or None
+        return file_out
+    if file_out[-4:] != ".png":  # TODO: improve input handling
+        file_out += ".png"
+    return file_out
 
-    cmd = 'wb_command -show-scene "{}" {} "{}" {} {}'.format(
-        scene_file, scene, file_out, width, height)
-    # cmd += " >/dev/null 2>&1"
-    system(cmd)
 
-    if transparent:
+def _pair_outputs(files_out, maps):
+    """
+    Pair each output filename with one map from `maps`.
+
+    Parameters
+    ----------
+    files_out : sequence of str
+        output filenames
+    maps : numpy.ndarray or iterable of numpy.ndarray
+        a two-dimensional array is iterated over its rows
+
+    Yields
+    ------
+    (str, numpy.ndarray)
+
+    Raises
+    ------
+    ValueError : number of maps does not match number of output files
+
+    """
+    files_out = list(files_out)
+    if isinstance(maps, np.ndarray):
+        if maps.ndim != 2:
+            raise ValueError(
+                "maps must be a two-dimensional array with one map per row"
+                "\nshape: {}".format(maps.shape))
+        if maps.shape[0] != len(files_out):
+            raise ValueError(
+                "got {} maps but {} output files".format(
+                    maps.shape[0], len(files_out)))
+    n = 0
+    for data in maps:
+        if n == len(files_out):
+            raise ValueError("got more maps than output files")
+        yield files_out[n], data
+        n += 1
+    if n != len(files_out):
+        raise ValueError(
+            "got {} maps but {} output files".format(n, len(files_out)))
+
+
+def _make_transparent(file_out):
+    """Make the white pixels of image file `file_out` transparent."""
+    with profiling.stage('postprocess'):
         plots.make_transparent(file_out)
+        profiling.add_file(file_out)
+
+
+def _show_scene(scene_file, scene, file_out, width, height):
+    """
+    Call Connectome Workbench to render `scene` to image `file_out`.
+
+    Raises
+    ------
+    WorkbenchError : wb_command failed or timed out
+
+    """
+    workbench.run(
+        ['-show-scene', scene_file, scene, file_out, width, height])